@@ -0,0 +1,138 @@
+"""
+array backed in memory tournament bracket
+"""
+
+import numpy as np
+
+from .models import Match
+from .rps import round_size, total_rounds, match_slot, match_slots
+
+
+class Bracket(object):
+    def __init__(self, total: int):
+        self.total = total
+        self.size = round_size(total, 0)
+        self.rounds = total_rounds(total)
+        self.dtype = np.int32 if total < 2 ** 31 else np.int64
+
+        # winner fid for each round and slot, 0 while unresolved
+        self.winners = [np.zeros(self.size >> (r + 1), dtype=self.dtype) for r in range(self.rounds)]
+        # round each fid was eliminated in, -1 while still alive (index 0 unused)
+        self.eliminated = np.full(total + 1, -1, dtype=np.int16)
+        self.eliminated[0] = 0
+        self.remaining = total
+
+    @classmethod
+    def from_matches(cls, total: int, matches: list[Match]):
+        bracket = cls(total)
+        for m in sorted(matches, key=lambda m: m.round):
+            if m.winner is not None:
+                bracket.set_winner(m.round, m.slot, m.winner, m.loser)
+        return bracket
+
+    # ---- slot math ----
+
+    def round_size(self, round_: int) -> int:
+        if round_ < 0:
+            raise ValueError(f'invalid round: {round_}')
+        if round_ >= self.rounds:
+            return 1
+        return self.size >> round_
+
+    def slot(self, fid: int, round_: int) -> int:
+        return match_slot(self.total, round_, fid)
+
+    def slots(self, fids: np.ndarray, round_: int) -> np.ndarray:
+        return match_slots(self.total, round_, fids)
+
+    def parents(self, round_: int, slot: int) -> (int, int):
+        self._check_slot(round_, slot)
+        if round_ < 1:
+            raise ValueError(f'invalid round: {round_}')
+        return slot, self.round_size(round_) - slot - 1
+
+    def parents_many(self, round_: int, slots: np.ndarray) -> (np.ndarray, np.ndarray):
+        slots = np.asarray(slots, dtype=np.int64)
+        self._check_slots(round_, slots)
+        if round_ < 1:
+            raise ValueError(f'invalid round: {round_}')
+        return slots, self.round_size(round_) - slots - 1
+
+    # ---- users ----
+
+    def users(self, round_: int, slot: int) -> (int, int):
+        # users in a match slot, 0 if a bye or not yet decided
+        self._check_slot(round_, slot)
+        if round_ == 0:
+            fid1 = self.size - slot
+            return slot + 1, fid1 if fid1 <= self.total else 0
+        a, b = self.parents(round_, slot)
+        prev = self.winners[round_ - 1]
+        return int(prev[a]), int(prev[b])
+
+    def users_many(self, round_: int, slots: np.ndarray) -> (np.ndarray, np.ndarray):
+        slots = np.asarray(slots, dtype=np.int64)
+        self._check_slots(round_, slots)
+        if round_ == 0:
+            fid1 = self.size - slots
+            fid1[fid1 > self.total] = 0
+            return slots + 1, fid1
+        a, b = self.parents_many(round_, slots)
+        prev = self.winners[round_ - 1]
+        return prev[a], prev[b]
+
+    def winner(self, round_: int, slot: int) -> int:
+        self._check_slot(round_, slot)
+        return int(self.winners[round_][slot])
+
+    def set_winner(self, round_: int, slot: int, fid: int, loser: int = None):
+        self._check_slot(round_, slot)
+        if loser is None:
+            u0, u1 = self.users(round_, slot)
+            if fid not in {u0, u1}:
+                raise ValueError(f'invalid winner {fid} for round {round_} slot {slot}')
+            loser = u1 if fid == u0 else u0
+        self.winners[round_][slot] = fid
+        if loser > 0 and self.eliminated[loser] < 0:
+            self.eliminated[loser] = round_
+            self.remaining -= 1
+
+    def set_winners(self, round_: int, slots: np.ndarray, fids: np.ndarray):
+        slots = np.asarray(slots, dtype=np.int64)
+        fids = np.asarray(fids, dtype=np.int64)
+        u0, u1 = self.users_many(round_, slots)
+        if np.any((fids != u0) & (fids != u1)):
+            raise ValueError(f'invalid winners for round {round_}')
+        losers = np.where(fids == u0, u1, u0)
+        losers = losers[(losers > 0) & (self.eliminated[losers] < 0)]
+        self.winners[round_][slots] = fids
+        self.eliminated[losers] = round_
+        self.remaining -= len(np.unique(losers))
+
+    # ---- elimination ----
+
+    def alive(self, fid: int) -> bool:
+        return bool(self.eliminated[fid] < 0)
+
+    def alive_many(self, fids: np.ndarray) -> np.ndarray:
+        return self.eliminated[np.asarray(fids, dtype=np.int64)] < 0
+
+    def alive_fids(self) -> np.ndarray:
+        return np.flatnonzero(self.eliminated < 0)
+
+    def champion(self) -> int:
+        if not self.rounds or not self.winners[-1][0]:
+            return None
+        return int(self.winners[-1][0])
+
+    def _check_slot(self, round_: int, slot: int):
+        if round_ < 0 or round_ >= self.rounds:
+            raise ValueError(f'invalid round: {round_}')
+        if slot < 0 or slot >= self.round_size(round_) // 2:
+            raise ValueError(f'slot too high: {slot}, round size: {self.round_size(round_)}')
+
+    def _check_slots(self, round_: int, slots: np.ndarray):
+        if round_ < 0 or round_ >= self.rounds:
+            raise ValueError(f'invalid round: {round_}')
+        if np.any(slots < 0) or np.any(slots >= self.round_size(round_) // 2):
+            raise ValueError(f'invalid slots for round size: {self.round_size(round_)}')
@@ -0,0 +1,153 @@
+"""
+in process and on disk caching utilities
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .log import get_logger
+
+log = get_logger(__name__)
+
+
+class LRUCache(object):
+    def __init__(self, maxsize: int = 1024, ttl: float = None, maxbytes: int = None, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()  # key -> (expiry, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expiry, _, value = item
+            if expiry is not None and expiry < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expiry = time.monotonic() + ttl if ttl is not None else None
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return  # would never fit
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (expiry, size, value)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                _, (_, sz, _) = self._data.popitem(last=False)
+                self.nbytes -= sz
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._remove(key)
+        return default if item is None else item[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+        return item
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache(object):
+    def __init__(self, directory: str = None, maxbytes: int = None):
+        # the directory may be shared with other processes, so the byte count is an estimate between scans and
+        # eviction goes by file mtime, which reads refresh
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'rps-cache')
+        self.maxbytes = maxbytes
+        self.nbytes = None  # unknown until the first scan
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        h = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, h[:2], h)
+
+    def get(self, key: str) -> bytes:
+        p = self.path(key)
+        try:
+            with open(p, 'rb') as f:
+                b = f.read()
+            if self.maxbytes is not None:
+                os.utime(p)
+            return b
+        except OSError:
+            return None
+
+    def set(self, key: str, value: bytes):
+        # write to temp file then atomically move into place so readers never see partial data
+        p = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(p))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, p)
+        except OSError as e:
+            log.warning('failed to write disk cache', path=p, error=e)
+            return
+        if self.maxbytes is not None:
+            with self._lock:
+                if self.nbytes is not None:
+                    self.nbytes += len(value)
+                if self.nbytes is None or self.nbytes > self.maxbytes:
+                    self._evict()
+
+    def pop(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # rescan the directory, then drop least recently used files down to 90% of the budget
+        files = []
+        for d in os.scandir(self.directory):
+            if not d.is_dir():
+                continue
+            for f in os.scandir(d.path):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, f.path))
+        self.nbytes = sum(f[1] for f in files)
+        if self.nbytes <= self.maxbytes:
+            return
+        target = self.maxbytes * 0.9
+        removed = 0
+        for _, size, path in sorted(files):
+            if self.nbytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.nbytes -= size
+            removed += 1
+        log.info('evicted disk cache', directory=self.directory, files=removed, nbytes=self.nbytes)
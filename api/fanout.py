@@ -0,0 +1,17 @@
+"""
+thread pool fan-out for independent calls within one request
+"""
+
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# storage and upstream calls go through pooled sync clients, submit them here so a view can run several at once
+STORAGE_WORKERS = int(os.getenv('STORAGE_WORKERS', 32))
+_executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix='storage')
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    # carry request context (timings, logging) over to the worker thread
+    ctx = contextvars.copy_context()
+    return _executor.submit(ctx.run, fn, *args, **kwargs)
@@ -2,17 +2,29 @@
 main entry point for rock paper scissors app
 """
 # lib
+import os
 import json
 import time
+import httpx
 from flask import Flask, render_template, url_for, request, make_response, jsonify
 
 # src
-from .warpcast import get_user
+from .warpcast import get_users
 from .neynar import validate_message_or_mock
-from .storage import get_supabase, get_current_tournament, get_tournament, get_match
+from .storage import (
+    get_backend,
+    reset_supabase,
+    get_current_tournament,
+    get_tournament,
+    get_match,
+    invalidate_tournament,
+    publish_invalidation
+)
+from .fanout import submit
+from .metrics import start_timings, current_timings, get_histograms
+from .log import get_logger, start_request, current_request
 from .models import FrameMessage, Gesture, MatchState, MatchStatus, MessageCode, Result, Tournament
 from .rps import (
-    get_round_settled,
     current_round,
     current_round_end,
     round_size,
@@ -21,15 +33,39 @@ from .rps import (
     get_match_user_last,
     get_match_state,
     get_match_slot,
+    RoundNotReady,
     submit_move,
-    remaining_users,
     update_match_result,
-    ROUND_BUFFER,
+    advance_round,
+    settle_round,
+    get_tournament_state,
+    refresh_tournament_state,
     get_final_bracket
 )
-from .render import render_home, render_match, render_message, render_bracket
+from .render import (
+    render_home,
+    render_match_base,
+    render_countdown,
+    render_message,
+    render_bracket,
+    home_render_key,
+    match_render_key,
+    match_base_key,
+    bracket_render_key,
+    replayable,
+    render_key,
+    get_render,
+    set_render,
+    content_type,
+    pfp_urls,
+    get_pfps
+)
+from .prerender import prerender_round, PRERENDER_WORKERS
 
 app = Flask(__name__)
+log = get_logger(__name__)
+
+PROFILE_TIMEOUT = 5  # fall back to placeholder profiles instead of failing a render
 
 
 class BadRequest(Exception):
@@ -43,12 +79,59 @@ def handle_invalid_usage(e):
     return response
 
 
+@app.errorhandler(RoundNotReady)
+def handle_round_not_ready(e):
+    # the round job has not materialized this round yet, retry shortly
+    response = jsonify({'status_code': 503, 'message': str(e)})
+    response.status_code = 503
+    response.headers.set('Retry-After', '30')
+    return response
+
+
+@app.errorhandler(httpx.TransportError)
+def handle_storage_connection(e):
+    # drop pooled client so the next request reconnects
+    log.error('storage connection error', error=e)
+    reset_supabase()
+    response = jsonify({'status_code': 503, 'message': 'storage unavailable'})
+    response.status_code = 503
+    return response
+
+
+@app.before_request
+def before_request():
+    start_request()
+    start_timings()
+
+
+@app.after_request
+def after_request(response):
+    # expose stage durations, e.g. image render stages, to browser devtools and tracing
+    timings = current_timings()
+    if timings is not None and timings.stages:
+        response.headers['Server-Timing'] = timings.server_timing()
+
+    # one summary record per request
+    ctx = current_request()
+    if ctx is not None:
+        log.info(
+            'request',
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code,
+            ms=round((time.perf_counter() - ctx.start) * 1000, 2),
+            stages={k: round(v, 2) for k, v in timings.stages.items()} if timings is not None else {}
+        )
+    return response
+
+
 # ---- core frame views ----
 
 @app.route('/', methods=['GET', 'POST'])
 def home():
     # tournament status home page
-    s = get_supabase()
+    s = get_backend()
     t = get_current_tournament(s)
 
     response = make_response(render_template(
@@ -78,11 +161,11 @@ def match():
 
     # parse action message
     msg = FrameMessage(**json.loads(request.data))
-    print(msg)
+    log.debug('match request', msg=msg)
 
     # tournament state
     now = time.time()
-    s = get_supabase()
+    s = get_backend()
     t = get_current_tournament(s)
     r = current_round(int(t.start.timestamp()), int(now))
     end = current_round_end(int(t.start.timestamp()), r)
@@ -97,7 +180,7 @@ def match():
         ), 200
 
     if msg.untrustedData.fid > t.size:
-        print(f'fid {msg.untrustedData.fid} not competing')
+        log.info('fid not competing', fid=msg.untrustedData.fid)
         return render_template(
             'frame.html',
             title='not entered',
@@ -107,11 +190,10 @@ def match():
         ), 200
 
     m, state = get_match_user(s, int(now), t.id, t.size, r, msg.untrustedData.fid)
-    print(m)
-    print(state)
+    log.debug('user match', match=m, state=state)
     if m is None:
         m = get_match_user_last(s, t.id, msg.untrustedData.fid)
-        print(f'last match {m.id}')
+        log.debug('last match', match=m.id)
         return render_template(
             'frame.html',
             title='your last match',
@@ -123,7 +205,7 @@ def match():
 
     if ((state.status == MatchStatus.USER_0_PLAYED and msg.untrustedData.fid == m.user0)
             or (state.status == MatchStatus.USER_1_PLAYED and msg.untrustedData.fid == m.user1)):
-        print('you played a move waiting on opponent')
+        log.debug('waiting on opponent', match=m.id)
         return render_template(
             'frame.html',
             title='waiting on opponent',
@@ -134,7 +216,7 @@ def match():
         ), 200
 
     elif m.result in {Result.BYE, Result.PLAYED} or state.status == MatchStatus.SETTLED:
-        print(f'settled: {m.result}')
+        log.debug('match settled', match=m.id, result=m.result)
         return render_template(
             'frame.html',
             title='match settled',
@@ -144,8 +226,8 @@ def match():
             button1='\U0001F519'  # back
         ), 200
 
-    elif state.status == MatchStatus.DRAW and (end - now) < ROUND_BUFFER:
-        print(f'draw in buffer window: {state}')
+    elif state.status == MatchStatus.DRAW and not replayable(end - int(now)):
+        log.debug('draw in buffer window', state=state)
         return render_template(
             'frame.html',
             title='match draw',
@@ -172,11 +254,11 @@ def match():
 @app.route('/move', methods=['POST'])
 def move():
     msg = FrameMessage(**json.loads(request.data))
-    print(msg)
+    log.debug('move request', msg=msg)
 
     # verify game state (turn unplayed)
     now = time.time()
-    s = get_supabase()
+    s = get_backend()
     t = get_current_tournament(s)
     r = current_round(int(t.start.timestamp()), int(now))
     end = current_round_end(int(t.start.timestamp()), r)
@@ -191,7 +273,7 @@ def move():
     m, state = get_match_user(s, int(now), t.id, t.size, r, msg.untrustedData.fid)
     if m is None:
         raise BadRequest(f'fid {msg.untrustedData.fid} has been eliminated')
-    print(state)
+    log.debug('move state', state=state)
 
     if state.status == MatchStatus.SETTLED:
         raise BadRequest(f'match {m.id} already settled, winner {m.winner}')
@@ -200,7 +282,7 @@ def move():
             or (state.status == MatchStatus.USER_1_PLAYED and msg.untrustedData.fid == m.user1)):
         raise BadRequest(f'{msg.untrustedData.fid} already played a move for match {m.id} turn {state.turn}')
 
-    elif state.status == MatchStatus.DRAW and (end - now) < ROUND_BUFFER:
+    elif state.status == MatchStatus.DRAW and not replayable(end - int(now)):
         raise BadRequest(f'cannot start a new turn {state.turn} for match {m.id} inside of round buffer window {now}')
 
     # authenticate action here
@@ -209,10 +291,13 @@ def move():
         raise BadRequest(f'invalid message! {msg.model_dump_json()}')
 
     g = Gesture(action.tapped_button.index)
-    print(f'played: {g}')
+    log.debug('move played', match=m.id, fid=action.interactor.fid, gesture=g)
 
     # submit action
-    submit_move(s, int(now), m.id, action.interactor.fid, state.turn, g, msg.trustedData.messageBytes)
+    try:
+        submit_move(s, int(now), m.id, action.interactor.fid, state.turn, g, msg.trustedData.messageBytes)
+    except ValueError as e:
+        raise BadRequest(str(e))
 
     return render_template(
         'frame.html',
@@ -243,7 +328,7 @@ def _validate_slot(now: int, tournament: Tournament, round_: int, slot: int):
 def spectate(tournament: int, round_: int, slot: int):
     # validate match slot
     now = time.time()
-    s = get_supabase()
+    s = get_backend()
     t = get_tournament(s, tournament)
     if t is None:
         raise BadRequest(f'invalid tournament {tournament}')
@@ -268,7 +353,7 @@ def spectate(tournament: int, round_: int, slot: int):
 
 @app.route('/bracket', methods=['GET', 'POST'])
 def bracket():
-    s = get_supabase()
+    s = get_backend()
     t = get_current_tournament(s)
 
     response = make_response(render_template(
@@ -286,11 +371,28 @@ def bracket():
 
 
 # ---- json info endpoints ----
+@app.route('/tournament/<int:tournament>', methods=['GET'])
+def info_get_tournament(tournament: int):
+    now = time.time()
+    s = get_backend()
+    t = get_tournament(s, tournament)
+    r = current_round(int(t.start.timestamp()), int(now))
+    if r < 0:
+        return jsonify({'msg': 'tournament not started', 'tournament': t.model_dump(mode='json')})
+
+    state = get_tournament_state(s, int(now), t, r)
+    return jsonify({
+        'msg': f'tournament {t.id} round {state.round}',
+        'tournament': t.model_dump(mode='json'),
+        'state': state.model_dump(mode='json')
+    })
+
+
 @app.route('/match/<int:fid>', methods=['GET'])
 def info_get_match_fid(fid: int):
     # tournament state
     now = time.time()
-    s = get_supabase()
+    s = get_backend()
     t = get_current_tournament(s)
     r = current_round(int(t.start.timestamp()), int(now))
 
@@ -317,7 +419,7 @@ def info_get_match_fid(fid: int):
 def info_get_match_slot(tournament: int, round_: int, slot: int):
     # validate match slot
     now = time.time()
-    s = get_supabase()
+    s = get_backend()
     t = get_tournament(s, tournament)
     if t is None:
         raise BadRequest(f'invalid tournament {tournament}')
@@ -336,13 +438,123 @@ def info_get_match_slot(tournament: int, round_: int, slot: int):
     })
 
 
+@app.route('/stats/render', methods=['GET'])
+def info_render_stats():
+    # per worker histograms of render stage durations
+    return jsonify({'msg': 'render stage timings (ms)', 'stages': get_histograms()})
+
+
+# ---- scheduled job endpoints ----
+
+def _authorize_job():
+    # vercel cron sends the project CRON_SECRET as a bearer token
+    secret = os.getenv('CRON_SECRET')
+    if not secret or request.headers.get('Authorization') != f'Bearer {secret}':
+        raise BadRequest('unauthorized')
+
+
+@app.route('/jobs/settle/<int:tournament>/<int:round_>', methods=['GET', 'POST'])
+def job_settle(tournament: int, round_: int):
+    _authorize_job()
+    now = time.time()
+    s = get_backend()
+    t = get_tournament(s, tournament)
+    r = current_round(int(t.start.timestamp()), int(now))
+    try:
+        report = settle_round(s, int(now), t.id, r, round_)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    refresh_tournament_state(s, int(now), t, r)
+    return jsonify(report)
+
+
+@app.route('/jobs/round', methods=['GET', 'POST'])
+def job_round():
+    # run at current_round_end, settle the round that just finished and materialize the next one
+    _authorize_job()
+    invalidate_tournament()
+    now = time.time()
+    s = get_backend()
+    t = get_current_tournament(s)
+    r = current_round(int(t.start.timestamp()), int(now))
+    if r < 0:
+        return jsonify({'msg': 'tournament not started'})
+
+    report = {'tournament': t.id, 'round': r}
+    if r > 0 and round_size(t.size, r - 1) >= 2:
+        report['settle'] = settle_round(s, int(now), t.id, r, r - 1)
+    if round_size(t.size, r) >= 2:
+        t0 = time.perf_counter()
+        created = advance_round(s, int(now), t.id, t.size, r, r)
+        report['advance'] = {'created': len(created), 'total_s': round(time.perf_counter() - t0, 4)}
+    report['state'] = refresh_tournament_state(s, int(now), t, r).model_dump(mode='json')
+    if PRERENDER_WORKERS and round_size(t.size, r) >= 2:
+        report['prerender'] = prerender_round(s, int(now), t, r)
+    return jsonify(report)
+
+
+@app.route('/jobs/prerender/<int:tournament>/<int:round_>', methods=['GET', 'POST'])
+def job_prerender(tournament: int, round_: int):
+    # render every match image of the round ahead of player requests
+    _authorize_job()
+    now = time.time()
+    s = get_backend()
+    t = get_tournament(s, tournament)
+    if t is None:
+        raise BadRequest(f'invalid tournament {tournament}')
+    return jsonify(prerender_round(s, int(now), t, round_, workers=max(1, PRERENDER_WORKERS)))
+
+
+@app.route('/jobs/invalidate', methods=['GET', 'POST'])
+def job_invalidate():
+    # drop cached tournament metadata on every worker, e.g. after editing a tournament outside the app
+    _authorize_job()
+    publish_invalidation(get_backend())
+    return jsonify({'msg': 'tournament cache invalidated'})
+
+
 # ---- image rendering endpoints ----
 
+def _image_response(kind: str, key: str, render, max_age: int = None):
+    # serve content addressed render, skipping opencv when unchanged
+    res = _image_cached(kind, key, max_age)
+    if res is None:
+        b = render()
+        set_render(key, b)
+        res = _image_bytes(kind, key, b, max_age)
+    return res
+
+
+def _image_cached(kind: str, key: str, max_age: int = None):
+    if request.if_none_match.contains(key):
+        res = make_response('', 304)
+    else:
+        b = get_render(key)
+        if b is None:
+            return None
+        res = make_response(b)
+        res.headers.set('Content-Type', content_type(kind))
+    res.set_etag(key)
+    if max_age is not None:
+        res.cache_control.max_age = max_age
+    return res
+
+
+def _image_bytes(kind: str, key: str, b: bytes, max_age: int = None):
+    # content type follows the configured encoding for the endpoint, urls keep their .png suffix
+    res = make_response(b)
+    res.headers.set('Content-Type', content_type(kind))
+    res.set_etag(key)
+    if max_age is not None:
+        res.cache_control.max_age = max_age
+    return res
+
+
 @app.route('/render/tournament/<int:tournament>/im.png')
 @app.route('/render/tournament/<int:tournament>/<int:timestamp>/im.png')
 def home_image(tournament: int, timestamp: int = None):
-    print(f'requesting image render for tournament {tournament} {timestamp}')
-    s = get_supabase()
+    log.debug('render tournament image', tournament=tournament, timestamp=timestamp)
+    s = get_backend()
     t = get_tournament(s, tournament)
     if t is None:
         raise BadRequest(f'invalid tournament {tournament}')
@@ -361,27 +573,31 @@ def home_image(tournament: int, timestamp: int = None):
         r_settled = 0
         remaining = 1
     else:
-        r_settled = get_round_settled(s, t.id, r)
-        remaining = remaining_users(t.size, r, r_settled)
+        state = get_tournament_state(s, int(now), t, r)
+        r_settled = state.settled
+        remaining = state.remaining
     prize = '500k $DEGEN'  # TODO get bounty live
-    print(f'tournament {tournament}, size {t.size}, round {r}, settled {r_settled}, remaining {remaining}')
+    log.debug('tournament image state', tournament=tournament, size=t.size, round=r, settled=r_settled,
+              remaining=remaining)
 
     # render image
-    res = make_response(render_home(t.id, t.size, r, prize, remaining))
-    res.headers.set('Content-Type', 'image/png')
-    res.cache_control.max_age = 900
-    return res
+    return _image_response(
+        'home',
+        home_render_key(t.id, t.size, r, prize, remaining),
+        lambda: render_home(t.id, t.size, r, prize, remaining),
+        max_age=900
+    )
 
 
 @app.route('/render/match/<int:tournament>/<int:round_>/<int:slot>/<int:turn>/<int:user>/<int:status>/im.png')
 def match_image(tournament: int, round_: int, slot: int, turn: int, user: int, status: int):
-    # get match
+    # get tournament and match concurrently
     now = time.time()
-    s = get_supabase()
-    t = get_tournament(s, tournament)
+    s = get_backend()
+    t, m = submit(get_tournament, s, tournament), submit(get_match, s, tournament, round_, slot)
+    t, m = t.result(), m.result()
     if t is None:
         raise BadRequest(f'invalid tournament {tournament}')
-    m = get_match(s, tournament, round_, slot)
     if m is None:
         raise BadRequest(f'invalid match {tournament} {round_} {slot}')
     if user == 0:
@@ -393,21 +609,33 @@ def match_image(tournament: int, round_: int, slot: int, turn: int, user: int, s
     else:
         raise BadRequest(f'invalid user {m.id} {user}')
 
-    # get match state (with lazy scoring)
+    # get match state (with lazy scoring) alongside user info
     status = MatchStatus(status)
+    users = submit(get_users, [m.user0, m.user1] if m.user1 > 0 else [m.user0], timeout=PROFILE_TIMEOUT)
     m, state = update_match_result(s, int(now), round_, m)
+    users = users.result()
     if state is None:
         state = get_match_state(s, m)
     end = current_round_end(int(t.start.timestamp()), round_)
-
-    # get user info
-    u0 = get_user(m.user0)
-    u1 = get_user(m.user1) if m.user1 > 0 else None
-
-    # render image
-    res = make_response(render_match(m, u0 if u else u1, u1 if u else u0, round_, state, end - int(now)))
-    res.headers.set('Content-Type', 'image/png')
-    return res
+    u0 = users[m.user0]
+    u1 = users.get(m.user1)
+
+    # render image, profile pictures only needed when the base image without the countdown is missing too
+    user, opponent = (u0, u1) if u else (u1, u0)
+    remaining = end - int(now)
+    key = match_render_key(m, user, opponent, round_, state, remaining)
+    res = _image_cached('match', key)
+    if res is not None:
+        return res
+    base_key = match_base_key(m, user, opponent, round_, state, remaining)
+    base = get_render(base_key)
+    if base is None:
+        pfps = get_pfps(pfp_urls(user, opponent))
+        base = render_match_base(m, user, opponent, round_, state, remaining, pfps=pfps)
+        set_render(base_key, base)
+    b = render_countdown(base, remaining)
+    set_render(key, b)
+    return _image_bytes('match', key, b)
 
 
 @app.route('/render/message/<int:code>/im.png')
@@ -415,22 +643,24 @@ def message_image(code: int):
     # render image
     msg = MessageCode(code)
     if msg == MessageCode.NOT_STARTED:
-        b = render_message(line0='The tournament has not started yet.', line1='Check back soon!')
+        line0, line1 = 'The tournament has not started yet.', 'Check back soon!'
     elif msg == MessageCode.NOT_ENTERED:
-        b = render_message(line0='You were not entered in this tournament.', line1='Check back soon!')
+        line0, line1 = 'You were not entered in this tournament.', 'Check back soon!'
     else:
         raise BadRequest(f'invalid msg {msg}')
 
     # response
-    res = make_response(b)
-    res.headers.set('Content-Type', 'image/png')
-    return res
+    return _image_response(
+        'message',
+        render_key('message', line0, line1),
+        lambda: render_message(line0=line0, line1=line1)
+    )
 
 
 @app.route('/render/bracket/<int:tournament>/im.png')
 def bracket_image(tournament: int):
     # get tournament
-    s = get_supabase()
+    s = get_backend()
     t = get_tournament(s, tournament)
     if t is None:
         raise BadRequest(f'invalid tournament {tournament}')
@@ -441,17 +671,16 @@ def bracket_image(tournament: int):
     bracket_matches = get_final_bracket(s, t.id, t.size)
 
     # get user profiles
-    users = {}
+    fids = []
     for _, bracket_round in bracket_matches.items():
         for _, m in bracket_round.items():
-            if m.user0 not in users:
-                users[m.user0] = get_user(m.user0)
-            if m.user1 not in users:
-                users[m.user1] = get_user(m.user1)
+            fids.extend([m.user0, m.user1])
+    users = get_users(fids, timeout=PROFILE_TIMEOUT)
 
     # render image
-    res = make_response(render_bracket(bracket_matches, users, r))
-    res.headers.set('Content-Type', 'image/png')
-    res.cache_control.max_age = 300
-
-    return res
+    return _image_response(
+        'bracket',
+        bracket_render_key(bracket_matches, users, r),
+        lambda: render_bracket(bracket_matches, users, r),
+        max_age=300
+    )
@@ -0,0 +1,162 @@
+"""
+durable move buffer for buffered move ingestion, shared by the worker processes on a host
+"""
+
+import os
+import time
+import fcntl
+import atexit
+import sqlite3
+import threading
+
+from .models import Move
+from .log import get_logger
+
+log = get_logger(__name__)
+
+JOURNAL_SCHEMA = '''
+create table if not exists move_buffer (
+    id text primary key,
+    "match" text not null,
+    body text not null,
+    created real not null,
+    flushed integer not null default 0
+);
+create index if not exists move_buffer_pending on move_buffer ("match") where flushed = 0;
+'''
+
+
+class MoveJournal(object):
+    def __init__(
+            self,
+            path: str,
+            write,
+            flush_size: int = 500,
+            flush_interval: float = 1.0,
+            retain: float = 2 * 86400
+    ):
+        # every worker on the host opens the same sqlite file, so a move id is claimed once for all of them at
+        # accept time and pending moves are visible to every reader. written rows are kept for retain seconds to
+        # keep rejecting their ids. write(moves) must be idempotent on move id, a crash between write and marking
+        # rows flushed writes them again, and returns any moves that conflicted with a different stored row
+        self.path = path
+        self.write = write
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('pragma journal_mode=wal')
+        self._conn.execute('pragma synchronous=full')  # an acknowledged move survives power loss
+        self._conn.executescript(JOURNAL_SCHEMA)
+        self._flusher = open(path + '.lock', 'a')  # one flushing worker at a time
+        if len(self):
+            log.info('replayed moves from journal', moves=len(self), path=path)
+            self._start()
+
+    def append(self, move: Move):
+        # durably accept a move, raise on duplicate id from any worker
+        try:
+            with self._lock:
+                self._conn.execute(
+                    'insert into move_buffer (id, "match", body, created) values (?, ?, ?, ?)',
+                    (move.id, move.match, move.model_dump_json(), time.time())
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f'duplicate move {move.id}')
+        self._start()
+        if len(self) >= self.flush_size:
+            self._wake.set()
+
+    def pending(self, match_ids: list[str]) -> dict[str, list[Move]]:
+        moves = {}
+        for i in range(0, len(match_ids), 500):
+            batch = match_ids[i:i + 500]
+            rows = self._select(
+                f'select body from move_buffer where flushed = 0 and "match" in ({",".join("?" * len(batch))}) '
+                f'order by id', *batch)
+            for (body,) in rows:
+                m = Move.model_validate_json(body)
+                moves.setdefault(m.match, []).append(m)
+        return moves
+
+    def flush(self) -> int:
+        if self._closed:
+            return 0
+        try:
+            fcntl.flock(self._flusher.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return 0  # another worker is flushing
+        try:
+            rows = self._select('select body from move_buffer where flushed = 0 order by created')
+            moves = [Move.model_validate_json(body) for (body,) in rows]
+            if moves:
+                rejected = self.write(moves)
+                if rejected:
+                    # only possible when another host wrote the same id, this buffer covers one host
+                    log.error('rejected duplicate moves', moves=[m.id for m in rejected])
+
+            # moves stay visible in the buffer until written, then are kept only to reject their ids
+            with self._lock:
+                self._conn.execute('begin immediate')
+                try:
+                    for i in range(0, len(moves), 500):
+                        batch = [m.id for m in moves[i:i + 500]]
+                        self._conn.execute(
+                            f'update move_buffer set flushed = 1 where id in ({",".join("?" * len(batch))})', batch)
+                    self._conn.execute(
+                        'delete from move_buffer where flushed = 1 and created < ?', (time.time() - self.retain,))
+                    self._conn.execute('commit')
+                except Exception:
+                    self._conn.execute('rollback')
+                    raise
+            return len(moves)
+        finally:
+            fcntl.flock(self._flusher.fileno(), fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        return self._select('select count(*) from move_buffer where flushed = 0')[0][0]
+
+    def close(self):
+        # release the buffer without flushing, anything pending is flushed by the next worker to open it
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+            self._flusher.close()
+
+    def _select(self, q: str, *params) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(q, params).fetchall()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='move-journal', daemon=True)
+            self._thread.start()
+            atexit.register(self._stop)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                # keep moves buffered, retry next interval
+                log.error('failed to flush moves', error=repr(e))
+                time.sleep(self.flush_interval)
+
+    def _stop(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.error('failed to flush moves on exit, left in journal', path=self.path, error=repr(e))
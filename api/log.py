@@ -0,0 +1,142 @@
+"""
+structured logging with levels, per request sampling and lazy formatting
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import datetime
+import contextvars
+
+LOG_LEVEL = logging.getLevelName((os.getenv('LOG_LEVEL') or 'INFO').upper())
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))  # share of requests that also emit debug records
+LOG_FORMAT = os.getenv('LOG_FORMAT') or 'json'  # json or text
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+_request = contextvars.ContextVar('log_request', default=None)
+
+
+class RequestContext(object):
+    def __init__(self, sampled: bool):
+        self.id = f'{random.getrandbits(48):012x}'
+        self.sampled = sampled
+        self.start = time.perf_counter()
+
+
+class Logger(object):
+    # disabled records return before touching their arguments, so callers can pass models and
+    # %-style args without paying for repr or string formatting
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def enabled(self, level: int) -> bool:
+        if level >= LOG_LEVEL:
+            return True
+        ctx = _request.get()
+        return ctx is not None and ctx.sampled
+
+    def debug(self, msg: str, /, *args, **fields):
+        if self.enabled(DEBUG):
+            self._log(DEBUG, msg, args, fields)
+
+    def info(self, msg: str, /, *args, **fields):
+        if self.enabled(INFO):
+            self._log(INFO, msg, args, fields)
+
+    def warning(self, msg: str, /, *args, **fields):
+        if self.enabled(WARNING):
+            self._log(WARNING, msg, args, fields)
+
+    def error(self, msg: str, /, *args, **fields):
+        if self.enabled(ERROR):
+            self._log(ERROR, msg, args, fields)
+
+    def _log(self, level: int, msg: str, args: tuple, fields: dict):
+        self._logger.log(level, msg, *args, extra={'fields': fields}, stacklevel=3)
+
+
+class StdoutHandler(logging.StreamHandler):
+    # resolve stdout on every write so redirection and test capture apply
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, _):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        body = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        ctx = _request.get()
+        if ctx is not None:
+            body['request'] = ctx.id
+        body.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            body['exc'] = self.formatException(record.exc_info)
+        return json.dumps(body, default=_default)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f'{record.levelname.lower()} {record.name} {record.getMessage()}'
+        fields = getattr(record, 'fields', {})
+        if fields:
+            line += ' ' + ' '.join(f'{k}={_default(v) if not isinstance(v, (int, float, str)) else v}'
+                                   for k, v in fields.items())
+        return line
+
+
+def get_logger(name: str) -> Logger:
+    return Logger(name)
+
+
+def start_request(sampled: bool = None) -> RequestContext:
+    if sampled is None:
+        sampled = random.random() < LOG_SAMPLE_RATE
+    ctx = RequestContext(sampled)
+    _request.set(ctx)
+    return ctx
+
+
+def current_request() -> RequestContext:
+    return _request.get()
+
+
+def configure(level: int = None, fmt: str = None):
+    global LOG_LEVEL
+    if level is not None:
+        LOG_LEVEL = level
+    root = logging.getLogger('api')
+    root.setLevel(DEBUG)  # level filtering happens in Logger.enabled
+    root.propagate = False
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    handler = StdoutHandler()
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == 'json' else TextFormatter())
+    root.addHandler(handler)
+
+
+def _default(v):
+    # pydantic models and enums are only serialized when a record is actually written
+    if hasattr(v, 'model_dump'):
+        return v.model_dump(mode='json')
+    if hasattr(v, 'value') and hasattr(v, 'name'):
+        return v.name
+    return str(v)
+
+
+configure()
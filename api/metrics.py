@@ -0,0 +1,151 @@
+"""
+stage timings, per request and aggregated into histograms
+"""
+
+import time
+import bisect
+import functools
+import threading
+import contextlib
+import contextvars
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram(object):
+    def __init__(self, buckets: tuple = BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is overflow
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        i = bisect.bisect_left(self.buckets, ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += ms
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th observation
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank and c:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.total
+        return {
+            'count': count,
+            'mean_ms': round(total / count, 3) if count else None,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': {str(b): c for b, c in zip(self.buckets + ('inf',), counts)}
+        }
+
+
+class Timings(object):
+    # stage name -> summed milliseconds, stages running concurrently on worker threads are summed
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, ms: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def server_timing(self) -> str:
+        with self._lock:
+            stages = list(self.stages.items())
+        return ', '.join(f'{name};dur={ms:.2f}' for name, ms in stages)
+
+
+_request = contextvars.ContextVar('request_timings', default=None)
+_render = contextvars.ContextVar('render_timings', default=None)
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def start_timings() -> Timings:
+    t = Timings()
+    _request.set(t)
+    return t
+
+
+def current_timings() -> Timings:
+    return _request.get()
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    # inside a render the stage total is observed once when the render ends, otherwise every call is observed
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        render = _render.get()
+        if render is not None:
+            render.add(name, ms)
+        else:
+            observe(name, ms)
+            request = _request.get()
+            if request is not None:
+                request.add(name, ms)
+
+
+def timed_render(kind: str):
+    # decorator, collects stage totals for one render into histograms and the request timings
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            render = Timings()
+            token = _render.set(render)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                _render.reset(token)
+                request = _request.get()
+                for name, stage_ms in render.stages.items():
+                    observe(name, stage_ms)
+                    if request is not None:
+                        request.add(name, stage_ms)
+                observe(f'render_{kind}', ms)
+                if request is not None:
+                    request.add(f'render_{kind}', ms)
+        return wrapper
+    return decorator
+
+
+def observe(name: str, ms: float):
+    h = _histograms.get(name)
+    if h is None:
+        with _histograms_lock:
+            h = _histograms.setdefault(name, Histogram())
+    h.observe(ms)
+
+
+def get_histograms() -> dict:
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {name: h.snapshot() for name, h in sorted(items)}
+
+
+def reset_histograms():
+    with _histograms_lock:
+        _histograms.clear()
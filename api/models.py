@@ -41,6 +41,28 @@ class Match(BaseModel):
     result: Result
 
 
+class Player(BaseModel):
+    id: str
+    tournament: int
+    fid: int
+    match: str
+    round: int
+    alive: bool = True
+    updated: Optional[datetime] = None
+
+
+class RoundStats(BaseModel):
+    id: str
+    tournament: int
+    round: int
+    matches: int = 0
+    pending: int = 0
+    settled: int = 0
+    played: int = 0
+    eliminated: int = 0
+    updated: Optional[datetime] = None
+
+
 class Gesture(Enum):
     ROCK = 1
     PAPER = 2
@@ -189,7 +211,18 @@ class MatchState(BaseModel):
 
 class TournamentState(BaseModel):
     tournament: int
-    # TODO ...
+    size: int
+    rounds: int
+    round: int
+    remaining: int
+    settled: int = 0
+    pending: int = 0
+    winner: Optional[int] = None
+    latest: Optional[str] = None
+    latest_winner: Optional[int] = None
+    latest_loser: Optional[int] = None
+    latest_result: Optional[Result] = None
+    updated: datetime
 
 
 class MessageCode(Enum):
@@ -2,13 +2,38 @@
 methods to call neynar api
 """
 import os
+import hashlib
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .models import FrameMessage, ValidatedMessage, Interactor, Profile, Bio, Button, Input
+from .cache import LRUCache
+from .log import get_logger
+
+log = get_logger(__name__)
+
+NEYNAR_TIMEOUT = float(os.getenv('NEYNAR_TIMEOUT', 5))
+NEYNAR_CACHE_SIZE = int(os.getenv('NEYNAR_CACHE_SIZE', 4096))
+NEYNAR_CACHE_TTL = float(os.getenv('NEYNAR_CACHE_TTL', 600))
+
+# shared keep-alive session and validation cache, clients retry frame posts with identical message bytes
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=8))
+_validated = LRUCache(maxsize=NEYNAR_CACHE_SIZE, ttl=NEYNAR_CACHE_TTL)
 
 
 def get_frame_action(msg: str) -> (bool, ValidatedMessage):
+    # key on the signed bytes themselves, the untrusted message hash could be paired with anything
+    key = hashlib.sha256(msg.encode()).hexdigest()
+    res = _validated.get(key)
+    if res is None:
+        res = fetch_frame_action(msg)
+        _validated.set(key, res)
+    return res
+
+
+def fetch_frame_action(msg: str) -> (bool, ValidatedMessage):
     key = os.getenv('NEYNAR_KEY')
     url = 'https://api.neynar.com/v2/farcaster/frame/validate'
     body = {
@@ -21,15 +46,15 @@ def get_frame_action(msg: str) -> (bool, ValidatedMessage):
         'api_key': key,
         'content-type': 'application/json'
     }
-    res = requests.post(url, json=body, headers=headers)
+    res = _session.post(url, json=body, headers=headers, timeout=NEYNAR_TIMEOUT)
+    res.raise_for_status()
 
     body = res.json()
     if not body['valid']:
         return False, None
 
-    print(body)
     action = ValidatedMessage(**body['action'])
-    print(action)
+    log.debug('validated frame action', action=action)
 
     return True, action
 
@@ -40,15 +65,16 @@ def validate_message(msg: FrameMessage) -> (bool, ValidatedMessage):
         return valid, action
 
     if msg.untrustedData.fid != action.interactor.fid:
-        print(f'fid does not match: {msg.untrustedData.fid} {action.interactor.fid}')
+        log.warning('fid does not match', fid=msg.untrustedData.fid, validated=action.interactor.fid)
         return False, action
 
     if msg.untrustedData.buttonIndex != action.tapped_button.index:
-        print(f'button index does not match: {msg.untrustedData.buttonIndex} {action.tapped_button.index}')
+        log.warning('button index does not match', button=msg.untrustedData.buttonIndex,
+                    validated=action.tapped_button.index)
         return False, action
 
     if msg.untrustedData.inputText is not None and msg.untrustedData.inputText != action.input.text:
-        print(f'text input does not match: {msg.untrustedData.inputText} {action.input.text}')
+        log.warning('text input does not match', text=msg.untrustedData.inputText, validated=action.input.text)
         return False, action
 
     return valid, action
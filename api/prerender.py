@@ -0,0 +1,125 @@
+"""
+pre-render match images for a new round across a process pool
+
+images land in the disk render store under RENDER_CACHE_DIR, which is only shared by the workers of one host. on
+serverless, where every instance has its own /tmp, only the instance that ran the job finds them
+"""
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .models import Tournament, Match, MatchState, User
+from .rps import current_round_end, resolve_match_states
+from .storage import Backend, get_matches_for_round, get_moves_for_matches
+from .warpcast import get_users
+from .cache import DiskCache
+from . import render
+from .render import render_match_base, match_base_key, store_render, has_render, get_pfps, pfp_urls
+from .log import get_logger
+
+log = get_logger(__name__)
+
+PRERENDER_WORKERS = int(os.getenv('PRERENDER_WORKERS', 0))  # run from the round job when set, 1 renders inline
+PRERENDER_CHUNK = 256  # images per worker task
+PROFILE_TIMEOUT = 30
+
+
+def prerender_round(
+        supabase: Backend,
+        now: int,
+        tournament: Tournament,
+        round_: int,
+        workers: int = PRERENDER_WORKERS
+) -> dict:
+    # render every match of the round from both sides into the disk render store, without the countdown so the
+    # base image serves the whole round and a request only draws the countdown on top
+    t0 = time.perf_counter()
+    matches = get_matches_for_round(supabase, tournament.id, round_)
+    moves = get_moves_for_matches(supabase, [m.id for m in matches])
+    states = resolve_match_states(matches, moves)
+
+    # a placeholder profile would key an image no request asks for, leave missing profiles to render on request
+    users = get_users([f for m in matches for f in (m.user0, m.user1) if f > 0], timeout=PROFILE_TIMEOUT,
+                      fallback=False)
+
+    remaining = current_round_end(int(tournament.start.timestamp()), round_) - now
+
+    jobs = []
+    skipped = missed = 0
+    for m, state in zip(matches, states):
+        if isinstance(state, Exception):
+            log.warning('skipping match with invalid state', match=m.id, error=repr(state))
+            continue
+        u0 = users.get(m.user0)
+        u1 = users.get(m.user1)
+        if u0 is None or (m.user1 > 0 and u1 is None):
+            missed += 1
+            continue
+        for user, opponent in [(u0, u1), (u1, u0)]:
+            if user is None:
+                continue  # bye
+            key = match_base_key(m, user, opponent, round_, state, remaining)
+            if has_render(key):
+                skipped += 1
+                continue
+            jobs.append((key, m, user, opponent, round_, state, remaining))
+
+    chunks = [jobs[i:i + PRERENDER_CHUNK] for i in range(0, len(jobs), PRERENDER_CHUNK)]
+    rendered = failed = 0
+    if workers <= 1:
+        for chunk in chunks:
+            n, f = render_chunk(chunk)
+            rendered += n
+            failed += f
+    elif chunks:
+        # spawn so workers never inherit locks held by this process's pool threads
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(render._renders_disk.directory, render._renders_disk.maxbytes)
+        ) as pool:
+            for future in as_completed([pool.submit(render_chunk, chunk) for chunk in chunks]):
+                try:
+                    n, f = future.result()
+                except Exception as e:
+                    log.error('failed to pre-render chunk', error=repr(e))
+                    continue
+                rendered += n
+                failed += f
+
+    report = {
+        'tournament': tournament.id,
+        'round': round_,
+        'matches': len(matches),
+        'rendered': rendered,
+        'skipped': skipped,
+        'missed_profiles': missed,
+        'failed': failed,
+        'workers': workers,
+        'total_s': round(time.perf_counter() - t0, 4)
+    }
+    log.info('pre-rendered round', **report)
+    return report
+
+
+def render_chunk(jobs: list[tuple[str, Match, User, User, int, MatchState, int]]) -> (int, int):
+    # fetch the pictures for the whole chunk at once, then render and store each image
+    pfps = get_pfps(pfp_urls(*[u for j in jobs for u in j[2:4]]))
+    rendered = failed = 0
+    for key, match, user, opponent, round_, state, remaining in jobs:
+        try:
+            b = render_match_base(match, user, opponent, round_, state, remaining, pfps=pfps)
+        except Exception as e:
+            log.warning('failed to pre-render match', match=match.id, fid=user.fid, error=repr(e))
+            failed += 1
+            continue
+        store_render(key, b)
+        rendered += 1
+    return rendered, failed
+
+
+def _init_worker(directory: str, maxbytes: int):
+    render._renders_disk = DiskCache(directory, maxbytes=maxbytes)
@@ -2,95 +2,319 @@
 dynamic image rendering for frames
 """
 
+import os
+import time
+import zlib
+import struct
+import hashlib
 import datetime
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 import cv2
 
 from .models import Tournament, Match, MatchState, MatchStatus, User, Result
 from .rps import ROUND_BUFFER
+from .cache import LRUCache, DiskCache
+from .metrics import stage, timed_render
+from .log import get_logger
+
+log = get_logger(__name__)
 
 FONT = cv2.FONT_HERSHEY_SIMPLEX
 PFP_SZ = 96
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+PFP_CACHE_BYTES = int(os.getenv('PFP_CACHE_BYTES', 64 * 2 ** 20))
+PFP_CACHE_DIR = os.getenv('PFP_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'rps-pfp')
+PFP_CACHE_DISK_BYTES = int(os.getenv('PFP_CACHE_DISK_BYTES', 512 * 2 ** 20))
+PFP_WORKERS = 8
+PFP_TIMEOUT = float(os.getenv('PFP_TIMEOUT', 5))
+RENDER_CACHE_BYTES = int(os.getenv('RENDER_CACHE_BYTES', 128 * 2 ** 20))
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'rps-render')
+RENDER_CACHE_DISK_BYTES = int(os.getenv('RENDER_CACHE_DISK_BYTES', 2 ** 30))
+COUNTDOWN_INTERVAL = 60  # round countdown is rendered at minute resolution so images can be reused
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT') or 'png'  # default encoding for all images, e.g. png:3 or webp:90
+
+# decoded and resized profile pictures, in memory and on disk
+_pfps = LRUCache(maxsize=2 ** 20, maxbytes=PFP_CACHE_BYTES, sizeof=lambda im: im.nbytes)
+_pfps_disk = DiskCache(PFP_CACHE_DIR, maxbytes=PFP_CACHE_DISK_BYTES)
+_pfp_session = requests.Session()
+_pfp_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=PFP_WORKERS))
+_pfp_executor = ThreadPoolExecutor(max_workers=PFP_WORKERS, thread_name_prefix='pfp')
+
+# encoded images keyed by a hash of their render inputs, in memory and pre-rendered on disk
+_renders = LRUCache(maxsize=2 ** 16, maxbytes=RENDER_CACHE_BYTES)
+_renders_disk = DiskCache(RENDER_CACHE_DIR, maxbytes=RENDER_CACHE_DISK_BYTES)
+
+
+class Encoding(object):
+    # output format for rendered images, the meaning of quality depends on the format
+    def __init__(self, fmt: str, quality: int = None):
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown image format {fmt}')
+        self.format = fmt
+        self.content_type, default, lo, hi = FORMATS[fmt]
+        self.quality = default if quality is None else int(quality)
+        if not lo <= self.quality <= hi:
+            raise ValueError(f'{fmt} quality must be between {lo} and {hi}, got {self.quality}')
+
+    @property
+    def spec(self) -> str:
+        return f'{self.format}:{self.quality}'
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Encoding':
+        # format[:quality], e.g. png, png:6, png_palette:64, jpeg:85, webp:101
+        fmt, _, quality = spec.strip().lower().partition(':')
+        return cls(fmt, quality or None)
+
+    def __repr__(self) -> str:
+        return f'Encoding({self.spec})'
+
+
+# format -> content type, default quality, quality range
+FORMATS = {
+    'png': ('image/png', 1, 0, 9),  # zlib compression level
+    'png_palette': ('image/png', 64, 2, 256),  # palette size
+    'jpeg': ('image/jpeg', 90, 0, 100),
+    'webp': ('image/webp', 90, 1, 101),  # 101 is lossless
+}
+KINDS = ['home', 'message', 'match', 'bracket']
+
+# per endpoint encodings, e.g. IMAGE_FORMAT_MATCH=webp:85 overrides IMAGE_FORMAT for match images
+ENCODINGS = {k: Encoding.parse(os.getenv(f'IMAGE_FORMAT_{k.upper()}') or IMAGE_FORMAT) for k in KINDS}
+
+# match images without the countdown, decoded and finished per request so keep them lossless and fast to decode
+BASE_ENCODING = Encoding('png', 1)
+
+
+def get_encoding(kind: str) -> Encoding:
+    return ENCODINGS[kind]
+
+
+def content_type(kind: str) -> str:
+    return ENCODINGS[kind].content_type
+
+
+def encode_image(im: np.ndarray, encoding: Encoding) -> bytes:
+    with stage('encode'):
+        if encoding.format == 'png_palette':
+            return encode_palette_png(im, encoding.quality)
+        if encoding.format == 'png':
+            _, b = cv2.imencode('.png', im, [cv2.IMWRITE_PNG_COMPRESSION, encoding.quality])
+        elif encoding.format == 'jpeg':
+            _, b = cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, encoding.quality])
+        else:
+            _, b = cv2.imencode('.webp', im, [cv2.IMWRITE_WEBP_QUALITY, encoding.quality])
+        return b.tobytes()
+
+
+def quantize(im: np.ndarray, colors: int) -> (np.ndarray, np.ndarray):
+    # bin pixels at 5 bits per channel, the most common bins become the palette (at the color of their first
+    # pixel, exact for flat fills) and every other bin maps to its nearest palette entry
+    flat = im.reshape(-1, 3)
+    q = flat >> 3
+    bins = (q[:, 0].astype(np.int32) << 10) | (q[:, 1].astype(np.int32) << 5) | q[:, 2]
+    counts = np.bincount(bins, minlength=2 ** 15)
+    present = np.flatnonzero(counts)
+    first = np.empty(2 ** 15, dtype=np.int64)
+    first[bins[::-1]] = np.arange(len(bins) - 1, -1, -1)  # last write wins, so this keeps the first pixel
+    samples = flat[first[present]].astype(np.float32)
+    palette = samples[np.argsort(-counts[present], kind='stable')[:colors]]
+    # squared distance without the per sample constant, |p|^2 - 2 s.p
+    dist = (palette ** 2).sum(axis=1)[None, :] - 2 * samples @ palette.T
+    lut = np.zeros(2 ** 15, dtype=np.uint8)
+    lut[present] = dist.argmin(axis=1)
+    return palette.astype(np.uint8), lut[bins].reshape(im.shape[:2])
+
+
+def encode_palette_png(im: np.ndarray, colors: int) -> bytes:
+    # opencv only writes truecolor png, so indexed png chunks are written directly
+    palette, idx = quantize(im, colors)
+    h, w = idx.shape
+    raw = np.zeros((h, w + 1), dtype=np.uint8)  # leading filter byte per row, none
+    raw[:, 1:] = idx
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 3, 0, 0, 0)),
+        _png_chunk(b'PLTE', palette[:, ::-1].tobytes()),  # bgr to rgb
+        _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)),
+        _png_chunk(b'IEND', b'')
+    ])
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+def load_background(name: str) -> np.ndarray:
+    with stage('imread'):
+        im = cv2.imread(os.path.join(STATIC_DIR, name))
+    if im is None:
+        raise Exception(f'failed to load background {name}')
+    im.flags.writeable = False  # shared, renders draw on a copy
+    return im
+
+
+# decoded once per process
+BACKGROUND_TOURNAMENT = load_background('tournament.png')
+BACKGROUND_MATCH = load_background('match.png')
+
 
+@timed_render('home')
+def render_home(tournament: int, total: int, round_: int, prize, remaining: int, encoding: Encoding = None) -> bytes:
+    im = draw_home(tournament, total, round_, prize, remaining)
+    return encode_image(im, encoding or get_encoding('home'))
 
-def render_home(tournament: int, total: int, round_: int, prize, remaining: int) -> bytes:
+
+def draw_home(tournament: int, total: int, round_: int, prize, remaining: int) -> np.ndarray:
     # setup background
-    im = cv2.imread('api/static/tournament.png')
+    with stage('background'):
+        im = BACKGROUND_TOURNAMENT.copy()
 
     # stats
     x = 12
-    im = cv2.putText(im, 'Farcaster rock paper scissors', (x, 30), FONT, 0.7, (0, 0, 0), 2)
-    im = cv2.putText(im, f'tournament {tournament}', (x, 70), FONT, 0.7, (0, 0, 0), 1)
-    im = cv2.putText(im, f'prize {prize}', (x, 100), FONT, 0.7, (0, 0, 0), 1)
-    im = cv2.putText(im, f'round {round_}', (x, 130), FONT, 0.7, (0, 0, 0), 1)
-    im = cv2.putText(im, f'{total} users entered', (x, 160), FONT, 0.7, (0, 0, 0), 1)
-    im = cv2.putText(im, f'{remaining} competitors remain', (x, 190), FONT, 0.7, (0, 0, 0), 1)
+    im = put_text(im, 'Farcaster rock paper scissors', (x, 30), FONT, 0.7, (0, 0, 0), 2)
+    im = put_text(im, f'tournament {tournament}', (x, 70), FONT, 0.7, (0, 0, 0), 1)
+    im = put_text(im, f'prize {prize}', (x, 100), FONT, 0.7, (0, 0, 0), 1)
+    im = put_text(im, f'round {round_}', (x, 130), FONT, 0.7, (0, 0, 0), 1)
+    im = put_text(im, f'{total} users entered', (x, 160), FONT, 0.7, (0, 0, 0), 1)
+    im = put_text(im, f'{remaining} competitors remain', (x, 190), FONT, 0.7, (0, 0, 0), 1)
 
     # message
     im = write_message(im, line0='Welcome to Farcaster rock paper scissors. Click below to play.', line1='Good luck!')
 
-    # encode
-    _, b = cv2.imencode('.png', im)
-    return b.tobytes()
+    return im
+
 
+@timed_render('message')
+def render_message(line0: str = None, line1: str = None, encoding: Encoding = None) -> bytes:
+    return encode_image(draw_message(line0=line0, line1=line1), encoding or get_encoding('message'))
 
-def render_message(line0: str = None, line1: str = None) -> bytes:
+
+def draw_message(line0: str = None, line1: str = None) -> np.ndarray:
     # setup background
-    im = cv2.imread('api/static/tournament.png')
+    with stage('background'):
+        im = BACKGROUND_TOURNAMENT.copy()
 
     # message
     im = write_message(im, line0=line0, line1=line1)
 
-    # encode
-    _, b = cv2.imencode('.png', im)
-    return b.tobytes()
+    return im
 
 
+@timed_render('match')
 def render_match(
         match: Match,
         user: User,
         opponent: User,
         round_: int,
         state: MatchState,
-        remaining: int
+        remaining: int,
+        pfps: dict[str, np.ndarray] = None,
+        encoding: Encoding = None
 ) -> bytes:
+    im = draw_match(match, user, opponent, round_, state, remaining, pfps=pfps)
+    return encode_image(im, encoding or get_encoding('match'))
+
+
+@timed_render('match')
+def render_match_base(
+        match: Match,
+        user: User,
+        opponent: User,
+        round_: int,
+        state: MatchState,
+        remaining: int,
+        pfps: dict[str, np.ndarray] = None
+) -> bytes:
+    im = draw_match_base(match, user, opponent, round_, state, remaining, pfps=pfps)
+    return encode_image(im, BASE_ENCODING)
+
+
+@timed_render('match')
+def render_countdown(base: bytes, remaining: int, encoding: Encoding = None) -> bytes:
+    # finish a base match image with the current countdown
+    with stage('decode'):
+        im = cv2.imdecode(np.frombuffer(base, dtype=np.uint8), cv2.IMREAD_COLOR)
+    im = draw_countdown(im, remaining)
+    return encode_image(im, encoding or get_encoding('match'))
+
+
+def draw_match(
+        match: Match,
+        user: User,
+        opponent: User,
+        round_: int,
+        state: MatchState,
+        remaining: int,
+        pfps: dict[str, np.ndarray] = None
+) -> np.ndarray:
+    im = draw_match_base(match, user, opponent, round_, state, remaining, pfps=pfps)
+    return draw_countdown(im, remaining)
+
+
+def draw_countdown(im: np.ndarray, remaining: int) -> np.ndarray:
+    return put_text(im, f'{datetime.timedelta(seconds=countdown(remaining))}', (510, 35), FONT, 0.3, (0, 0, 0))
+
+
+def draw_match_base(
+        match: Match,
+        user: User,
+        opponent: User,
+        round_: int,
+        state: MatchState,
+        remaining: int,
+        pfps: dict[str, np.ndarray] = None
+) -> np.ndarray:
+    # everything but the countdown, remaining only decides whether a draw can still be replayed
     # setup background
-    im = cv2.imread('api/static/match.png')
+    with stage('background'):
+        im = BACKGROUND_MATCH.copy()
 
     # match data
-    im = cv2.putText(im, f'round {round_}', (510, 15), FONT, 0.3, (0, 0, 0))
-    im = cv2.putText(im, f'turn {state.turn}', (518, 25), FONT, 0.3, (0, 0, 0))
-    im = cv2.putText(im, f'{datetime.timedelta(seconds=max(0, remaining))}', (510, 35), FONT, 0.3, (0, 0, 0))
+    im = put_text(im, f'round {round_}', (510, 15), FONT, 0.3, (0, 0, 0))
+    im = put_text(im, f'turn {state.turn}', (518, 25), FONT, 0.3, (0, 0, 0))
+
+    # fetch both profile pictures concurrently (unless already prefetched)
+    if pfps is None:
+        with stage('pfp'):
+            pfps = get_pfps(pfp_urls(user, opponent))
 
     # player data
     name_user = strip_text(f'{user.displayName:.16s}')
-    im = cv2.putText(im, name_user, (328, 158), FONT, 0.4, (0, 0, 0))
-    im = cv2.putText(im, f'Fid.{user.fid}', (460, 158), FONT, 0.3, (0, 0, 0))
+    im = put_text(im, name_user, (328, 158), FONT, 0.4, (0, 0, 0))
+    im = put_text(im, f'Fid.{user.fid}', (460, 158), FONT, 0.3, (0, 0, 0))
     try:
-        pfp_user = get_pfp(user.pfp.url)
+        pfp_user = pfps[user.pfp.url]
         x = 100
         y = 120
-        im[y:y + PFP_SZ, x:x + PFP_SZ] = pfp_user
+        with stage('paste'):
+            im[y:y + PFP_SZ, x:x + PFP_SZ] = pfp_user
     except Exception as e:
-        print(f'failed to render user pfp {user.fid} {e}')
+        log.warning('failed to render user pfp', fid=user.fid, error=repr(e))
 
     # opponent data
     if opponent is None:
         name_opp = 'BYE'
-        im = cv2.putText(im, 'BYE', (45, 25), FONT, 0.4, (0, 0, 0))
-        im = cv2.putText(im, 'Fid.0', (175, 25), FONT, 0.3, (0, 0, 0))
+        im = put_text(im, 'BYE', (45, 25), FONT, 0.4, (0, 0, 0))
+        im = put_text(im, 'Fid.0', (175, 25), FONT, 0.3, (0, 0, 0))
     else:
         name_opp = strip_text(f'{opponent.displayName:.16s}')
-        im = cv2.putText(im, name_opp, (45, 25), FONT, 0.4, (0, 0, 0))
-        im = cv2.putText(im, f'Fid.{opponent.fid}', (175, 25), FONT, 0.3, (0, 0, 0))
+        im = put_text(im, name_opp, (45, 25), FONT, 0.4, (0, 0, 0))
+        im = put_text(im, f'Fid.{opponent.fid}', (175, 25), FONT, 0.3, (0, 0, 0))
         try:
-            pfp_opp = get_pfp(opponent.pfp.url)
+            pfp_opp = pfps[opponent.pfp.url]
             x = 360
             y = 20
-            im[y:y + PFP_SZ, x:x + PFP_SZ] = pfp_opp
+            with stage('paste'):
+                im[y:y + PFP_SZ, x:x + PFP_SZ] = pfp_opp
         except Exception as e:
-            print(f'failed to render opponent pfp {user.fid} {e}')
+            log.warning('failed to render opponent pfp', fid=opponent.fid, error=repr(e))
 
     # TODO bonus features: health bar, loser drop, gif, emoji render
 
@@ -98,7 +322,7 @@ def render_match(
     if match.result == Result.PENDING:
         if state.status == MatchStatus.DRAW:
             msg = f'Draw! You both played {state.history0[-1].name}.'
-            if remaining > ROUND_BUFFER:
+            if replayable(remaining):
                 msg += ' Make your next move.'
         elif (user.fid == match.user0 and state.status == MatchStatus.USER_0_PLAYED) or (
                 user.fid == match.user1 and state.status == MatchStatus.USER_1_PLAYED):
@@ -175,14 +399,18 @@ def render_match(
     # cv2.waitKey(0)
     # return
 
-    # encode
-    _, b = cv2.imencode('.png', im)
-    return b.tobytes()
+    return im
+
 
+@timed_render('bracket')
+def render_bracket(bracket: dict, users: dict[int, User], round_: int, encoding: Encoding = None) -> bytes:
+    return encode_image(draw_bracket(bracket, users, round_), encoding or get_encoding('bracket'))
 
-def render_bracket(bracket: dict, users: dict[int, User], round_: int) -> bytes:
+
+def draw_bracket(bracket: dict, users: dict[int, User], round_: int) -> np.ndarray:
     # setup background
-    im = cv2.imread('api/static/tournament.png')
+    with stage('background'):
+        im = BACKGROUND_TOURNAMENT.copy()
 
     # draw bracket
     y0 = 20
@@ -208,14 +436,14 @@ def render_bracket(bracket: dict, users: dict[int, User], round_: int) -> bytes:
                 continue
             m: Match = bracket[i][slot]
             name_user0 = strip_text(f'{users[m.user0].displayName:.16s}')
-            im = cv2.putText(im, name_user0, (x + 2, y - 2), FONT, 0.3, (0, 0, 0))
+            im = put_text(im, name_user0, (x + 2, y - 2), FONT, 0.3, (0, 0, 0))
             name_user1 = strip_text(f'{users[m.user1].displayName:.16s}')
-            im = cv2.putText(im, name_user1, (x + 2, y + dy - 2), FONT, 0.3, (0, 0, 0))
+            im = put_text(im, name_user1, (x + 2, y + dy - 2), FONT, 0.3, (0, 0, 0))
 
             # place winners
             if (m.round == round_ or i == 3) and m.winner is not None:
                 name_user = strip_text(f'{users[m.winner].displayName:.16s}')
-                im = cv2.putText(im, name_user, (x + 102, int(y + 0.5 * dy - 2)), FONT, 0.3, (0, 0, 0))
+                im = put_text(im, name_user, (x + 102, int(y + 0.5 * dy - 2)), FONT, 0.3, (0, 0, 0))
 
             # get update message
             if m.round == round_ and (msg is None or m.updated > msg_dt):
@@ -240,16 +468,150 @@ def render_bracket(bracket: dict, users: dict[int, User], round_: int) -> bytes:
     # cv2.waitKey(0)
     # return
 
-    # encode
-    _, b = cv2.imencode('.png', im)
-    return b.tobytes()
+    return im
+
+
+def render_key(kind: str, *parts) -> str:
+    # content address for a render, also used as a strong etag
+    parts = (kind, get_encoding(kind).spec) + parts
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def profile_version(user: User) -> str:
+    if user is None:
+        return 'none'
+    return f'{user.fid}:{user.displayName}:{user.pfp.url if user.pfp is not None else ""}'
+
+
+def countdown(remaining: int) -> int:
+    return max(0, remaining) // COUNTDOWN_INTERVAL * COUNTDOWN_INTERVAL
+
+
+def replayable(remaining: int) -> bool:
+    # same cutoff as the move buttons on the frame, on the raw time left rather than the displayed minute
+    return remaining >= ROUND_BUFFER
+
+
+def match_render_key(
+        match: Match,
+        user: User,
+        opponent: User,
+        round_: int,
+        state: MatchState,
+        remaining: int
+) -> str:
+    return render_key(
+        'match', match.id, match.updated.timestamp(), match.result.value, match.winner, round_,
+        state.turn, state.status.value, user.fid, profile_version(user), profile_version(opponent),
+        countdown(remaining), replayable(remaining)
+    )
+
+
+def match_base_key(
+        match: Match,
+        user: User,
+        opponent: User,
+        round_: int,
+        state: MatchState,
+        remaining: int
+) -> str:
+    # same inputs as the final image minus the countdown, good for the whole round. only a pending draw's message
+    # changes near the end of the round
+    draw = match.result == Result.PENDING and state.status == MatchStatus.DRAW
+    return render_key(
+        'match', 'base', match.id, match.updated.timestamp(), match.result.value, match.winner, round_,
+        state.turn, state.status.value, user.fid, profile_version(user), profile_version(opponent),
+        replayable(remaining) if draw else None
+    )
+
+
+def home_render_key(tournament: int, total: int, round_: int, prize, remaining: int) -> str:
+    return render_key('home', tournament, total, round_, prize, remaining)
+
+
+def bracket_render_key(bracket: dict, users: dict[int, User], round_: int) -> str:
+    matches = sorted((m.id, m.updated.timestamp(), m.winner) for r in bracket.values() for m in r.values())
+    profiles = sorted(profile_version(u) for u in users.values())
+    return render_key('bracket', round_, matches, profiles)
+
+
+def get_render(key: str) -> bytes:
+    with stage('render_cache'):
+        b = _renders.get(key)
+        if b is None:
+            b = _renders_disk.get(key)
+            if b is not None:
+                _renders.set(key, b)
+        return b
+
+
+def set_render(key: str, b: bytes):
+    _renders.set(key, b)
+
+
+def store_render(key: str, b: bytes):
+    # shared with other workers through the disk store, e.g. for pre-rendered images
+    _renders_disk.set(key, b)
+
+
+def has_render(key: str) -> bool:
+    return _renders.get(key) is not None or os.path.exists(_renders_disk.path(key))
 
 
 def strip_text(msg: str) -> str:
     return ''.join(m for m in msg if ord(m) < 128).strip()
 
 
+def pfp_urls(*users: User) -> list[str]:
+    return [u.pfp.url for u in users if u is not None and u.pfp is not None]
+
+
+def get_pfps(urls: list[str], timeout: float = PFP_TIMEOUT) -> dict[str, np.ndarray]:
+    # fetch in parallel, slow or failed pictures are left out so the render can fall back
+    futures = {url: _pfp_executor.submit(contextvars.copy_context().run, get_pfp, url) for url in dict.fromkeys(urls)}
+    deadline = time.monotonic() + timeout
+    pfps = {}
+    for url, f in futures.items():
+        try:
+            pfps[url] = f.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            log.warning('failed to get pfp', url=url, error=repr(e))
+    return pfps
+
+
 def get_pfp(url: str) -> np.ndarray:
+    im = get_cached_pfp(url)
+    if im is None:
+        im = cache_pfp(url, fetch_pfp(url))
+    return im
+
+
+def get_cached_pfp(url: str) -> np.ndarray:
+    key = f'{PFP_SZ}_{url}'
+    im = _pfps.get(key)
+    if im is not None:
+        return im
+
+    with stage('pfp_disk'):
+        b = _pfps_disk.get(key)
+    if b is None or len(b) != PFP_SZ * PFP_SZ * 3:
+        return None
+    im = np.frombuffer(b, dtype=np.uint8).reshape((PFP_SZ, PFP_SZ, 3))
+    _pfps.set(key, im)
+    return im
+
+
+def cache_pfp(url: str, im: np.ndarray) -> np.ndarray:
+    key = f'{PFP_SZ}_{url}'
+    _pfps_disk.set(key, im.tobytes())
+
+    # shared across renders, callers copy it into their own image
+    im.flags.writeable = False
+    _pfps.set(key, im)
+    return im
+
+
+def pfp_source(url: str) -> str:
     # if 'imgur' in url:
     #     if 'jpg' in 'url':
     #         url = url.replace('.jpg', 'b.jpg')
@@ -257,18 +619,30 @@ def get_pfp(url: str) -> np.ndarray:
     #         url = url.replace('.png', 'b.png')
     # elif 'ipfs.decentralized-content' in url:
     #     url = f'https://res.cloudinary.com/merkle-manufactory/image/fetch/c_fill,f_png,w_168/{url}'
-    url = f'https://res.cloudinary.com/merkle-manufactory/image/fetch/c_fill,f_jpg,h_{PFP_SZ},w_{PFP_SZ}/{url}'
+    return f'https://res.cloudinary.com/merkle-manufactory/image/fetch/c_fill,f_jpg,h_{PFP_SZ},w_{PFP_SZ}/{url}'
+
+
+def fetch_pfp(url: str) -> np.ndarray:
+    with stage('pfp_fetch'):
+        res = _pfp_session.get(pfp_source(url), timeout=PFP_TIMEOUT)
+    return decode_pfp(res.content)
 
-    res = requests.get(url, stream=True).raw
-    im = np.asarray(bytearray(res.read()), dtype='uint8')
-    im = cv2.imdecode(im, cv2.IMREAD_COLOR)
-    im = cv2.resize(im, (PFP_SZ, PFP_SZ))
+
+def decode_pfp(b: bytes) -> np.ndarray:
+    with stage('pfp_decode'):
+        im = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+        im = cv2.resize(im, (PFP_SZ, PFP_SZ))
     return im
 
 
+def put_text(im: np.ndarray, text: str, org: tuple, font: int, scale: float, color: tuple, thickness: int = 1):
+    with stage('text'):
+        return cv2.putText(im, text, org, font, scale, color, thickness)
+
+
 def write_message(im: np.ndarray, line0: str = None, line1: str = None) -> np.ndarray:
     if line0 is not None:
-        im = cv2.putText(im, line0, (22, 250), FONT, 0.5, (255, 255, 255))
+        im = put_text(im, line0, (22, 250), FONT, 0.5, (255, 255, 255))
     if line1 is not None:
-        im = cv2.putText(im, line1, (22, 270), FONT, 0.5, (255, 255, 255))
+        im = put_text(im, line1, (22, 270), FONT, 0.5, (255, 255, 255))
     return im
@@ -2,19 +2,71 @@
 game logic and state management on top of raw storage
 """
 import math
+import time
 import datetime
+import functools
+
+import numpy as np
+
+from .models import (
+    Tournament,
+    Match,
+    Move,
+    Gesture,
+    MatchState,
+    MatchStatus,
+    Result,
+    TournamentState,
+    RoundStats,
+    Player
+)
+from .storage import (
+    Backend,
+    get_matches_count,
+    get_round_stats,
+    set_round_stats,
+    get_state,
+    set_state,
+    record_match_result,
+    set_players,
+    get_match,
+    get_moves,
+    set_matches,
+    queue_move,
+    get_match_last,
+    get_matches_after,
+    get_matches_for_round,
+    get_moves_for_matches
+)
+from .log import get_logger
+
+log = get_logger(__name__)
+
+
+class RoundNotReady(Exception):
+    pass
 
-from supabase import Client
-
-from .models import Tournament, Match, Move, Gesture, MatchState, MatchStatus, Result, TournamentState
-from .storage import get_matches_count, get_match, get_moves, set_match, set_move, get_match_last, get_matches_after
 
 # constants
 ROUND_START = 18000  # midnight EST
 ROUND_DURATION = 86400
 ROUND_BUFFER = 3600
 
+# outcome of user0 gesture vs user1 gesture, indexed by gesture value - 1 (1: user0 wins, -1: user1 wins, 0: draw)
+OUTCOMES = np.array([
+    [0, -1, 1],  # rock vs rock, paper, scissors
+    [1, 0, -1],  # paper
+    [-1, 1, 0],  # scissors
+], dtype=np.int8)
+
+# batch match state sanity errors
+STATE_OK = 0
+STATE_MISMATCHED = 1
+STATE_MISALIGNED = 2
+STATE_UNNECESSARY = 3
 
+
+@functools.lru_cache(maxsize=64)
 def tournament_start(start: int) -> int:
     # get next increment for actual tournament start time
     days = math.ceil((start - ROUND_START) / ROUND_DURATION)
@@ -39,24 +91,23 @@ def round_size(total: int, round_: int) -> int:
     if round_ < 0:
         raise ValueError(f'invalid round: {round_}')
 
-    # find next power of 2
+    # next power of 2, split for each round passed
     total_rounds_ = total_rounds(total)
-
-    # split for each round passed
-    sz = 2 ** (total_rounds_ - round_)
-
-    if sz < 1:
+    if round_ >= total_rounds_:
         return 1  # tournament over
-    return int(sz)
+    return 1 << (total_rounds_ - round_)
 
 
 def total_rounds(total: int) -> int:
-    return math.ceil(math.log2(total))
+    # exact integer ceil(log2(total))
+    if total < 1:
+        raise ValueError(f'invalid total: {total}')
+    return (total - 1).bit_length()
 
 
-def remaining_users(total: int, round_: int, settled: int) -> int:
-    round_remaining = round_size(total, round_) - settled
-    return min(round_remaining, total)
+def remaining_users(total: int, round_: int, eliminated: int) -> int:
+    # everyone still alive entered this round (round 0 includes byes), minus those knocked out so far
+    return min(round_size(total, round_), total) - eliminated
 
 
 def match_slot(total: int, round_: int, fid: int) -> int:
@@ -68,14 +119,39 @@ def match_slot(total: int, round_: int, fid: int) -> int:
         raise ValueError(f'fid too low: {fid}')
     if round_ < 0:
         raise ValueError(f'invalid round: {round_}')
+    if total < 2:
+        raise ValueError('fewer than two people')
 
-    sz = round_size(total, 0)
-    slot = fid - 1
-    for i in range(round_ + 1):
-        slot = slot if slot < sz / 2 else sz - slot - 1
-        sz /= 2
+    total_rounds_ = total_rounds(total)
+    if round_ >= total_rounds_:
+        return 0
+    return _fold_slot(fid - 1, total_rounds_ - round_ - 1)
+
+
+def match_slots(total: int, round_: int, fids: np.ndarray) -> np.ndarray:
+    # vectorized match_slot
+    fids = np.asarray(fids, dtype=np.int64)
+    if np.any(fids > total):
+        raise ValueError(f'user too high: {fids.max()}, total: {total}')
+    if np.any(fids < 1):
+        raise ValueError(f'fid too low: {fids.min()}')
+    if round_ < 0:
+        raise ValueError(f'invalid round: {round_}')
+    if total < 2:
+        raise ValueError('fewer than two people')
+
+    total_rounds_ = total_rounds(total)
+    if round_ >= total_rounds_:
+        return np.zeros(len(fids), dtype=np.int64)
+    return _fold_slot(fids - 1, total_rounds_ - round_ - 1)
 
-    return int(slot)
+
+def _fold_slot(seed, k: int):
+    # each round folds the bracket in half (slot -> sz - slot - 1 for the upper half), so after
+    # round r only the low bits of the seed remain, complemented if the last bit folded away was set
+    # works on ints and int arrays alike
+    mask = (1 << k) - 1
+    return (seed & mask) ^ (mask * ((seed >> k) & 1))
 
 
 def parent_slots(total: int, round_: int, slot: int) -> (int, int):
@@ -89,12 +165,53 @@ def parent_slots(total: int, round_: int, slot: int) -> (int, int):
     return slot, mirror
 
 
-def get_round_settled(supabase: Client, tournament: int, round_: int) -> int:
-    return get_matches_count(supabase, tournament, round_, result=Result.PLAYED)
+def get_round_settled(supabase: Backend, tournament: int, round_: int) -> int:
+    return get_round_counts(supabase, tournament, round_).played
+
+
+def get_round_counts(supabase: Backend, tournament: int, round_: int) -> RoundStats:
+    # maintained counters, rebuilt from head only counts if missing
+    stats = get_round_stats(supabase, tournament, round_)
+    if stats is not None:
+        return stats
+
+    matches = get_matches_count(supabase, tournament, round_)
+    pending = get_matches_count(supabase, tournament, round_, result=Result.PENDING)
+    played = get_matches_count(supabase, tournament, round_, result=Result.PLAYED)
+    byes = get_matches_count(supabase, tournament, round_, result=Result.BYE)
+    stats = RoundStats(
+        id=f'{tournament}_{round_}',
+        tournament=tournament,
+        round=round_,
+        matches=matches,
+        pending=pending,
+        settled=matches - pending,
+        played=played,
+        eliminated=matches - pending - byes
+    )
+    if matches:
+        set_round_stats(supabase, stats)
+    return stats
+
+
+def round_stats_from_matches(now: int, tournament: int, round_: int, matches: list[Match]) -> RoundStats:
+    pending = sum(1 for m in matches if m.result == Result.PENDING)
+    byes = sum(1 for m in matches if m.result == Result.BYE)
+    return RoundStats(
+        id=f'{tournament}_{round_}',
+        tournament=tournament,
+        round=round_,
+        matches=len(matches),
+        pending=pending,
+        settled=len(matches) - pending,
+        played=sum(1 for m in matches if m.result == Result.PLAYED),
+        eliminated=len(matches) - pending - byes,
+        updated=now
+    )
 
 
 def get_match_user(
-        supabase: Client,
+        supabase: Backend,
         now: int,
         tournament: int,
         total: int,
@@ -111,7 +228,7 @@ def get_match_user(
 
     # get or lazily create match
     m, s = get_match_slot(supabase, now, tournament, total, round_, round_, slot)
-    print(m, s)
+    log.debug('match slot', match=m, state=s)
 
     # verify that user made it to match
     if fid != m.user0 and fid != m.user1:
@@ -125,46 +242,44 @@ def get_match_user(
 
 
 def get_match_slot(
-        supabase: Client,
+        supabase: Backend,
         now: int,
         tournament: int,
         total: int,
         curr_round: int,
         round_: int,
-        slot: int,
-        create_if_none: bool = True
+        slot: int
 ) -> (Match, MatchState):
-    # get match if exists
+    # get match, rounds are materialized by the round advance job and never from a request
     m = get_match(supabase, tournament, round_, slot)
-    if m is not None:
-        print(f'got match {tournament} {round_} {slot}')
-        return update_match_result(supabase, now, curr_round, m)
-    else:
-        print(f'lazy init match {tournament} {round_} {slot}')
-        # lazy init
-        if round_ == 0:
-            # at beginning
-            sz = round_size(total, 0)
-            fid0 = slot + 1
-            fid1 = sz - slot
-            if fid1 > total:
-                fid1 = 0  # bye
+    if m is None:
+        log.warning('round not materialized', tournament=tournament, round=round_, slot=slot)
+        raise RoundNotReady(f'round {round_} of tournament {tournament} is not ready')
 
-        else:
-            # get users by previous match results
-            a, b = parent_slots(total, round_, slot)
+    return update_match_result(supabase, now, curr_round, m)
 
-            # recurse and (optional) backfill as needed
-            ma, _ = get_match_slot(supabase, now, tournament, total, curr_round, round_ - 1, a, create_if_none=True)
-            mb, _ = get_match_slot(supabase, now, tournament, total, curr_round, round_ - 1, b, create_if_none=True)
-            if ma.winner is None:
-                raise Exception(f'winner missing for match {ma.id}')  # sanity
-            if mb.winner is None:
-                raise Exception(f'winner missing for match {mb.id}')
 
-            fid0 = ma.winner
-            fid1 = mb.winner
+def round_pairings(total: int, round_: int, winners: np.ndarray = None) -> (np.ndarray, np.ndarray):
+    # compute user pairings for every slot in a round (user1 of 0 is a bye)
+    sz = round_size(total, round_)
+    slots = np.arange(sz // 2, dtype=np.int64)
+
+    if round_ == 0:
+        fid0 = slots + 1
+        fid1 = sz - slots
+        fid1[fid1 > total] = 0  # bye
+        return fid0, fid1
 
+    # pair up winners of mirrored parent slots
+    if winners is None or len(winners) != sz:
+        raise ValueError(f'expected {sz} winners for round {round_ - 1}')
+    return winners[slots], winners[sz - slots - 1]
+
+
+def create_round(now: int, tournament: int, total: int, round_: int, winners: np.ndarray = None) -> list[Match]:
+    fid0, fid1 = round_pairings(total, round_, winners)
+    matches = []
+    for slot, (u0, u1) in enumerate(zip(fid0.tolist(), fid1.tolist())):
         m = Match(
             id=f'{tournament}_{round_}_{slot}',
             created=now,
@@ -172,24 +287,127 @@ def get_match_slot(
             tournament=tournament,
             round=round_,
             slot=slot,
-            user0=fid0,
-            user1=fid1,
+            user0=u0,
+            user1=u1,
             result=Result.PENDING
         )
-
-        # if match did not already exist, no moves could have been played
-        state = MatchState(match=m.id, turn=0, status=MatchStatus.NEW)
+        if u1 == 0:
+            # settle bye
+            m.winner = u0
+            m.loser = 0
+            m.result = Result.BYE
+        matches.append(m)
+    return matches
+
+
+def match_players(now: int, matches: list[Match]) -> list[Player]:
+    # player index entries for everyone in these matches
+    players = []
+    for m in matches:
+        for fid in (m.user0, m.user1):
+            if fid > 0:
+                players.append(Player(
+                    id=f'{m.tournament}_{fid}',
+                    tournament=m.tournament,
+                    fid=fid,
+                    match=m.id,
+                    round=m.round,
+                    alive=fid != m.loser,
+                    updated=now
+                ))
+    return players
+
+
+def advance_round(supabase: Backend, now: int, tournament: int, total: int, curr_round: int, round_: int) -> list[Match]:
+    # materialize every match of a round from the previous round winners, written with one bulk upsert
+    if round_ < 0 or round_ > curr_round:
+        raise ValueError(f'cannot advance to round {round_}, current round {curr_round}')
+    sz = round_size(total, round_)
+    if sz < 2:
+        return []  # tournament over
+
+    existing = {m.slot: m for m in get_matches_for_round(supabase, tournament, round_)}
+    if len(existing) == sz // 2:
+        return []  # already materialized
+
+    winners = None
+    if round_ > 0:
+        prev = get_matches_for_round(supabase, tournament, round_ - 1)
+        if len(prev) < sz:
+            # previous round was never materialized either
+            advance_round(supabase, now, tournament, total, curr_round, round_ - 1)
+            prev = get_matches_for_round(supabase, tournament, round_ - 1)
+
+        if any(m.winner is None for m in prev):
+            # score any matches left pending at the end of the previous round
+            settle_round(supabase, now, tournament, curr_round, round_ - 1)
+            prev = get_matches_for_round(supabase, tournament, round_ - 1)
+
+        winners = np.zeros(sz, dtype=np.int64)
+        for m in prev:
+            if m.winner is None:
+                raise Exception(f'winner missing for match {m.id}')  # sanity
+            winners[m.slot] = m.winner
+
+    matches = [m for m in create_round(now, tournament, total, round_, winners) if m.slot not in existing]
+    set_matches(supabase, matches, ignore_duplicates=True)
+    set_players(supabase, match_players(now, matches))
+    set_round_stats(supabase, round_stats_from_matches(now, tournament, round_, list(existing.values()) + matches))
+    log.info('advanced round', tournament=tournament, round=round_, created=len(matches))
+    return matches
+
+
+def settle_round(supabase: Backend, now: int, tournament: int, curr_round: int, round_: int) -> dict:
+    # score every pending match of a finished round in bulk and write results with one batched upsert
+    if round_ >= curr_round:
+        raise ValueError(f'cannot settle round {round_} before it ends, current round {curr_round}')
+
+    t0 = time.perf_counter()
+    matches = get_matches_for_round(supabase, tournament, round_)
+    pending = [m for m in matches if m.winner is None]
+    moves = get_moves_for_matches(supabase, [m.id for m in pending])
+    t_read = time.perf_counter()
+
+    settled = []
+    errors = []
+    counts = {r.name: 0 for r in Result}
+    for m, state in zip(pending, resolve_match_states(pending, moves)):
+        if isinstance(state, Exception):
+            log.warning('failed to resolve match', match=m.id, error=repr(state))
+            errors.append(m.id)
+            continue
         m = resolve_match(curr_round, m, state)
-
-        # note: would prefer not to recursively create old matches
-        # but currently doing backfill to incrementally handle timeout + set elimination match
-        if create_if_none:
-            set_match(supabase, m)
-
-        return m, state
-
-
-def update_match_result(supabase: Client, now: int, round_: int, match: Match) -> (Match, MatchState):
+        if m.result == Result.PENDING:
+            errors.append(m.id)  # sanity, every match should be decided after its round
+            continue
+        m.updated = datetime.datetime.utcfromtimestamp(now)
+        counts[m.result.name] += 1
+        settled.append(m)
+    t_resolve = time.perf_counter()
+
+    set_matches(supabase, settled)
+    set_players(supabase, [p for p in match_players(now, settled) if not p.alive])
+    set_round_stats(supabase, round_stats_from_matches(now, tournament, round_, matches))
+    t_write = time.perf_counter()
+
+    report = {
+        'tournament': tournament,
+        'round': round_,
+        'matches': len(matches),
+        'pending': len(pending),
+        'settled': len(settled),
+        'errors': errors,
+        'results': counts,
+        'read_s': round(t_read - t0, 4),
+        'resolve_s': round(t_resolve - t_read, 4),
+        'write_s': round(t_write - t_resolve, 4),
+        'total_s': round(t_write - t0, 4)
+    }
+    log.info('settled round', **report)
+    return report
+
+
+def update_match_result(supabase: Backend, now: int, round_: int, match: Match) -> (Match, MatchState):
     if match.winner is not None:
         # already scored
         return match, None
@@ -202,9 +420,10 @@ def update_match_result(supabase: Client, now: int, round_: int, match: Match) -
     if match.result == Result.PENDING:
         return match, state  # nothing to update
 
-    # update
+    # update, only the first reader to settle the match moves the counters
     match.updated = datetime.datetime.utcfromtimestamp(now)
-    set_match(supabase, match)
+    if not record_match_result(supabase, match):
+        log.debug('match already settled', match=match.id)
 
     return match, state
 
@@ -255,7 +474,7 @@ def resolve_match(round_: int, match: Match, state: MatchState) -> Match:
     return match
 
 
-def get_match_state(supabase: Client, match: Match) -> MatchState:
+def get_match_state(supabase: Backend, match: Match) -> MatchState:
     moves = get_moves(supabase, match.id)
     state = resolve_match_state(match, moves)
     return state
@@ -273,7 +492,7 @@ def resolve_match_state(match: Match, moves: list[Move]) -> MatchState:
         raise Exception(f'mismatched number of moves {match.id}')  # sanity
 
     for i, (m0, m1) in enumerate(zip(moves0, moves1)):
-        print(i, m0, m1)
+        log.debug('move pair', turn=i, move0=m0, move1=m1)
         if m0.turn != i or m0.turn != m1.turn:
             raise Exception(f'invalid move alignment {match.id} {i} {m0.turn} {m1.turn}')  # sanity
 
@@ -321,7 +540,138 @@ def resolve_match_state(match: Match, moves: list[Move]) -> MatchState:
     return state
 
 
-def submit_move(supabase: Client, now: int, match: str, fid: int, turn: int, gesture: Gesture, signature: str):
+def resolve_match_states(matches: list[Match], moves: dict[str, list[Move]]) -> list[MatchState]:
+    # batch version of resolve_match_state, sanity errors are returned in place of the state for that match
+    match_idx, side, turn, gesture = [], [], [], []
+    for i, m in enumerate(matches):
+        for mv in moves.get(m.id, []):
+            match_idx.append(i)
+            side.append(0 if mv.user == m.user0 else 1 if mv.user == m.user1 else -1)
+            turn.append(mv.turn)
+            gesture.append(mv.move.value)
+
+    res = resolve_match_states_columnar(len(matches), match_idx, side, turn, gesture)
+
+    states = []
+    for i, m in enumerate(matches):
+        err = res['error'][i]
+        n0, n1 = res['count0'][i], res['count1'][i]
+        t = res['turn'][i]
+        if err == STATE_MISMATCHED:
+            states.append(Exception(f'mismatched number of moves {m.id} {n0} {n1}'))
+            continue
+        if err == STATE_MISALIGNED:
+            t0, t1 = res['turn0'][i], res['turn1'][i]
+            states.append(Exception(f'invalid move alignment {m.id} {t} {t0} {t1}'))
+            continue
+        if err == STATE_UNNECESSARY:
+            states.append(Exception(f'unnecessary moves found {m.id} {t} {n0}'))
+            continue
+
+        k = res['history'][i]
+        state = MatchState(
+            match=m.id,
+            turn=int(t),
+            status=MatchStatus(int(res['status'][i])),
+            history0=[Gesture(int(g)) for g in res['history0'][i, :k]],
+            history1=[Gesture(int(g)) for g in res['history1'][i, :k]]
+        )
+        if state.status == MatchStatus.SETTLED:
+            w = res['winner'][i]
+            state.winner = m.user0 if w == 0 else m.user1
+            state.loser = m.user1 if w == 0 else m.user0
+        states.append(state)
+
+    return states
+
+
+def resolve_match_states_columnar(n: int, match_idx, side, turn, gesture) -> dict[str, np.ndarray]:
+    # vectorized match state for n matches, from one row per move (side -1 for moves by neither user)
+    match_idx = np.asarray(match_idx, dtype=np.int64)
+    side = np.asarray(side, dtype=np.int64)
+    turn = np.asarray(turn, dtype=np.int64)
+    gesture = np.asarray(gesture, dtype=np.int64)
+
+    any_moves = np.bincount(match_idx, minlength=n) > 0
+    keep = side >= 0
+    match_idx, side, turn, gesture = match_idx[keep], side[keep], turn[keep], gesture[keep]
+    count0 = np.bincount(match_idx[side == 0], minlength=n)
+    count1 = np.bincount(match_idx[side == 1], minlength=n)
+    paired_count = np.minimum(count0, count1)
+
+    # order moves by match, side, then turn (stable, like sorting each user's moves by turn)
+    order = np.argsort(turn, kind='stable')
+    order = order[np.argsort(side[order], kind='stable')]
+    order = order[np.argsort(match_idx[order], kind='stable')]
+    match_idx, side, turn, gesture = match_idx[order], side[order], turn[order], gesture[order]
+
+    # index of each move within its (match, side) group
+    group = match_idx * 2 + side
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(group) else np.zeros(0, dtype=np.int64)
+    rank = np.arange(len(group)) - np.repeat(starts, np.diff(np.r_[starts, len(group)]))
+
+    # lay out both users' moves as (match, turn index) grids
+    width = int(max(count0.max(initial=0), count1.max(initial=0)))
+    g = np.zeros((2, n, width), dtype=np.int8)
+    t = np.full((2, n, width), -1, dtype=np.int64)
+    g[side, match_idx, rank] = gesture
+    t[side, match_idx, rank] = turn
+
+    cols = np.arange(width)
+    paired = cols[None, :] < paired_count[:, None]
+    misaligned = paired & ((t[0] != cols[None, :]) | (t[0] != t[1]))
+    outcome = np.where(paired, OUTCOMES[np.maximum(g[0] - 1, 0), np.maximum(g[1] - 1, 0)], 0)
+    decisive = paired & (outcome != 0)
+
+    # first turn that is either invalid or decides the match
+    event = misaligned | decisive
+    has_event = event.any(axis=1)
+    first = np.argmax(event, axis=1) if width else np.zeros(n, dtype=np.int64)
+    rows = np.arange(n)
+    first_misaligned = has_event & misaligned[rows, first] if width else np.zeros(n, dtype=bool)
+    settled = has_event & ~first_misaligned
+
+    # ongoing status
+    status = np.where(
+        count0 == count1, MatchStatus.DRAW.value,
+        np.where(count0 > count1, MatchStatus.USER_0_PLAYED.value, MatchStatus.USER_1_PLAYED.value)
+    )
+    turn_out = paired_count.copy()
+    history = paired_count.copy()
+    winner = np.full(n, -1, dtype=np.int64)
+
+    # settled status
+    status[settled] = MatchStatus.SETTLED.value
+    turn_out[settled] = first[settled]
+    history[settled] = first[settled] + 1
+    if width:
+        winner[settled] = np.where(outcome[rows, first][settled] > 0, 0, 1)
+    status[~any_moves] = MatchStatus.NEW.value
+
+    # sanity errors, in the same precedence as resolve_match_state
+    error = np.full(n, STATE_OK, dtype=np.int8)
+    error[settled & (count0 != count1)] = STATE_MISMATCHED
+    error[settled & (first != count0 - 1)] = STATE_UNNECESSARY
+    error[first_misaligned] = STATE_MISALIGNED
+    error[np.abs(count0 - count1) > 1] = STATE_MISMATCHED
+    turn_out[first_misaligned] = first[first_misaligned]
+
+    return {
+        'status': status,
+        'turn': turn_out,
+        'winner': winner,
+        'error': error,
+        'count0': count0,
+        'count1': count1,
+        'history': history,
+        'history0': g[0],
+        'history1': g[1],
+        'turn0': t[0][rows, first] if width else np.full(n, -1),
+        'turn1': t[1][rows, first] if width else np.full(n, -1)
+    }
+
+
+def submit_move(supabase: Backend, now: int, match: str, fid: int, turn: int, gesture: Gesture, signature: str):
     move = Move(
         id=f'{match}_{fid}_{turn}',
         created=now,
@@ -331,10 +681,10 @@ def submit_move(supabase: Client, now: int, match: str, fid: int, turn: int, ges
         move=gesture,
         signature=signature
     )
-    return set_move(supabase, move)
+    return queue_move(supabase, move)
 
 
-def get_match_user_last(supabase: Client, tournament: int, fid: int) -> Match:
+def get_match_user_last(supabase: Backend, tournament: int, fid: int) -> Match:
     # convenience just to show user elimination (or last match) details
     m = get_match_last(supabase, tournament, fid)
     if m is None:
@@ -342,12 +692,14 @@ def get_match_user_last(supabase: Client, tournament: int, fid: int) -> Match:
     return m
 
 
-def get_winner(supabase: Client, tournament: int) -> int:
-    # TODO
-    pass
+def get_winner(supabase: Backend, tournament: int) -> int:
+    state = get_state(supabase, tournament)
+    if state is None:
+        return None
+    return state.winner
 
 
-def get_final_bracket(supabase: Client, tournament: int, total: int):
+def get_final_bracket(supabase: Backend, tournament: int, total: int):
     # start bracket with round of 16
     total_rounds_ = total_rounds(total)
     if total_rounds_ < 4:
@@ -366,6 +718,46 @@ def get_final_bracket(supabase: Client, tournament: int, total: int):
     return bracket
 
 
-def get_tournament_state(supabase: Client, tournament: int, round_: int) -> TournamentState:
-    # TODO
-    pass
+def get_tournament_state(supabase: Backend, now: int, tournament: Tournament, round_: int) -> TournamentState:
+    # single read of materialized state, rebuilt when missing or on the first read of a new round
+    state = get_state(supabase, tournament.id)
+    if state is None or state.round < min(round_, state.rounds - 1):
+        state = refresh_tournament_state(supabase, now, tournament, round_, state)
+    return state
+
+
+def refresh_tournament_state(
+        supabase: Backend,
+        now: int,
+        tournament: Tournament,
+        round_: int,
+        prev: TournamentState = None
+) -> TournamentState:
+    rounds = total_rounds(tournament.size)
+    r = min(round_, rounds - 1)
+    stats = get_round_counts(supabase, tournament.id, r)
+    state = TournamentState(
+        tournament=tournament.id,
+        size=tournament.size,
+        rounds=rounds,
+        round=r,
+        remaining=remaining_users(tournament.size, r, stats.eliminated),
+        settled=stats.settled,
+        pending=stats.pending,
+        updated=now
+    )
+
+    # keep latest result, then check for a champion
+    if prev is None:
+        prev = get_state(supabase, tournament.id)
+    if prev is not None:
+        state.latest = prev.latest
+        state.latest_winner = prev.latest_winner
+        state.latest_loser = prev.latest_loser
+        state.latest_result = prev.latest_result
+    if r == rounds - 1 and stats.matches and not stats.pending:
+        final = get_match(supabase, tournament.id, r, 0)
+        state.winner = final.winner if final is not None else None
+
+    set_state(supabase, state)
+    return state
@@ -4,48 +4,308 @@ methods to read from and write to postgres database
 
 # lib
 import os
+import time
+import functools
+import threading
+from typing import Union
 
+import httpx
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from postgrest.types import CountMethod
 
 # src
-from .models import Tournament, Match, Result, Move, Gesture
+from .models import Tournament, Match, Result, Move, Gesture, RoundStats, TournamentState, Player
+from .cache import LRUCache
+from .journal import MoveJournal
+from .store import Store, MemoryStore, SqliteStore
+from .log import get_logger
 
+log = get_logger(__name__)
 
-def get_supabase() -> Client:
-    if os.getenv('VERCEL_ENV') is None:
-        load_dotenv()
+# storage functions take the supabase client or a local store in its place
+Backend = Union[Client, Store]
+
+# client pool settings
+if os.getenv('VERCEL_ENV') is None:
+    load_dotenv()
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND') or 'supabase'  # supabase, memory, or sqlite
+STORAGE_PATH = os.getenv('STORAGE_PATH') or 'rps.db'  # sqlite database file
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', 10))
+SUPABASE_HEALTH_INTERVAL = float(os.getenv('SUPABASE_HEALTH_INTERVAL', 60))
+SUPABASE_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', 10))
+
+# bulk query settings
+PAGE_SIZE = 1000  # postgrest default max rows
+ID_BATCH_SIZE = 200  # keep in.() filters well under url length limits
+WRITE_BATCH_SIZE = 5000
+
+# tournament rows are effectively immutable while running, keep them briefly per worker
+TOURNAMENT_CACHE_TTL = float(os.getenv('TOURNAMENT_CACHE_TTL', 60))
+TOURNAMENT_CACHE_CHECK = float(os.getenv('TOURNAMENT_CACHE_CHECK', 5))  # seconds between shared generation reads
+_tournaments = LRUCache(maxsize=64, ttl=TOURNAMENT_CACHE_TTL)
+_generation = None  # last seen tournament cache generation
+_generation_checked = 0.0
+_generation_lock = threading.Lock()
+
+# optional buffered move ingestion through a sqlite file shared by the workers on one host. moves for a tournament
+# must all go through that host, another host's buffer cannot see them
+MOVE_JOURNAL = os.getenv('MOVE_JOURNAL') or None
+MOVE_FLUSH_SIZE = int(os.getenv('MOVE_FLUSH_SIZE', 500))
+MOVE_FLUSH_INTERVAL = float(os.getenv('MOVE_FLUSH_INTERVAL', 1.0))
+_journal: MoveJournal = None
+_journal_lock = threading.Lock()
+
+# process wide client, shared by all requests on this worker
+_client: Backend = None
+_client_checked = 0.0
+_client_lock = threading.Lock()
+
+
+def get_backend() -> Backend:
+    # storage handle for this worker, the pooled supabase client or the configured local store, either one is
+    # accepted by every storage function
+    global _client, _client_checked
+    if STORAGE_BACKEND != 'supabase':
+        return get_store()
+
+    with _client_lock:
+        client = _client
+        checked = _client_checked
+
+    now = time.monotonic()
+    if client is not None and now - checked > SUPABASE_HEALTH_INTERVAL:
+        # periodic health check, rebuild client if connection pool has gone bad
+        if check_supabase(client):
+            with _client_lock:
+                _client_checked = now
+        else:
+            log.warning('supabase health check failed, reconnecting')
+            reset_supabase(client)
+            client = None
+
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_supabase()
+                _client_checked = now
+            client = _client
+
+    return client
+
+
+def get_store() -> Store:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_store(STORAGE_BACKEND, STORAGE_PATH)
+        return _client
+
+
+def create_store(backend: str, path: str = None) -> Store:
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'sqlite':
+        return SqliteStore(path or ':memory:')
+    raise ValueError(f'unknown storage backend {backend}')
+
+
+def create_supabase() -> Client:
     url = os.environ.get('SUPABASE_URL')
     key = os.environ.get('SUPABASE_KEY')
     supabase = create_client(url, key)
+
+    # swap default postgrest session for a keep-alive pool of configurable size
+    session = supabase.postgrest.session
+    limits = httpx.Limits(max_connections=SUPABASE_POOL_SIZE, max_keepalive_connections=SUPABASE_POOL_SIZE)
+    supabase.postgrest.session = httpx.Client(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=SUPABASE_TIMEOUT,
+        follow_redirects=True,
+        transport=httpx.HTTPTransport(limits=limits, retries=1)
+    )
+    session.close()
     return supabase
 
 
-def get_current_tournament(supabase: Client) -> Tournament:
+def check_supabase(supabase: Backend) -> bool:
+    try:
+        supabase.table('tournament').select('id').limit(1).execute()
+        return True
+    except Exception as e:
+        log.warning('supabase health check error', error=e)
+        return False
+
+
+def reset_supabase(supabase: Backend = None):
+    # drop pooled client (optionally only if it is still the one that failed)
+    global _client
+    if STORAGE_BACKEND != 'supabase':
+        return
+    with _client_lock:
+        if _client is None or (supabase is not None and _client is not supabase):
+            return
+        client = _client
+        _client = None
+    try:
+        client.postgrest.session.close()
+    except Exception as e:
+        log.warning('failed to close supabase session', error=e)
+
+
+def _local(fn):
+    # route calls with a local store in place of the supabase client to the store method of the same name
+    @functools.wraps(fn)
+    def wrapper(supabase, *args, **kwargs):
+        if isinstance(supabase, Store):
+            return getattr(supabase, fn.__name__)(*args, **kwargs)
+        return fn(supabase, *args, **kwargs)
+    return wrapper
+
+
+def set_tournament(supabase: Backend, tournament: Tournament):
+    invalidate_tournament(tournament.id)
+    if isinstance(supabase, Store):
+        return supabase.set_tournament(tournament)
+    res = supabase.table('tournament').upsert(tournament.model_dump(mode='json')).execute()
+    publish_invalidation(supabase)
+    return res
+
+
+@_local
+def get_current_tournament(supabase: Backend) -> Tournament:
+    check_invalidation(supabase)
+    t = _tournaments.get('current')
+    if t is not None:
+        return t
     res = supabase.table('tournament').select('*').order('id', desc=True).limit(1).execute()
     if not res.data:
         raise Exception('could not get current tournament')
-    return Tournament(**res.data[0])
+    t = Tournament(**res.data[0])
+    _tournaments.set('current', t)
+    _tournaments.set(t.id, t)
+    return t
 
 
-def get_tournament(supabase: Client, tournament: int) -> Tournament:
+@_local
+def get_tournament(supabase: Backend, tournament: int) -> Tournament:
+    check_invalidation(supabase)
+    t = _tournaments.get(tournament)
+    if t is not None:
+        return t
     res = supabase.table('tournament').select('*').eq('id', tournament).execute()
     if not res.data:
         raise Exception('could not get current tournament')
-    return Tournament(**res.data[0])
+    t = Tournament(**res.data[0])
+    _tournaments.set(t.id, t)
+    return t
+
+
+def invalidate_tournament(tournament: int = None):
+    if tournament is None:
+        _tournaments.clear()
+        return
+    _tournaments.pop(tournament)
+    _tournaments.pop('current')
+
+
+def publish_invalidation(supabase: Backend):
+    # bump the shared generation so every worker drops its cached tournaments within TOURNAMENT_CACHE_CHECK,
+    # local stores are read uncached
+    global _generation
+    invalidate_tournament()
+    if isinstance(supabase, Store):
+        return
+    res = supabase.rpc('bump_cache_generation', {'p_name': 'tournament'}).execute()
+    with _generation_lock:
+        _generation = res.data
+
+
+def check_invalidation(supabase: Backend):
+    # at most one small read per worker every TOURNAMENT_CACHE_CHECK, the cache ttl still bounds staleness if the
+    # read fails
+    global _generation, _generation_checked
+    now = time.monotonic()
+    with _generation_lock:
+        if now - _generation_checked < TOURNAMENT_CACHE_CHECK:
+            return
+        _generation_checked = now
+    try:
+        res = supabase.table('cache_generation').select('generation').eq('name', 'tournament').execute()
+        generation = res.data[0]['generation'] if res.data else 0
+    except Exception as e:
+        log.warning('failed to check tournament cache generation', error=repr(e))
+        return
+    with _generation_lock:
+        changed = _generation is not None and generation != _generation
+        _generation = generation
+    if changed:
+        log.info('tournament cache invalidated by another worker', generation=generation)
+        invalidate_tournament()
 
 
-def get_matches_count(supabase: Client, tournament: int, round_: int, result: Result = None) -> int:
-    # TODO ideally would not return any data
+@_local
+def get_matches_count(supabase: Backend, tournament: int, round_: int, result: Result = None) -> int:
+    # exact count from the content-range header, limit 0 so no rows are returned
     q = supabase.table('match').select('id', count=CountMethod.exact).eq('tournament', tournament).eq('round', round_)
     if result is not None:
         q = q.eq('result', result.value)
-    res = q.execute()
+    res = q.limit(0).execute()
     return res.count
 
 
-def get_matches_after(supabase: Client, tournament: int, round_: int) -> list[Match]:
+@_local
+def get_round_stats(supabase: Backend, tournament: int, round_: int) -> RoundStats:
+    res = supabase.table('round_stats').select('*').eq('id', f'{tournament}_{round_}').execute()
+    if not res.data:
+        return None
+    return RoundStats(**res.data[0])
+
+
+@_local
+def set_round_stats(supabase: Backend, stats: RoundStats):
+    stats_id = f'{stats.tournament}_{stats.round}'
+    if stats.id != stats_id:
+        log.warning('round stats id was wrong, fixing', id=stats.id, expected=stats_id)
+        stats.id = stats_id
+    body = stats.model_dump(mode='json', exclude_none=True)
+    return supabase.table('round_stats').upsert(body).execute()
+
+
+@_local
+def get_state(supabase: Backend, tournament: int) -> TournamentState:
+    res = supabase.table('tournament_state').select('*').eq('tournament', tournament).execute()
+    if not res.data:
+        return None
+    return TournamentState(**res.data[0])
+
+
+@_local
+def set_state(supabase: Backend, state: TournamentState):
+    body = state.model_dump(mode='json')
+    return supabase.table('tournament_state').upsert(body).execute()
+
+
+@_local
+def record_match_result(supabase: Backend, match: Match) -> bool:
+    # settle a pending match and bump round counters and tournament state in one atomic call,
+    # false if the match was already settled (e.g. by a concurrent reader) and nothing changed
+    params = {
+        'p_tournament': match.tournament,
+        'p_round': match.round,
+        'p_match': match.id,
+        'p_result': match.result.value,
+        'p_winner': match.winner,
+        'p_loser': match.loser,
+        'p_updated': match.updated.isoformat()
+    }
+    res = supabase.rpc('record_match_result', params).execute()
+    return bool(res.data)
+
+
+@_local
+def get_matches_after(supabase: Backend, tournament: int, round_: int) -> list[Match]:
     q = supabase.table('match').select('*').eq('tournament', tournament).gte('round', round_)
     res = q.execute()
     if not res.data:
@@ -53,7 +313,25 @@ def get_matches_after(supabase: Client, tournament: int, round_: int) -> list[Ma
     return [Match(**d) for d in res.data]
 
 
-def get_match(supabase: Client, tournament: int, round_: int, slot: int) -> Match:
+@_local
+def get_matches_for_round(supabase: Backend, tournament: int, round_: int) -> list[Match]:
+    rows = _select_all(
+        lambda: supabase.table('match').select('*').eq('tournament', tournament).eq('round', round_).order('slot')
+    )
+    return [Match(**d) for d in rows]
+
+
+@_local
+def get_matches_by_ids(supabase: Backend, match_ids: list[str]) -> dict[str, Match]:
+    matches = {}
+    for batch in _batches(match_ids):
+        rows = _select_all(lambda: supabase.table('match').select('*').in_('id', batch).order('id'))
+        matches.update((d['id'], Match(**d)) for d in rows)
+    return matches
+
+
+@_local
+def get_match(supabase: Backend, tournament: int, round_: int, slot: int) -> Match:
     match_id = f'{tournament}_{round_}_{slot}'
     res = supabase.table('match').select('*').eq('id', match_id).execute()
     if not res.data:
@@ -61,7 +339,8 @@ def get_match(supabase: Client, tournament: int, round_: int, slot: int) -> Matc
     return Match(**res.data[0])
 
 
-def get_match_loser(supabase: Client, tournament: int, loser: int) -> Match:
+@_local
+def get_match_loser(supabase: Backend, tournament: int, loser: int) -> Match:
     res = supabase.table('match').select('*').eq('tournament', tournament).eq('loser', loser).execute()
     if not res.data:
         return None
@@ -70,39 +349,195 @@ def get_match_loser(supabase: Client, tournament: int, loser: int) -> Match:
     return Match(**res.data[0])
 
 
-def get_match_last(supabase: Client, tournament: int, fid: int) -> Match:
-    res = supabase.table('match').select('*').eq('tournament', tournament).or_(f'user0.eq.{fid},user1.eq.{fid}').order(
-        'round', desc=True).limit(1).execute()
+@_local
+def get_match_last(supabase: Backend, tournament: int, fid: int) -> Match:
+    # one keyed request on the player index with the match row embedded through its foreign key,
+    # scan only for players not yet indexed
+    res = supabase.table('player').select('last:match(*)').eq('id', f'{tournament}_{fid}').execute()
+    if res.data and res.data[0]['last'] is not None:
+        return Match(**res.data[0]['last'])
+    res = supabase.table('match').select('*').eq('tournament', tournament).or_(
+        f'user0.eq.{fid},user1.eq.{fid}').order('round', desc=True).limit(1).execute()
     if not res.data:
         return None
     return Match(**res.data[0])
 
 
-def set_match(supabase: Client, match: Match):
+@_local
+def get_player(supabase: Backend, tournament: int, fid: int) -> Player:
+    res = supabase.table('player').select('*').eq('id', f'{tournament}_{fid}').execute()
+    if not res.data:
+        return None
+    return Player(**res.data[0])
+
+
+@_local
+def set_players(supabase: Backend, players: list[Player]):
+    bodies = []
+    for player in players:
+        player_id = f'{player.tournament}_{player.fid}'
+        if player.id != player_id:
+            log.warning('player id was wrong, fixing', id=player.id, expected=player_id)
+            player.id = player_id
+        bodies.append(player.model_dump(mode='json'))
+    log.debug('set players', count=len(bodies))
+
+    for i in range(0, len(bodies), WRITE_BATCH_SIZE):
+        supabase.table('player').upsert(bodies[i:i + WRITE_BATCH_SIZE]).execute()
+
+
+@_local
+def set_match(supabase: Backend, match: Match):
     match_id = f'{match.tournament}_{match.round}_{match.slot}'
     if match.id != match_id:
-        print(f'warning: match id was wrong {match.id} {match_id}, fixing...')
+        log.warning('match id was wrong, fixing', id=match.id, expected=match_id)
         match.id = match_id
     body = match.model_dump(mode='json', exclude_none=True)
-    print(f'set match {body}')
+    log.debug('set match', match=body)
     res = supabase.table('match').upsert(body).execute()
     return res
 
 
-def get_moves(supabase: Client, match_id: str) -> list[Move]:
-    res = supabase.table('move').select('*').eq('match', match_id).execute()
-    if not res.data:
-        return []
-    return [Move(**d) for d in res.data]
+@_local
+def set_matches(supabase: Backend, matches: list[Match], ignore_duplicates: bool = False):
+    # bulk upsert, all rows must share the same keys so nulls are written explicitly
+    bodies = []
+    for match in matches:
+        match_id = f'{match.tournament}_{match.round}_{match.slot}'
+        if match.id != match_id:
+            log.warning('match id was wrong, fixing', id=match.id, expected=match_id)
+            match.id = match_id
+        bodies.append(match.model_dump(mode='json'))
+    log.debug('set matches', count=len(bodies))
+
+    for i in range(0, len(bodies), WRITE_BATCH_SIZE):
+        supabase.table('match').upsert(bodies[i:i + WRITE_BATCH_SIZE], ignore_duplicates=ignore_duplicates).execute()
+
+
+def get_moves(supabase: Backend, match_id: str) -> list[Move]:
+    if isinstance(supabase, Store):
+        moves = supabase.get_moves(match_id)
+    else:
+        res = supabase.table('move').select('*').eq('match', match_id).execute()
+        moves = [Move(**d) for d in res.data] if res.data else []
+    journal = get_move_journal()
+    if journal is None:
+        return moves
+    return _with_pending(moves, journal.pending([match_id]).get(match_id))
+
+
+def get_moves_for_matches(supabase: Backend, match_ids: list[str]) -> dict[str, list[Move]]:
+    if isinstance(supabase, Store):
+        moves = supabase.get_moves_for_matches(match_ids)
+    else:
+        moves = {match_id: [] for match_id in match_ids}
+        for batch in _batches(match_ids):
+            rows = _select_all(lambda: supabase.table('move').select('*').in_('match', batch).order('id'))
+            for d in rows:
+                moves[d['match']].append(Move(**d))
+    journal = get_move_journal()
+    if journal is not None:
+        for match_id, pending in journal.pending(match_ids).items():
+            moves[match_id] = _with_pending(moves[match_id], pending)
+    return moves
 
 
-def set_move(supabase: Client, move: Move):
+@_local
+def set_move(supabase: Backend, move: Move):
     move_id = f'{move.match}_{move.user}_{move.turn}'
     if move.id != move_id:
-        print(f'warning: move id was wrong {move.id} {move_id}, fixing...')
+        log.warning('move id was wrong, fixing', id=move.id, expected=move_id)
         move.id = move_id
 
     body = move.model_dump(mode='json')
-    print(f'set move {body}')
+    log.debug('set move', move=body)
     res = supabase.table('move').insert(body).execute()
     return res
+
+
+@_local
+def set_moves(supabase: Backend, moves: list[Move]) -> list[Move]:
+    # bulk insert, an existing identical row is a harmless journal replay, returns moves that lost to a different row
+    for move in moves:
+        move.id = f'{move.match}_{move.user}_{move.turn}'
+    log.debug('set moves', count=len(moves))
+
+    rejected = []
+    for i in range(0, len(moves), WRITE_BATCH_SIZE):
+        batch = moves[i:i + WRITE_BATCH_SIZE]
+        res = supabase.table('move').upsert(
+            [m.model_dump(mode='json') for m in batch], ignore_duplicates=True).execute()
+
+        # only inserted rows come back, check what the rest collided with
+        inserted = {d['id'] for d in res.data or []}
+        conflicts = [m for m in batch if m.id not in inserted]
+        if not conflicts:
+            continue
+        res = supabase.table('move').select('*').in_('id', [m.id for m in conflicts]).execute()
+        existing = {d['id']: Move(**d) for d in res.data or []}
+        rejected.extend(m for m in conflicts if not _same_move(m, existing.get(m.id)))
+    return rejected
+
+
+def queue_move(supabase: Backend, move: Move):
+    # accept a move into the journal when buffering is enabled, otherwise write through
+    journal = get_move_journal()
+    if journal is None:
+        return set_move(supabase, move)
+
+    move_id = f'{move.match}_{move.user}_{move.turn}'
+    if move.id != move_id:
+        log.warning('move id was wrong, fixing', id=move.id, expected=move_id)
+        move.id = move_id
+
+    # the journal rejects ids it has buffered, check storage for moves written before it or through set_move
+    if any(m.id == move.id for m in get_moves(supabase, move.match)):
+        raise ValueError(f'duplicate move {move.id}')
+    log.debug('queue move', move=move.id)
+    journal.append(move)
+
+
+def _same_move(a: Move, b: Move) -> bool:
+    return b is not None and a.move == b.move and a.signature == b.signature
+
+
+def get_move_journal() -> MoveJournal:
+    global _journal
+    if MOVE_JOURNAL is None:
+        return None
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = MoveJournal(
+                    MOVE_JOURNAL,
+                    lambda moves: set_moves(get_backend(), moves),
+                    flush_size=MOVE_FLUSH_SIZE,
+                    flush_interval=MOVE_FLUSH_INTERVAL
+                )
+    return _journal
+
+
+def _with_pending(moves: list[Move], pending: list[Move]) -> list[Move]:
+    # overlay acknowledged moves that are still buffered
+    if not pending:
+        return moves
+    ids = {m.id for m in moves}
+    return sorted(moves + [m for m in pending if m.id not in ids], key=lambda m: m.id)
+
+
+def _batches(ids: list, size: int = ID_BATCH_SIZE) -> list[list]:
+    ids = list(dict.fromkeys(ids))
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def _select_all(query) -> list[dict]:
+    # page through all rows of a (freshly built, ordered) select query
+    rows = []
+    offset = 0
+    while True:
+        res = query().range(offset, offset + PAGE_SIZE - 1).execute()
+        rows.extend(res.data)
+        if len(res.data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    return rows
@@ -0,0 +1,588 @@
+"""
+local storage backends, in memory and sqlite, mirroring the supabase tables
+"""
+
+import datetime
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+from .models import Tournament, Match, Result, Move, RoundStats, TournamentState, Player
+
+
+class Store(ABC):
+    # interface for local backends, methods mirror storage functions by name minus the client argument
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    @abstractmethod
+    def set_tournament(self, tournament: Tournament):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_current_tournament(self) -> Tournament:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_tournament(self, tournament: int) -> Tournament:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_matches_count(self, tournament: int, round_: int, result: Result = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_round_stats(self, tournament: int, round_: int) -> RoundStats:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_round_stats(self, stats: RoundStats):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_state(self, tournament: int) -> TournamentState:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_state(self, state: TournamentState):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_matches_after(self, tournament: int, round_: int) -> list[Match]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_matches_for_round(self, tournament: int, round_: int) -> list[Match]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_matches_by_ids(self, match_ids: list[str]) -> dict[str, Match]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_match(self, tournament: int, round_: int, slot: int) -> Match:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_match_loser(self, tournament: int, loser: int) -> Match:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_match_last(self, tournament: int, fid: int) -> Match:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_player(self, tournament: int, fid: int) -> Player:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_players(self, players: list[Player]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_match(self, match: Match):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_matches(self, matches: list[Match], ignore_duplicates: bool = False):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_moves(self, match_id: str) -> list[Move]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_moves_for_matches(self, match_ids: list[str]) -> dict[str, list[Move]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_move(self, move: Move):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_moves(self, moves: list[Move]) -> list[Move]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_match_result(self, match: Match) -> bool:
+        # write the result and bump the round and tournament counters only if the match is still pending
+        raise NotImplementedError
+
+
+class MemoryStore(Store):
+    # rows are kept as json dicts so callers never share mutable models with the store
+    def __init__(self):
+        super().__init__()
+        self._tournaments = {}
+        self._matches = {}
+        self._moves = {}
+        self._players = {}
+        self._stats = {}
+        self._states = {}
+
+        # secondary indexes
+        self._rounds = {}  # (tournament, round) -> {slot: match id}
+        self._losers = {}  # (tournament, loser) -> {match id}
+        self._users = {}  # (tournament, fid) -> {match id}
+        self._match_moves = {}  # match id -> {move id}
+
+    def set_tournament(self, tournament: Tournament):
+        with self._lock:
+            self._tournaments[tournament.id] = _row(tournament)
+
+    def get_current_tournament(self) -> Tournament:
+        with self._lock:
+            if not self._tournaments:
+                raise Exception('could not get current tournament')
+            return Tournament(**self._tournaments[max(self._tournaments)])
+
+    def get_tournament(self, tournament: int) -> Tournament:
+        with self._lock:
+            d = self._tournaments.get(tournament)
+        if d is None:
+            raise Exception('could not get current tournament')
+        return Tournament(**d)
+
+    def get_matches_count(self, tournament: int, round_: int, result: Result = None) -> int:
+        with self._lock:
+            ids = self._rounds.get((tournament, round_), {}).values()
+            if result is None:
+                return len(ids)
+            return sum(1 for i in ids if self._matches[i]['result'] == result.value)
+
+    def get_round_stats(self, tournament: int, round_: int) -> RoundStats:
+        with self._lock:
+            d = self._stats.get(f'{tournament}_{round_}')
+        return None if d is None else RoundStats(**d)
+
+    def set_round_stats(self, stats: RoundStats):
+        stats.id = f'{stats.tournament}_{stats.round}'
+        with self._lock:
+            self._stats[stats.id] = _merge(self._stats.get(stats.id), _row(stats, exclude_none=True))
+
+    def get_state(self, tournament: int) -> TournamentState:
+        with self._lock:
+            d = self._states.get(tournament)
+        return None if d is None else TournamentState(**d)
+
+    def set_state(self, state: TournamentState):
+        with self._lock:
+            self._states[state.tournament] = _row(state)
+
+    def get_matches_after(self, tournament: int, round_: int) -> list[Match]:
+        with self._lock:
+            rows = [self._matches[i] for (t, r), slots in self._rounds.items()
+                    if t == tournament and r >= round_ for i in slots.values()]
+        return [Match(**d) for d in rows]
+
+    def get_matches_for_round(self, tournament: int, round_: int) -> list[Match]:
+        with self._lock:
+            slots = self._rounds.get((tournament, round_), {})
+            rows = [self._matches[slots[s]] for s in sorted(slots)]
+        return [Match(**d) for d in rows]
+
+    def get_matches_by_ids(self, match_ids: list[str]) -> dict[str, Match]:
+        with self._lock:
+            rows = [self._matches[i] for i in dict.fromkeys(match_ids) if i in self._matches]
+        return {d['id']: Match(**d) for d in rows}
+
+    def get_match(self, tournament: int, round_: int, slot: int) -> Match:
+        with self._lock:
+            d = self._matches.get(f'{tournament}_{round_}_{slot}')
+        return None if d is None else Match(**d)
+
+    def get_match_loser(self, tournament: int, loser: int) -> Match:
+        with self._lock:
+            rows = [self._matches[i] for i in self._losers.get((tournament, loser), ())]
+        if not rows:
+            return None
+        if len(rows) > 1:
+            raise Exception(f'multiple elimination matches {rows}')
+        return Match(**rows[0])
+
+    def get_match_last(self, tournament: int, fid: int) -> Match:
+        with self._lock:
+            p = self._players.get(f'{tournament}_{fid}')
+            if p is not None:
+                d = self._matches.get(p['match'])
+            else:
+                rows = [self._matches[i] for i in self._users.get((tournament, fid), ())]
+                d = max(rows, key=lambda r: r['round']) if rows else None
+        return None if d is None else Match(**d)
+
+    def get_player(self, tournament: int, fid: int) -> Player:
+        with self._lock:
+            d = self._players.get(f'{tournament}_{fid}')
+        return None if d is None else Player(**d)
+
+    def set_players(self, players: list[Player]):
+        with self._lock:
+            for p in players:
+                p.id = f'{p.tournament}_{p.fid}'
+                self._players[p.id] = _row(p)
+
+    def set_match(self, match: Match):
+        match.id = f'{match.tournament}_{match.round}_{match.slot}'
+        with self._lock:
+            self._put_match(_merge(self._matches.get(match.id), _row(match, exclude_none=True)))
+
+    def record_match_result(self, match: Match) -> bool:
+        # same bookkeeping as the record_match_result postgres function, nothing moves if already settled
+        now = datetime.datetime.now(datetime.timezone.utc)
+        eliminated = match.loser is not None and match.loser > 0
+        with self._lock:
+            if not self._settle_match(match):
+                return False
+            stats = self.get_round_stats(match.tournament, match.round)
+            if stats is not None:
+                stats.pending -= 1
+                stats.settled += 1
+                stats.played += int(match.result == Result.PLAYED)
+                stats.eliminated += int(eliminated)
+                stats.updated = now
+                self.set_round_stats(stats)
+
+            if eliminated:
+                p = self.get_player(match.tournament, match.loser)
+                if p is not None:
+                    p.alive = False
+                    p.updated = now
+                    self.set_players([p])
+
+            state = self.get_state(match.tournament)
+            if state is not None and state.round == match.round:
+                state.settled += 1
+                state.pending -= 1
+                state.remaining -= int(eliminated)
+                if match.round == state.rounds - 1:
+                    state.winner = match.winner
+                state.latest = match.id
+                state.latest_winner = match.winner
+                state.latest_loser = match.loser
+                state.latest_result = match.result
+                state.updated = now
+                self.set_state(state)
+        return True
+
+    def _settle_match(self, match: Match) -> bool:
+        # write the result only if the match is still pending
+        match.id = f'{match.tournament}_{match.round}_{match.slot}'
+        with self._lock:
+            d = self._matches.get(match.id)
+            if d is None or d.get('winner') is not None:
+                return False
+            self._put_match(_merge(d, _row(match, exclude_none=True)))
+            return True
+
+    def set_matches(self, matches: list[Match], ignore_duplicates: bool = False):
+        with self._lock:
+            for match in matches:
+                match.id = f'{match.tournament}_{match.round}_{match.slot}'
+                if ignore_duplicates and match.id in self._matches:
+                    continue
+                self._put_match(_row(match))
+
+    def get_moves(self, match_id: str) -> list[Move]:
+        return self.get_moves_for_matches([match_id])[match_id]
+
+    def get_moves_for_matches(self, match_ids: list[str]) -> dict[str, list[Move]]:
+        with self._lock:
+            rows = {i: [self._moves[m] for m in sorted(self._match_moves.get(i, ()))] for i in match_ids}
+        return {i: [Move(**d) for d in ds] for i, ds in rows.items()}
+
+    def set_move(self, move: Move):
+        move.id = f'{move.match}_{move.user}_{move.turn}'
+        with self._lock:
+            if move.id in self._moves:
+                raise ValueError(f'duplicate move {move.id}')
+            self._put_move(_row(move))
+
+    def set_moves(self, moves: list[Move]) -> list[Move]:
+        rejected = []
+        with self._lock:
+            for move in moves:
+                move.id = f'{move.match}_{move.user}_{move.turn}'
+                d = _row(move)
+                old = self._moves.get(move.id)
+                if old is None:
+                    self._put_move(d)
+                elif (old['move'], old['signature']) != (d['move'], d['signature']):
+                    rejected.append(move)
+        return rejected
+
+    def _put_match(self, d: dict):
+        old = self._matches.get(d['id'])
+        if old is not None and old.get('loser') is not None:
+            self._losers[(old['tournament'], old['loser'])].discard(old['id'])
+        self._matches[d['id']] = d
+        self._rounds.setdefault((d['tournament'], d['round']), {})[d['slot']] = d['id']
+        if d.get('loser') is not None:
+            self._losers.setdefault((d['tournament'], d['loser']), set()).add(d['id'])
+        for fid in (d['user0'], d['user1']):
+            self._users.setdefault((d['tournament'], fid), set()).add(d['id'])
+
+    def _put_move(self, d: dict):
+        self._moves[d['id']] = d
+        self._match_moves.setdefault(d['match'], set()).add(d['id'])
+
+
+# sqlite schema, mirrors the supabase tables with the indexes our queries need
+SQLITE_SCHEMA = '''
+create table if not exists tournament (
+    id integer primary key, created text, start text, size integer, seed integer
+);
+create table if not exists "match" (
+    id text primary key, created text, updated text, tournament integer, round integer, slot integer,
+    user0 integer, user1 integer, winner integer, loser integer, result integer
+);
+create index if not exists match_round on "match" (tournament, round, slot);
+create index if not exists match_loser on "match" (tournament, loser);
+create index if not exists match_user0 on "match" (tournament, user0, round);
+create index if not exists match_user1 on "match" (tournament, user1, round);
+create table if not exists move (
+    id text primary key, created text, "match" text, user integer, turn integer, move integer, signature text
+);
+create index if not exists move_match on move ("match", id);
+create table if not exists player (
+    id text primary key, tournament integer, fid integer, "match" text, round integer, alive integer, updated text
+);
+create table if not exists round_stats (
+    id text primary key, tournament integer, round integer, matches integer, pending integer, settled integer,
+    played integer, eliminated integer, updated text
+);
+create table if not exists tournament_state (
+    tournament integer primary key, size integer, rounds integer, round integer, remaining integer,
+    settled integer, pending integer, winner integer, latest text, latest_winner integer, latest_loser integer,
+    latest_result integer, updated text
+);
+'''
+
+
+class SqliteStore(Store):
+    def __init__(self, path: str = ':memory:'):
+        super().__init__()
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute('pragma journal_mode=wal')
+            self._conn.execute('pragma synchronous=normal')
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def set_tournament(self, tournament: Tournament):
+        self._upsert('tournament', 'id', [_row(tournament)])
+
+    def get_current_tournament(self) -> Tournament:
+        rows = self._select('select * from tournament order by id desc limit 1')
+        if not rows:
+            raise Exception('could not get current tournament')
+        return Tournament(**rows[0])
+
+    def get_tournament(self, tournament: int) -> Tournament:
+        rows = self._select('select * from tournament where id = ?', tournament)
+        if not rows:
+            raise Exception('could not get current tournament')
+        return Tournament(**rows[0])
+
+    def get_matches_count(self, tournament: int, round_: int, result: Result = None) -> int:
+        q = 'select count(*) from "match" where tournament = ? and round = ?'
+        params = [tournament, round_]
+        if result is not None:
+            q += ' and result = ?'
+            params.append(result.value)
+        with self._lock:
+            return self._conn.execute(q, params).fetchone()[0]
+
+    def get_round_stats(self, tournament: int, round_: int) -> RoundStats:
+        rows = self._select('select * from round_stats where id = ?', f'{tournament}_{round_}')
+        return RoundStats(**rows[0]) if rows else None
+
+    def set_round_stats(self, stats: RoundStats):
+        stats.id = f'{stats.tournament}_{stats.round}'
+        self._upsert('round_stats', 'id', [_row(stats, exclude_none=True)])
+
+    def get_state(self, tournament: int) -> TournamentState:
+        rows = self._select('select * from tournament_state where tournament = ?', tournament)
+        return TournamentState(**rows[0]) if rows else None
+
+    def set_state(self, state: TournamentState):
+        self._upsert('tournament_state', 'tournament', [_row(state)])
+
+    def get_matches_after(self, tournament: int, round_: int) -> list[Match]:
+        rows = self._select('select * from "match" where tournament = ? and round >= ?', tournament, round_)
+        return [Match(**d) for d in rows]
+
+    def get_matches_for_round(self, tournament: int, round_: int) -> list[Match]:
+        rows = self._select('select * from "match" where tournament = ? and round = ? order by slot', tournament, round_)
+        return [Match(**d) for d in rows]
+
+    def get_matches_by_ids(self, match_ids: list[str]) -> dict[str, Match]:
+        matches = {}
+        for batch in _chunks(list(dict.fromkeys(match_ids))):
+            rows = self._select(f'select * from "match" where id in ({",".join("?" * len(batch))})', *batch)
+            matches.update((d['id'], Match(**d)) for d in rows)
+        return matches
+
+    def get_match(self, tournament: int, round_: int, slot: int) -> Match:
+        rows = self._select('select * from "match" where id = ?', f'{tournament}_{round_}_{slot}')
+        return Match(**rows[0]) if rows else None
+
+    def get_match_loser(self, tournament: int, loser: int) -> Match:
+        rows = self._select('select * from "match" where tournament = ? and loser = ?', tournament, loser)
+        if not rows:
+            return None
+        if len(rows) > 1:
+            raise Exception(f'multiple elimination matches {rows}')
+        return Match(**rows[0])
+
+    def get_match_last(self, tournament: int, fid: int) -> Match:
+        p = self.get_player(tournament, fid)
+        if p is not None:
+            rows = self._select('select * from "match" where id = ?', p.match)
+        else:
+            rows = self._select(
+                'select * from "match" where tournament = ? and user0 = ? union all '
+                'select * from "match" where tournament = ? and user1 = ? order by round desc limit 1',
+                tournament, fid, tournament, fid
+            )
+        return Match(**rows[0]) if rows else None
+
+    def get_player(self, tournament: int, fid: int) -> Player:
+        rows = self._select('select * from player where id = ?', f'{tournament}_{fid}')
+        return Player(**rows[0]) if rows else None
+
+    def set_players(self, players: list[Player]):
+        for p in players:
+            p.id = f'{p.tournament}_{p.fid}'
+        self._upsert('player', 'id', [_row(p) for p in players])
+
+    def set_match(self, match: Match):
+        match.id = f'{match.tournament}_{match.round}_{match.slot}'
+        self._upsert('match', 'id', [_row(match, exclude_none=True)])
+
+    def record_match_result(self, match: Match) -> bool:
+        # one transaction like the postgres function, so processes sharing a database file count a match once
+        match.id = f'{match.tournament}_{match.round}_{match.slot}'
+        d = _row(match)
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        eliminated = int(match.loser is not None and match.loser > 0)
+        with self._lock:
+            self._conn.execute('begin immediate')
+            try:
+                settled = self._conn.execute(
+                    'update "match" set result = ?, winner = ?, loser = ?, updated = ? where id = ? and winner is null',
+                    [d['result'], d['winner'], d['loser'], d['updated'], match.id]
+                ).rowcount > 0
+                if settled:
+                    self._conn.execute(
+                        'update round_stats set pending = pending - 1, settled = settled + 1, played = played + ?, '
+                        'eliminated = eliminated + ?, updated = ? where id = ?',
+                        [int(match.result == Result.PLAYED), eliminated, now, f'{match.tournament}_{match.round}']
+                    )
+                    if eliminated:
+                        self._conn.execute('update player set alive = 0, updated = ? where id = ?',
+                                           [now, f'{match.tournament}_{match.loser}'])
+                    self._conn.execute(
+                        'update tournament_state set settled = settled + 1, pending = pending - 1, '
+                        'remaining = remaining - ?, winner = case when ? = rounds - 1 then ? else winner end, '
+                        'latest = ?, latest_winner = ?, latest_loser = ?, latest_result = ?, updated = ? '
+                        'where tournament = ? and round = ?',
+                        [eliminated, match.round, match.winner, match.id, match.winner, match.loser, d['result'], now,
+                         match.tournament, match.round]
+                    )
+                self._conn.execute('commit')
+            except Exception:
+                self._conn.execute('rollback')
+                raise
+        return settled
+
+    def set_matches(self, matches: list[Match], ignore_duplicates: bool = False):
+        for match in matches:
+            match.id = f'{match.tournament}_{match.round}_{match.slot}'
+        self._upsert('match', 'id', [_row(m) for m in matches], ignore=ignore_duplicates)
+
+    def get_moves(self, match_id: str) -> list[Move]:
+        rows = self._select('select * from move where "match" = ? order by id', match_id)
+        return [Move(**d) for d in rows]
+
+    def get_moves_for_matches(self, match_ids: list[str]) -> dict[str, list[Move]]:
+        moves = {match_id: [] for match_id in match_ids}
+        for batch in _chunks(list(moves)):
+            rows = self._select(
+                f'select * from move where "match" in ({",".join("?" * len(batch))}) order by id', *batch)
+            for d in rows:
+                moves[d['match']].append(Move(**d))
+        return moves
+
+    def set_move(self, move: Move):
+        move.id = f'{move.match}_{move.user}_{move.turn}'
+        d = _row(move)
+        cols = ', '.join(f'"{c}"' for c in d)
+        try:
+            with self._lock:
+                self._conn.execute(f'insert into move ({cols}) values ({",".join("?" * len(d))})', list(d.values()))
+        except sqlite3.IntegrityError:
+            raise ValueError(f'duplicate move {move.id}')
+
+    def set_moves(self, moves: list[Move]) -> list[Move]:
+        for move in moves:
+            move.id = f'{move.match}_{move.user}_{move.turn}'
+        rows = [_row(m) for m in moves]
+        self._upsert('move', 'id', rows, ignore=True)
+
+        # read back, anything that differs from the stored row lost to an earlier write
+        rejected = []
+        for batch in _chunks(list(zip(moves, rows))):
+            stored = {d['id']: (d['move'], d['signature']) for d in self._select(
+                f'select id, move, signature from move where id in ({",".join("?" * len(batch))})',
+                *[m.id for m, _ in batch])}
+            rejected.extend(m for m, d in batch if stored.get(m.id) != (d['move'], d['signature']))
+        return rejected
+
+    def _select(self, q: str, *params) -> list[dict]:
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(q, params).fetchall()]
+
+    def _upsert(self, table: str, key: str, rows: list[dict], ignore: bool = False):
+        # columns missing from a row keep their existing values, like a postgrest upsert of a partial body
+        groups = {}
+        for d in rows:
+            groups.setdefault(tuple(d), []).append(d)
+        with self._lock:
+            self._conn.execute('begin')
+            try:
+                for cols, group in groups.items():
+                    names = ', '.join(f'"{c}"' for c in cols)
+                    if ignore:
+                        conflict = 'do nothing'
+                    else:
+                        conflict = 'do update set ' + ', '.join(f'"{c}" = excluded."{c}"' for c in cols if c != key)
+                    q = (f'insert into "{table}" ({names}) values ({",".join("?" * len(cols))}) '
+                         f'on conflict ("{key}") {conflict}')
+                    self._conn.executemany(q, [[d[c] for c in cols] for d in group])
+                self._conn.execute('commit')
+            except Exception:
+                self._conn.execute('rollback')
+                raise
+
+
+def _row(model, exclude_none: bool = False) -> dict:
+    # timestamptz semantics, naive datetimes are taken as utc
+    d = model.model_dump(mode='json', exclude_none=exclude_none)
+    for k, v in model:
+        if isinstance(v, datetime.datetime) and v.tzinfo is None and k in d:
+            d[k] = v.replace(tzinfo=datetime.timezone.utc).isoformat()
+    return d
+
+
+def _merge(old: dict, new: dict) -> dict:
+    if old is None:
+        return new
+    d = dict(old)
+    d.update(new)
+    return d
+
+
+def _chunks(ids: list, size: int = 500) -> list[list]:
+    # stay under the sqlite bound parameter limit
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
@@ -2,11 +2,84 @@
 methods to query farcaster data from the warpcast api
 """
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from .models import User, WarpProfile, WarpBio, WarpLocation
+from .cache import LRUCache
+from .log import get_logger
+
+log = get_logger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 4096))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 3600))
+FETCH_WORKERS = 16
+FETCH_TIMEOUT = 5
 
-from .models import User
+# shared keep-alive session and profile cache
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS))
+_users = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='warpcast')
 
 
 def get_user(fid: int) -> User:
-    res = requests.get('https://client.warpcast.com/v2/user', params={'fid': fid})
+    u = _users.get(fid)
+    if u is None:
+        u = fetch_user(fid)
+        _users.set(fid, u)
+    return u
+
+
+def get_users(fids: list[int], timeout: float = None, fallback: bool = True) -> dict[int, User]:
+    # deduplicate, serve from cache, then fetch all misses concurrently
+    users = {}
+    missing = []
+    for fid in dict.fromkeys(fids):
+        u = _users.get(fid)
+        if u is None:
+            missing.append(fid)
+        else:
+            users[fid] = u
+
+    futures = {fid: _executor.submit(fetch_user, fid) for fid in missing}
+    if timeout is None:
+        for fid, f in futures.items():
+            users[fid] = f.result()
+            _users.set(fid, users[fid])
+        return users
+
+    # with a timeout, slow or failed lookups fall back to a placeholder profile, or are left out without fallback.
+    # lookups still queued at the deadline are dropped
+    deadline = time.monotonic() + timeout
+    for fid, f in futures.items():
+        try:
+            users[fid] = f.result(timeout=max(0.0, deadline - time.monotonic()))
+            _users.set(fid, users[fid])
+        except Exception as e:
+            f.cancel()
+            log.warning('failed to get user', fid=fid, error=repr(e))
+            if fallback:
+                users[fid] = placeholder_user(fid)
+
+    return users
+
+
+def placeholder_user(fid: int) -> User:
+    return User(
+        fid=fid,
+        displayName=f'fid {fid}',
+        profile=WarpProfile(bio=WarpBio(text=''), location=WarpLocation(placeId='', description='')),
+        followerCount=0,
+        followingCount=0,
+        activeOnFcNetwork=False
+    )
+
+
+def fetch_user(fid: int) -> User:
+    res = _session.get('https://client.warpcast.com/v2/user', params={'fid': fid}, timeout=FETCH_TIMEOUT)
     return User(**res.json()['result']['user'])
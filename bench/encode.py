@@ -0,0 +1,141 @@
+"""
+image encoding benchmark, encode time and response size per output format for each renderer
+
+python -m bench.encode
+python -m bench.encode --formats png:3,png_palette:64,webp:90 --kinds match --save
+"""
+
+import os
+import json
+import time
+import argparse
+import datetime
+import platform
+
+import numpy as np
+import cv2
+
+from api.render import Encoding, encode_image, draw_home, draw_message, draw_match, draw_bracket, PFP_SZ
+from api.models import Match, MatchState, MatchStatus, Gesture, Result, Pfp
+from api.warpcast import placeholder_user
+from bench.util import RESULTS_DIR, git_commit
+from bench.micro import measure
+
+FORMATS = [
+    'png:1', 'png:3', 'png:6', 'png:9',
+    'png_palette:16', 'png_palette:64', 'png_palette:256',
+    'jpeg:75', 'jpeg:90',
+    'webp:75', 'webp:90', 'webp:101'
+]
+KINDS = ['match', 'home', 'bracket']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rock paper scissors image encoding benchmark')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='comma separated encodings, format[:quality]')
+    parser.add_argument('--kinds', default=','.join(KINDS), help='comma separated renderers')
+    parser.add_argument('--save', action='store_true', help=f'write results to {RESULTS_DIR}')
+    args = parser.parse_args()
+
+    result = run_encode(args.formats.split(','), args.kinds.split(','))
+    print_result(result)
+    if args.save:
+        print(f'saved {save_result(result)}')
+
+
+def run_encode(formats: list[str], kinds: list[str]) -> dict:
+    encodings = [Encoding.parse(f) for f in formats]
+    images = sample_images()
+    results = {}
+    for kind in kinds:
+        im = images[kind]
+        rows = {}
+        for e in encodings:
+            b = encode_image(im, e)
+            rows[e.spec] = {
+                'content_type': e.content_type,
+                'encode_ms': round(measure(lambda: encode_image(im, e)) * 1000, 3),
+                'bytes': len(b),
+                'error': round(error(im, b), 3)
+            }
+        results[kind] = rows
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'platform': platform.platform()
+        },
+        'kinds': results
+    }
+
+
+def sample_images() -> dict[str, np.ndarray]:
+    # representative frames, drawn once and encoded repeatedly
+    now = datetime.datetime.now(datetime.timezone.utc)
+    u0, u1 = placeholder_user(12), placeholder_user(99)
+    u0.displayName, u1.displayName = 'rockenjoyer', 'scissorhands'
+    u0.pfp = Pfp(url='https://example.com/12.png', verified=False)
+    u1.pfp = Pfp(url='https://example.com/99.png', verified=False)
+    match = Match(id='1_3_7', created=now, updated=now, tournament=1, round=3, slot=7, user0=u0.fid,
+                  user1=u1.fid, result=Result.PENDING)
+    state = MatchState(match=match.id, turn=1, status=MatchStatus.DRAW, history0=[Gesture.ROCK],
+                       history1=[Gesture.ROCK])
+    pfps = {u0.pfp.url: photo(0), u1.pfp.url: photo(1)}
+
+    bracket = {}
+    users = {}
+    for i in range(5):
+        bracket[i] = {}
+        for slot in range(16 // 2 ** i):
+            fid0, fid1 = 1000 + 64 * i + 2 * slot, 1000 + 64 * i + 2 * slot + 1
+            users[fid0] = placeholder_user(fid0)
+            users[fid1] = placeholder_user(fid1)
+            users[fid0].displayName, users[fid1].displayName = f'player{fid0}', f'player{fid1}'
+            bracket[i][slot] = Match(
+                id=f'1_{i}_{slot}', created=now, updated=now, tournament=1, round=i, slot=slot, user0=fid0,
+                user1=fid1, result=Result.PLAYED if i < 2 else Result.PENDING, winner=fid0 if i < 2 else None,
+                loser=fid1 if i < 2 else None
+            )
+
+    return {
+        'match': draw_match(match, u0, u1, 3, state, 7215, pfps=pfps),
+        'home': draw_home(1, 2 ** 16, 3, '500k $DEGEN', 8192),
+        'bracket': draw_bracket(bracket, users, 2),
+        'message': draw_message('The tournament has not started yet.', 'Check back soon!')
+    }
+
+
+def photo(seed: int) -> np.ndarray:
+    # smooth gradients with sensor noise, compresses like a profile photo rather than a flat fill
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:PFP_SZ, 0:PFP_SZ] / PFP_SZ
+    base = np.stack([np.sin(3 * x + seed), np.cos(2 * y - seed), np.sin(x * y * 5)], axis=2) * 90 + 128
+    im = base + rng.normal(0, 6, base.shape)
+    return np.clip(im, 0, 255).astype(np.uint8)
+
+
+def error(im: np.ndarray, b: bytes) -> float:
+    # mean absolute difference per channel after a decode round trip, zero for lossless formats
+    decoded = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return float(np.abs(decoded.astype(np.int16) - im.astype(np.int16)).mean())
+
+
+def save_result(result: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f'encode_{result["meta"]["commit"]}_{int(time.time())}.json')
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    return out
+
+
+def print_result(result: dict):
+    print(f'{"image":<10}{"encoding":<18}{"type":<12}{"encode ms":>10}{"bytes":>10}{"error":>8}')
+    for kind, rows in result['kinds'].items():
+        for spec, r in rows.items():
+            print(f'{kind:<10}{spec:<18}{r["content_type"]:<12}{r["encode_ms"]:>10}{r["bytes"]:>10}{r["error"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
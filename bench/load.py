@@ -0,0 +1,291 @@
+"""
+end to end load benchmark, drives the flask app against a local storage backend
+
+python -m bench.load --size 65536 --backend sqlite --path /tmp/rps-bench.db
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import threading
+import contextlib
+
+import numpy as np
+
+from api import index, storage, warpcast, render
+from api.store import Store
+from api.models import Tournament, MatchStatus
+from api.rps import ROUND_START, ROUND_DURATION, total_rounds
+from bench.util import RESULTS_DIR, git_commit
+
+MAX_SIZE = 2 ** 20
+CRON_SECRET = 'bench'
+
+# share of requests by kind, roughly what a round looks like from the frame server
+MIX = {
+    'match': 0.35,
+    'move': 0.3,
+    'spectate': 0.1,
+    'render_match': 0.2,
+    'render_home': 0.03,
+    'render_bracket': 0.02
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rock paper scissors load benchmark')
+    parser.add_argument('--size', type=int, default=4096, help=f'tournament size, up to {MAX_SIZE}')
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--path', default=None, help='sqlite database file, in memory if omitted')
+    parser.add_argument('--requests', type=int, default=None,
+                        help='requests per round, defaults to two per player left in the round')
+    parser.add_argument('--max-requests', type=int, default=20000, help='cap on requests per round')
+    parser.add_argument('--rounds', type=int, default=None, help='number of rounds to run, defaults to all')
+    parser.add_argument('--mix', default=None, help='traffic mix, e.g. match=0.5,move=0.5')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default=None, help='name for the saved result, defaults to git commit')
+    parser.add_argument('--compare', default=None, help='previous result file to compare against')
+    parser.add_argument('--verbose', action='store_true', help='keep app logging')
+    args = parser.parse_args()
+
+    if not 2 <= args.size <= MAX_SIZE:
+        raise ValueError(f'size must be between 2 and {MAX_SIZE}')
+    mix = parse_mix(args.mix) if args.mix else MIX
+
+    result = run_load(
+        args.size,
+        backend=args.backend,
+        path=args.path,
+        requests_per_round=args.requests,
+        max_requests=args.max_requests,
+        rounds=args.rounds,
+        mix=mix,
+        seed=args.seed,
+        verbose=args.verbose
+    )
+    print_result(result)
+    out = save_result(result, args.label)
+    print(f'saved {out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_compare(json.load(f), result)
+
+
+def run_load(
+        size: int,
+        backend: str = 'memory',
+        path: str = None,
+        requests_per_round: int = None,
+        max_requests: int = 20000,
+        rounds: int = None,
+        mix: dict = None,
+        seed: int = 0,
+        verbose: bool = False
+) -> dict:
+    rng = random.Random(seed)
+    mix = mix or MIX
+    kinds, weights = list(mix), list(mix.values())
+    rounds = min(rounds or total_rounds(size), total_rounds(size))
+
+    # offline app against a fresh local store
+    offline()
+    store = storage.create_store(backend, path)
+    calls = count_calls(store)
+    storage.STORAGE_BACKEND = backend
+    storage._client = store
+    os.environ['CRON_SECRET'] = CRON_SECRET
+    client = index.app.test_client()
+    log = None if verbose else open(os.devnull, 'w')
+
+    samples = {}
+    t_start = time.perf_counter()
+    for r in range(rounds):
+        set_round(store, size, r)
+
+        # round job settles the previous round and materializes this one
+        sample(samples, 'job_round', calls, log, lambda: client.post(
+            '/jobs/round', headers={'Authorization': f'Bearer {CRON_SECRET}'}))
+
+        matches = storage.get_matches_for_round(store, 1, r)
+        fids = [f for m in matches for f in (m.user0, m.user1) if f > 0]
+        n = requests_per_round or 2 * len(fids)
+        n = min(n, max_requests)
+        print(f'round {r}: {len(matches)} matches, {len(fids)} players, {n} requests')
+
+        for kind in rng.choices(kinds, weights=weights, k=n):
+            req = request_for(kind, rng, r, size, matches, fids)
+            sample(samples, kind, calls, log, lambda: client.open(**req))
+
+    wall = time.perf_counter() - t_start
+    if log is not None:
+        log.close()
+
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': size,
+            'backend': backend,
+            'rounds': rounds,
+            'requests_per_round': requests_per_round,
+            'max_requests': max_requests,
+            'mix': mix,
+            'seed': seed
+        },
+        'total': summarize([s for k, v in samples.items() if k != 'job_round' for s in v], wall),
+        'endpoints': {k: summarize(v) for k, v in samples.items()}
+    }
+
+
+def request_for(kind: str, rng: random.Random, round_: int, size: int, matches: list, fids: list) -> dict:
+    if kind == 'match':
+        # mostly players in the round, some eliminated or not entered
+        fid = rng.choice(fids) if rng.random() < 0.9 else rng.randint(1, size + 10)
+        return {'path': '/match', 'method': 'POST', 'data': frame_message(fid, 1)}
+    if kind == 'move':
+        fid = rng.choice(fids)
+        return {'path': '/move', 'method': 'POST', 'data': frame_message(fid, rng.randint(1, 3))}
+    if kind == 'spectate':
+        m = rng.choice(matches)
+        return {'path': f'/spectate/1/{round_}/{m.slot}', 'method': 'POST'}
+    if kind == 'render_match':
+        m = rng.choice(matches)
+        status = rng.choice([MatchStatus.NEW, MatchStatus.USER_0_PLAYED, MatchStatus.DRAW]).value
+        return {'path': f'/render/match/1/{round_}/{m.slot}/{rng.randint(0, 2)}/{m.user0}/{status}/im.png',
+                'method': 'GET'}
+    if kind == 'render_home':
+        return {'path': '/render/tournament/1/im.png', 'method': 'GET'}
+    if kind == 'render_bracket':
+        return {'path': '/render/bracket/1/im.png', 'method': 'GET'}
+    raise ValueError(f'unknown request kind {kind}')
+
+
+def frame_message(fid: int, button: int) -> str:
+    return json.dumps({
+        'untrustedData': {
+            'fid': fid,
+            'url': 'http://localhost/',
+            'messageHash': f'0x{fid:040x}',
+            'timestamp': int(time.time()),
+            'network': 1,
+            'buttonIndex': button,
+            'castId': {'fid': 1, 'hash': '0x0'}
+        },
+        'trustedData': {'messageBytes': f'{fid:064x}'}
+    })
+
+
+def sample(samples: dict, kind: str, calls: list, log, send):
+    c0 = calls[0]
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(log) if log is not None else contextlib.nullcontext():
+        res = send()
+    dt = time.perf_counter() - t0
+    samples.setdefault(kind, []).append((dt, calls[0] - c0, res.status_code))
+
+
+def summarize(samples: list, wall: float = None) -> dict:
+    if not samples:
+        return {'requests': 0}
+    lat = np.array([s[0] for s in samples]) * 1000
+    db = np.array([s[1] for s in samples])
+    status = {}
+    for s in samples:
+        status[str(s[2])] = status.get(str(s[2]), 0) + 1
+    wall = wall if wall is not None else lat.sum() / 1000
+    return {
+        'requests': len(samples),
+        'seconds': round(wall, 4),
+        'rps': round(len(samples) / wall, 2),
+        'mean_ms': round(float(lat.mean()), 3),
+        'p50_ms': round(float(np.percentile(lat, 50)), 3),
+        'p95_ms': round(float(np.percentile(lat, 95)), 3),
+        'p99_ms': round(float(np.percentile(lat, 99)), 3),
+        'db_calls': round(float(db.mean()), 2),
+        'status': status
+    }
+
+
+def set_round(store: Store, size: int, round_: int):
+    # shift tournament start so the wall clock sits early in the requested round
+    now = int(time.time())
+    boundary = now - (now - ROUND_START) % ROUND_DURATION
+    start = datetime.datetime.fromtimestamp(boundary - round_ * ROUND_DURATION, tz=datetime.timezone.utc)
+    storage.set_tournament(store, Tournament(id=1, created=start, start=start, size=size))
+
+
+def count_calls(store: Store) -> list:
+    # count every storage call made against the store
+    calls = [0]
+    lock = threading.Lock()
+
+    def counted(fn):
+        def wrapper(*args, **kwargs):
+            with lock:
+                calls[0] += 1
+            return fn(*args, **kwargs)
+        return wrapper
+
+    for name in dir(Store):
+        if not name.startswith('_') and callable(getattr(Store, name)):
+            setattr(store, name, counted(getattr(store, name)))
+    return calls
+
+
+def offline():
+    # serve profiles and pictures locally so the benchmark measures this app, not upstream apis
+    im = np.full((render.PFP_SZ, render.PFP_SZ, 3), 128, dtype=np.uint8)
+
+    warpcast.fetch_user = warpcast.placeholder_user
+    render.fetch_pfp = lambda url: im.copy()
+
+
+def parse_mix(mix: str) -> dict:
+    parsed = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        if kind not in MIX:
+            raise ValueError(f'unknown request kind {kind}')
+        parsed[kind] = float(weight)
+    return parsed
+
+
+def save_result(result: dict, label: str = None) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    m = result['meta']
+    name = f'load_{label or m["commit"]}_{m["backend"]}_{m["size"]}_{int(time.time())}.json'
+    out = os.path.join(RESULTS_DIR, name)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    return out
+
+
+def print_result(result: dict):
+    print(f'{"endpoint":<16}{"requests":>10}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"db/req":>8}')
+    rows = list(result['endpoints'].items()) + [('total', result['total'])]
+    for kind, s in rows:
+        print(f'{kind:<16}{s["requests"]:>10}{s["rps"]:>10}{s["p50_ms"]:>10}{s["p95_ms"]:>10}{s["p99_ms"]:>10}'
+              f'{s["db_calls"]:>8}')
+
+
+def print_compare(prev: dict, curr: dict):
+    print(f'compare {prev["meta"]["commit"]} -> {curr["meta"]["commit"]}')
+    prev_rows = dict(prev['endpoints'], total=prev['total'])
+    curr_rows = dict(curr['endpoints'], total=curr['total'])
+    for kind, s in curr_rows.items():
+        p = prev_rows.get(kind)
+        if p is None or not p.get('requests'):
+            continue
+        print(f'{kind:<16}rps {p["rps"]:>9} -> {s["rps"]:<9} p95 {p["p95_ms"]:>8} -> {s["p95_ms"]:<8} '
+              f'db/req {p["db_calls"]} -> {s["db_calls"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+microbenchmarks for the per request bracket math and match resolution
+
+python -m bench.micro           compare against the saved baseline, exit 1 on regression
+python -m bench.micro --save    record a new baseline
+"""
+
+import os
+import sys
+import json
+import random
+import timeit
+import argparse
+import datetime
+import platform
+import contextlib
+
+from api.models import Match, Move, MatchState, MatchStatus, Gesture, Result
+from api.rps import match_slot, parent_slots, round_size, total_rounds, resolve_match, resolve_match_state
+from bench.util import git_commit
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+THRESHOLD = 1.5  # fail when a case gets this much slower than baseline, after machine calibration
+RETRIES = 3  # re-measure regressed cases before failing, timings on shared machines are noisy
+SIZES = [2, 2 ** 4, 2 ** 8, 2 ** 12, 2 ** 16, 2 ** 20, 2 ** 24]
+DRAWS = [0, 1, 4, 16, 64]
+BATCH = 1000  # inputs per timed call
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rock paper scissors microbenchmarks')
+    parser.add_argument('--save', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--filter', default=None, help='only run cases containing this string')
+    args = parser.parse_args()
+
+    result = run_micro(args.filter)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print_result(result)
+        print(f'saved baseline {args.baseline}')
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, result, args.threshold)
+    print_result(result, baseline)
+    for _ in range(RETRIES):
+        if not regressions:
+            break
+        # each retry measures its own calibration, so a slow spell on a shared machine is scaled out rather than
+        # compared against calibration from another moment. a case fails only if it regresses on every attempt
+        retry = run_micro(names=regressions)
+        print(f're-measured {len(regressions)} cases')
+        print_result(retry, baseline)
+        regressions = [k for k in compare(baseline, retry, args.threshold) if k in regressions]
+    if regressions:
+        print(f'{len(regressions)} regressions over {args.threshold}x baseline: {", ".join(regressions)}')
+        sys.exit(1)
+    print('no regressions')
+
+
+def run_micro(name_filter: str = None, names: list[str] = None) -> dict:
+    # calibration is sampled between cases and the best kept, a single sample taken during a slow spell skews every
+    # scaled ratio of the run
+    times = {'calibration': measure(calibration)}
+    with open(os.devnull, 'w') as log, contextlib.redirect_stdout(log):
+        for name, fn in cases().items():
+            if names is not None and name not in names:
+                continue
+            if name_filter is None or name_filter in name:
+                times[name] = measure(fn) / BATCH
+                times['calibration'] = min(times['calibration'], measure(calibration))
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'ns': {k: round(v * 1e9, 1) for k, v in times.items()}
+    }
+
+
+def cases() -> dict:
+    # each case processes BATCH inputs per call
+    rng = random.Random(0)
+    c = {}
+    for total in SIZES:
+        rounds = total_rounds(total)
+        fids = [rng.randint(1, total) for _ in range(BATCH)]
+        rs = [rng.randrange(rounds) for _ in range(BATCH)]
+        c[f'match_slot/{total}'] = lambda total=total, fids=fids, rs=rs: [
+            match_slot(total, r, f) for r, f in zip(rs, fids)]
+
+        later = [(r, rng.randrange(round_size(total, r) // 2)) for r in (rng.randrange(1, rounds) for _ in range(
+            BATCH))] if rounds > 1 else []
+        if later:
+            c[f'parent_slots/{total}'] = lambda total=total, later=later: [
+                parent_slots(total, r, s) for r, s in later]
+
+        c[f'round_size/{total}'] = lambda total=total, rs=rs: [round_size(total, r) for r in rs]
+
+    for draws in DRAWS:
+        match, moves = draw_chain(draws)
+        c[f'resolve_match_state/{draws}'] = lambda match=match, moves=moves: [
+            resolve_match_state(match, moves) for _ in range(BATCH)]
+
+        state = resolve_match_state(match, moves) if draws < 64 else MatchState(
+            match=match.id, turn=draws, status=MatchStatus.DRAW)
+        matches = [match.model_copy() for _ in range(BATCH)]
+        c[f'resolve_match/{draws}'] = lambda matches=matches, state=state: [
+            resolve_match(m.round + 1, m.model_copy(), state) for m in matches]
+    return c
+
+
+def draw_chain(draws: int) -> (Match, list[Move]):
+    # a match with the given number of drawn turns followed by a deciding turn
+    match = Match(id='1_3_7', created=0, updated=0, tournament=1, round=3, slot=7, user0=12, user1=99,
+                  result=Result.PENDING)
+    moves = []
+    for turn in range(draws + 1):
+        g0 = Gesture.ROCK
+        g1 = Gesture.ROCK if turn < draws else Gesture.SCISSORS
+        for fid, g in ((match.user0, g0), (match.user1, g1)):
+            moves.append(Move(id=f'{match.id}_{fid}_{turn}', created=0, match=match.id, user=fid, turn=turn, move=g,
+                              signature='0x'))
+    return match, moves
+
+
+def calibration():
+    # fixed pure python workload, used to scale baselines recorded on other machines
+    x = 0
+    for i in range(BATCH * 10):
+        x = (x * 31 + i) & 0xffff
+    return x
+
+
+def measure(fn) -> float:
+    # best of several repeats, seconds per call
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=7, number=number)) / number
+
+
+def compare(baseline: dict, result: dict, threshold: float = THRESHOLD) -> list[str]:
+    base, curr = baseline['ns'], result['ns']
+    scale = curr['calibration'] / base['calibration']
+    return [k for k, v in curr.items()
+            if k != 'calibration' and k in base and v / scale > threshold * base[k]]
+
+
+def print_result(result: dict, baseline: dict = None):
+    curr = result['ns']
+    base = baseline['ns'] if baseline else {}
+    scale = curr['calibration'] / base['calibration'] if base else 1.0
+    print(f'{"case":<28}{"ns/op":>12}{"baseline":>12}{"ratio":>8}')
+    for k, v in curr.items():
+        if k in base:
+            print(f'{k:<28}{v:>12}{base[k]:>12}{v / scale / base[k]:>8.2f}')
+        else:
+            print(f'{k:<28}{v:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,10 @@ import time
 
 import requests
 
-from api.warpcast import get_user
+from api.warpcast import get_user, get_users
 from api.models import User, Match, Result, MatchStatus, MatchState, Gesture
 from api.render import render_match, render_bracket
-from api.storage import get_supabase, get_matches_count
+from api.storage import get_backend, get_matches_count
 from api.rps import get_final_bracket
 
 
@@ -41,16 +41,14 @@ def render_test_match():
 
 
 def render_test_bracket():
-    s = get_supabase()
+    s = get_backend()
     bracket = get_final_bracket(s, 5, 32)
     print(bracket)
-    users = {}
+    fids = []
     for _, r in bracket.items():
         for _, m in r.items():
-            if m.user0 not in users:
-                users[m.user0] = get_user(m.user0)
-            if m.user1 not in users:
-                users[m.user1] = get_user(m.user1)
+            fids.extend([m.user0, m.user1])
+    users = get_users(fids)
 
     render_bracket(bracket, users, 1)
 
@@ -0,0 +1,61 @@
+"""
+scheduled jobs for tournament management
+"""
+
+import json
+import time
+import argparse
+
+from api.storage import get_backend, get_tournament
+from api.rps import current_round, advance_round, settle_round, refresh_tournament_state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rock paper scissors tournament jobs')
+    sub = parser.add_subparsers(dest='job', required=True)
+
+    p = sub.add_parser('advance', help='materialize all matches for a round')
+    p.add_argument('tournament', type=int)
+    p.add_argument('--round', type=int, default=None, help='round to create, defaults to current round')
+
+    p = sub.add_parser('settle', help='score all pending matches of a finished round')
+    p.add_argument('tournament', type=int)
+    p.add_argument('--round', type=int, default=None, help='round to settle, defaults to previous round')
+
+    args = parser.parse_args()
+    if args.job == 'advance':
+        run_advance(args.tournament, args.round)
+    elif args.job == 'settle':
+        run_settle(args.tournament, args.round)
+
+
+def run_advance(tournament: int, round_: int = None):
+    now = int(time.time())
+    s = get_backend()
+    t = get_tournament(s, tournament)
+    r = current_round(int(t.start.timestamp()), now)
+    if round_ is None:
+        round_ = r
+
+    t0 = time.perf_counter()
+    matches = advance_round(s, now, t.id, t.size, r, round_)
+    print(f'advance tournament {t.id} round {round_}: created {len(matches)} matches '
+          f'in {time.perf_counter() - t0:.3f}s')
+    refresh_tournament_state(s, now, t, r)
+
+
+def run_settle(tournament: int, round_: int = None):
+    now = int(time.time())
+    s = get_backend()
+    t = get_tournament(s, tournament)
+    r = current_round(int(t.start.timestamp()), now)
+    if round_ is None:
+        round_ = r - 1
+
+    report = settle_round(s, now, t.id, r, round_)
+    print(json.dumps(report, indent=2))
+    refresh_tournament_state(s, now, t, r)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+-- maintained per round match counters
+create table if not exists round_stats (
+    id text primary key,  -- {tournament}_{round}
+    tournament bigint not null references tournament (id),
+    round integer not null,
+    matches integer not null default 0,
+    pending integer not null default 0,
+    settled integer not null default 0,
+    played integer not null default 0,
+    eliminated integer not null default 0,
+    updated timestamptz not null default now()
+);
+
+-- atomic increment when a single match settles (no-op if the round has no counters yet)
+create or replace function increment_round_stats(
+    stats_id text,
+    d_pending integer,
+    d_settled integer,
+    d_played integer,
+    d_eliminated integer
+) returns void as $$
+    update round_stats set
+        pending = pending + d_pending,
+        settled = settled + d_settled,
+        played = played + d_played,
+        eliminated = eliminated + d_eliminated,
+        updated = now()
+    where id = stats_id;
+$$ language sql;
+
+-- settle a pending match, true only for the call that moved it from pending to settled so concurrent readers
+-- resolving the same match bump the counters once
+create or replace function settle_match(
+    p_match text,
+    p_result integer,
+    p_winner bigint,
+    p_loser bigint,
+    p_updated timestamptz
+) returns boolean as $$
+begin
+    update match set
+        result = p_result,
+        winner = p_winner,
+        loser = p_loser,
+        updated = p_updated
+    where id = p_match and winner is null;
+    return found;
+end;
+$$ language plpgsql;
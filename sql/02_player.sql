@@ -0,0 +1,10 @@
+-- per user index of where each player currently is in a tournament
+create table if not exists player (
+    id text primary key,  -- {tournament}_{fid}
+    tournament bigint not null references tournament (id),
+    fid bigint not null,
+    match text not null references match (id),
+    round integer not null,
+    alive boolean not null default true,
+    updated timestamptz not null default now()
+);
@@ -0,0 +1,52 @@
+-- single row materialized tournament state, kept up to date as matches settle
+create table if not exists tournament_state (
+    tournament bigint primary key references tournament (id),
+    size integer not null,
+    rounds integer not null,
+    round integer not null,
+    remaining integer not null,
+    settled integer not null default 0,
+    pending integer not null default 0,
+    winner bigint,
+    latest text,
+    latest_winner bigint,
+    latest_loser bigint,
+    latest_result integer,
+    updated timestamptz not null default now()
+);
+
+-- settle a single match and record it against round counters, player index and tournament state in one call,
+-- counters only move when this call settled the match (returns false if it was already settled)
+drop function if exists record_match_result(bigint, integer, text, integer, bigint, bigint);
+create or replace function record_match_result(
+    p_tournament bigint,
+    p_round integer,
+    p_match text,
+    p_result integer,
+    p_winner bigint,
+    p_loser bigint,
+    p_updated timestamptz
+) returns boolean as $$
+begin
+    if not settle_match(p_match, p_result, p_winner, p_loser, p_updated) then
+        return false;
+    end if;
+    perform increment_round_stats(
+        p_tournament || '_' || p_round, -1, 1, (p_result = 1)::integer, (p_loser > 0)::integer
+    );
+    update player set alive = false, updated = now()
+    where id = p_tournament || '_' || p_loser and p_loser > 0;
+    update tournament_state set
+        settled = settled + 1,
+        pending = pending - 1,
+        remaining = remaining - (p_loser > 0)::integer,
+        winner = case when p_round = rounds - 1 then p_winner else winner end,
+        latest = p_match,
+        latest_winner = p_winner,
+        latest_loser = p_loser,
+        latest_result = p_result,
+        updated = now()
+    where tournament = p_tournament and round = p_round;
+    return true;
+end;
+$$ language plpgsql;
@@ -0,0 +1,12 @@
+-- shared generation counters for per worker caches, a worker drops its cache when the counter moves
+create table if not exists cache_generation (
+    name text primary key,
+    generation bigint not null default 0,
+    updated timestamptz not null default now()
+);
+
+create or replace function bump_cache_generation(p_name text) returns bigint as $$
+    insert into cache_generation (name, generation) values (p_name, 1)
+    on conflict (name) do update set generation = cache_generation.generation + 1, updated = now()
+    returning generation;
+$$ language sql;
@@ -0,0 +1,33 @@
+"""
+smoke test for the load benchmark harness
+"""
+
+# src
+from api import storage, warpcast, render
+from bench.load import run_load, summarize
+
+
+class TestLoadBench(object):
+    def test_small(self, monkeypatch):
+        # run_load swaps in a local store and offline fetchers, restore them after
+        monkeypatch.setattr(storage, 'STORAGE_BACKEND', storage.STORAGE_BACKEND)
+        monkeypatch.setattr(storage, '_client', storage._client)
+        monkeypatch.setattr(warpcast, 'fetch_user', warpcast.fetch_user)
+        monkeypatch.setattr(render, 'fetch_pfp', render.fetch_pfp)
+        monkeypatch.setenv('CRON_SECRET', 'bench')
+
+        result = run_load(8, requests_per_round=20, seed=1)
+        assert result['meta']['rounds'] == 3
+        assert result['total']['requests'] == 60
+        assert result['endpoints']['job_round']['requests'] == 3
+        for kind, s in result['endpoints'].items():
+            assert '500' not in s['status'], kind
+            assert s['db_calls'] > 0
+
+    def test_summarize(self):
+        s = summarize([(0.001, 2, 200), (0.003, 4, 200), (0.002, 3, 403)], wall=1.0)
+        assert s['requests'] == 3
+        assert s['rps'] == 3
+        assert s['p50_ms'] == 2.0
+        assert s['db_calls'] == 3.0
+        assert s['status'] == {'200': 2, '403': 1}
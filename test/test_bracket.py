@@ -0,0 +1,152 @@
+"""
+test cases for in memory bracket engine
+"""
+
+# lib
+import math
+import pytest
+import numpy as np
+
+# src
+from api.bracket import Bracket
+from api.rps import match_slot, parent_slots, round_size, round_pairings
+from api.models import Match, Result
+
+
+def _loop_slot(total: int, round_: int, fid: int) -> int:
+    # original implementation, folds the slot once per round
+    sz = 2 ** math.ceil(math.log2(total))
+    slot = fid - 1
+    for i in range(round_ + 1):
+        slot = slot if slot < sz / 2 else sz - slot - 1
+        sz /= 2
+    return int(slot)
+
+
+class TestBracketSlot(object):
+    def test_0_33(self):
+        b = Bracket(64)
+        assert b.slot(33, 0) == 31
+
+    def test_1_32(self):
+        b = Bracket(64)
+        assert b.slot(32, 1) == 0
+
+    def test_elite8_63(self):
+        b = Bracket(64)
+        assert b.slot(63, 3) == 1
+
+    def test_final(self):
+        b = Bracket(64)
+        assert b.slot(42, 5) == 0
+
+    def test_uneven_invalid(self):
+        b = Bracket(50)
+        with pytest.raises(ValueError):
+            b.slot(51, 3)
+
+    def test_match_slot(self):
+        # against the original per round loop, for every tournament size up to 299
+        for total in range(2, 300):
+            b = Bracket(total)
+            for r in range(b.rounds + 1):
+                for fid in range(1, total + 1):
+                    expected = _loop_slot(total, r, fid)
+                    assert match_slot(total, r, fid) == expected
+                    assert b.slot(fid, r) == expected
+
+    def test_vectorized(self):
+        for total in [2, 3, 17, 100, 299, 1000]:
+            b = Bracket(total)
+            fids = np.arange(1, total + 1)
+            for r in range(b.rounds + 1):
+                expected = [_loop_slot(total, r, int(f)) for f in fids]
+                assert b.slots(fids, r).tolist() == expected
+
+    def test_known(self):
+        assert [match_slot(8, 0, f) for f in range(1, 9)] == [0, 1, 2, 3, 3, 2, 1, 0]
+        assert [match_slot(8, 1, f) for f in range(1, 9)] == [0, 1, 1, 0, 0, 1, 1, 0]
+        assert [match_slot(5, 0, f) for f in range(1, 6)] == [0, 1, 2, 3, 3]
+        assert [match_slot(64, 2, f) for f in [1, 9, 16, 33, 64]] == [0, 7, 0, 0, 0]
+
+    def test_large(self):
+        total = 3_000_000
+        b = Bracket(total)
+        fids = np.array([1, 2, 1_048_577, 2_999_999, 3_000_000])
+        for r in [0, 5, 20, 21]:
+            assert b.slots(fids, r).tolist() == [match_slot(total, r, int(f)) for f in fids]
+
+
+class TestBracketParents(object):
+    def test_1_8(self):
+        b = Bracket(64)
+        assert b.parents(1, 8) == (8, 23)
+
+    def test_final_uneven(self):
+        b = Bracket(48)
+        assert b.parents(5, 0) == (0, 1)
+
+    def test_final_invalid(self):
+        b = Bracket(64)
+        with pytest.raises(ValueError):
+            b.parents(5, 1)
+
+    def test_parent_slots(self):
+        b = Bracket(80)
+        for r in range(1, b.rounds):
+            slots = np.arange(round_size(80, r) // 2)
+            a, c = b.parents_many(r, slots)
+            for s in slots:
+                assert (a[s], c[s]) == parent_slots(80, r, int(s))
+
+
+class TestBracketUsers(object):
+    def test_first_round(self):
+        b = Bracket(50)
+        fid0, fid1 = b.users_many(0, np.arange(32))
+        e0, e1 = round_pairings(50, 0)
+        assert fid0.tolist() == e0.tolist()
+        assert fid1.tolist() == e1.tolist()
+        assert b.users(0, 0) == (1, 0)  # bye
+        assert b.users(0, 14) == (15, 50)
+
+    def test_advance(self):
+        b = Bracket(8)
+        b.set_winners(0, np.arange(4), np.array([1, 7, 3, 5]))
+        assert b.users(1, 0) == (1, 5)
+        assert b.users(1, 1) == (7, 3)
+        assert b.remaining == 4
+        assert b.alive(7)
+        assert not b.alive(2)
+        assert b.alive_many(np.array([1, 2, 3, 4])).tolist() == [True, False, True, False]
+        assert b.alive_fids().tolist() == [1, 3, 5, 7]
+
+    def test_champion(self):
+        b = Bracket(4)
+        assert b.champion() is None
+        b.set_winner(0, 0, 1)
+        b.set_winner(0, 1, 3)
+        b.set_winner(1, 0, 3)
+        assert b.champion() == 3
+        assert b.remaining == 1
+        assert b.eliminated[1] == 1
+        assert b.eliminated[2] == 0
+
+    def test_invalid_winner(self):
+        b = Bracket(8)
+        with pytest.raises(ValueError):
+            b.set_winner(0, 0, 2)
+
+    def test_from_matches(self):
+        matches = [
+            Match(id='1_0_0', created=0, updated=0, tournament=1, round=0, slot=0, user0=1, user1=0,
+                  winner=1, loser=0, result=Result.BYE),
+            Match(id='1_0_1', created=0, updated=0, tournament=1, round=0, slot=1, user0=2, user1=3,
+                  winner=3, loser=2, result=Result.PLAYED),
+            Match(id='1_1_0', created=0, updated=0, tournament=1, round=1, slot=0, user0=1, user1=3,
+                  result=Result.PENDING),
+        ]
+        b = Bracket.from_matches(3, matches)
+        assert b.users(1, 0) == (1, 3)
+        assert b.remaining == 2
+        assert b.alive_fids().tolist() == [1, 3]
@@ -0,0 +1,242 @@
+"""
+test cases for caching utilities
+"""
+
+# lib
+import os
+import time
+import pytest
+import numpy as np
+
+# src
+from api.cache import LRUCache, DiskCache
+from api import warpcast, render, storage, neynar
+
+
+class TestLRUCache(object):
+    def test_get_set(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+        assert c.get('a') == 1
+        assert c.get('b') is None
+        assert c.hits == 1
+        assert c.misses == 1
+
+    def test_evict(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')  # a now most recent
+        c.set('c', 3)
+        assert c.get('a') == 1
+        assert c.get('b') is None
+        assert c.get('c') == 3
+        assert len(c) == 2
+
+    def test_ttl(self):
+        c = LRUCache(maxsize=2, ttl=0.01)
+        c.set('a', 1)
+        c.set('b', 2, ttl=60)
+        time.sleep(0.02)
+        assert c.get('a') is None
+        assert c.get('b') == 2
+
+    def test_maxbytes(self):
+        c = LRUCache(maxsize=100, maxbytes=10)
+        c.set('a', b'12345')
+        c.set('b', b'1234')
+        assert c.nbytes == 9
+        c.set('c', b'12')
+        assert c.get('a') is None
+        assert c.nbytes == 6
+        c.set('d', b'12345678901')  # too big to ever fit
+        assert c.get('d') is None
+        assert c.get('b') == b'1234'
+
+    def test_pop(self):
+        c = LRUCache()
+        c.set('a', 1)
+        assert c.pop('a') == 1
+        assert c.get('a') is None
+
+
+class TestGetUsers(object):
+    def test_dedupe(self, monkeypatch):
+        fetched = []
+
+        def fetch(fid):
+            fetched.append(fid)
+            return f'user{fid}'
+
+        monkeypatch.setattr(warpcast, 'fetch_user', fetch)
+        monkeypatch.setattr(warpcast, '_users', LRUCache())
+
+        users = warpcast.get_users([3, 1, 3, 2, 1])
+        assert users == {3: 'user3', 1: 'user1', 2: 'user2'}
+        assert sorted(fetched) == [1, 2, 3]
+
+        users = warpcast.get_users([2, 4])
+        assert users == {2: 'user2', 4: 'user4'}
+        assert sorted(fetched) == [1, 2, 3, 4]  # only miss fetched
+
+
+class TestDiskCache(object):
+    def test_get_set(self, tmp_path):
+        c = DiskCache(str(tmp_path))
+        assert c.get('a') is None
+        c.set('a', b'abc')
+        assert c.get('a') == b'abc'
+        c.pop('a')
+        assert c.get('a') is None
+
+    def test_evict(self, tmp_path):
+        # least recently read files go first once the byte budget is exceeded
+        c = DiskCache(str(tmp_path), maxbytes=250)
+        now = time.time()
+        c.set('a', b'a' * 100)
+        c.set('b', b'b' * 100)
+        os.utime(c.path('a'), (now - 20, now - 20))
+        os.utime(c.path('b'), (now - 10, now - 10))
+        assert c.get('a') is not None
+        c.set('c', b'c' * 100)
+        assert c.get('b') is None
+        assert c.get('a') is not None and c.get('c') is not None
+        assert c.nbytes == 200
+
+
+class TestPfpCache(object):
+    def test_levels(self, monkeypatch, tmp_path):
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            return np.full((render.PFP_SZ, render.PFP_SZ, 3), 7, dtype=np.uint8)
+
+        monkeypatch.setattr(render, 'fetch_pfp', fetch)
+        monkeypatch.setattr(render, '_pfps', LRUCache(maxbytes=2 ** 20, sizeof=lambda im: im.nbytes))
+        monkeypatch.setattr(render, '_pfps_disk', DiskCache(str(tmp_path)))
+
+        im = render.get_pfp('https://example.com/a.png')
+        assert im.shape == (render.PFP_SZ, render.PFP_SZ, 3)
+        assert render.get_pfp('https://example.com/a.png') is im  # memory
+        assert len(fetched) == 1
+
+        render._pfps.clear()
+        im = render.get_pfp('https://example.com/a.png')  # disk
+        assert len(fetched) == 1
+        assert np.all(im == 7)
+
+    def test_timeout_fallback(self, monkeypatch):
+        def fetch(fid):
+            if fid == 2:
+                raise Exception('not found')
+            if fid == 3:
+                time.sleep(0.5)
+            return f'user{fid}'
+
+        monkeypatch.setattr(warpcast, 'fetch_user', fetch)
+        monkeypatch.setattr(warpcast, '_users', LRUCache())
+
+        users = warpcast.get_users([1, 2, 3], timeout=0.1)
+        assert users[1] == 'user1'
+        assert users[2].fid == 2
+        assert users[2].displayName == 'fid 2'
+        assert users[3].displayName == 'fid 3'
+        assert warpcast._users.get(2) is None  # placeholder not cached
+
+        monkeypatch.setattr(warpcast, '_users', LRUCache())
+        users = warpcast.get_users([1, 2, 3], timeout=0.1, fallback=False)
+        assert list(users) == [1]
+
+
+class TestTournamentCache(object):
+    @staticmethod
+    def _client(queries: list, generation: list):
+        class Query(object):
+            def __init__(self, table):
+                self.table = table
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self
+
+            def execute(self):
+                queries.append(self.table)
+                if self.table == 'cache_generation':
+                    rows = [{'generation': generation[0]}]
+                else:
+                    rows = [{'id': 3, 'created': 0, 'start': 0, 'size': 64}]
+                return type('Response', (object,), {'data': rows})
+
+        class Client(object):
+            def table(self, name):
+                return Query(name)
+
+        return Client()
+
+    def test_cached(self, monkeypatch):
+        queries = []
+        monkeypatch.setattr(storage, '_tournaments', LRUCache(ttl=60))
+        monkeypatch.setattr(storage, '_generation', None)
+        monkeypatch.setattr(storage, '_generation_checked', 0.0)
+        s = self._client(queries, [0])
+        t = storage.get_current_tournament(s)
+        assert t.id == 3
+        assert storage.get_current_tournament(s) is t
+        assert storage.get_tournament(s, 3) is t
+        assert queries == ['cache_generation', 'tournament']
+
+        storage.invalidate_tournament(3)
+        storage.get_tournament(s, 3)
+        storage.get_current_tournament(s)
+        assert queries.count('tournament') == 3
+
+    def test_generation(self, monkeypatch):
+        # another worker bumping the shared generation drops this worker's cache on its next check
+        queries = []
+        generation = [4]
+        monkeypatch.setattr(storage, '_tournaments', LRUCache(ttl=60))
+        monkeypatch.setattr(storage, '_generation', None)
+        monkeypatch.setattr(storage, 'TOURNAMENT_CACHE_CHECK', 0)
+        s = self._client(queries, generation)
+        storage.get_tournament(s, 3)
+        storage.get_tournament(s, 3)
+        assert queries.count('tournament') == 1
+
+        generation[0] = 5
+        storage.get_tournament(s, 3)
+        assert queries.count('tournament') == 2
+
+
+class TestNeynarCache(object):
+    def test_retry(self, monkeypatch):
+        fetched = []
+
+        def fetch(msg):
+            fetched.append(msg)
+            return msg == 'aa', None
+
+        monkeypatch.setattr(neynar, 'fetch_frame_action', fetch)
+        monkeypatch.setattr(neynar, '_validated', LRUCache())
+
+        assert neynar.get_frame_action('aa') == (True, None)
+        assert neynar.get_frame_action('aa') == (True, None)  # retried post
+        assert neynar.get_frame_action('bb') == (False, None)
+        assert neynar.get_frame_action('bb') == (False, None)
+        assert fetched == ['aa', 'bb']
+
+    def test_error_not_cached(self, monkeypatch):
+        calls = []
+
+        def fetch(msg):
+            calls.append(msg)
+            if len(calls) == 1:
+                raise Exception('neynar unavailable')
+            return True, None
+
+        monkeypatch.setattr(neynar, 'fetch_frame_action', fetch)
+        monkeypatch.setattr(neynar, '_validated', LRUCache())
+
+        with pytest.raises(Exception):
+            neynar.get_frame_action('aa')
+        assert neynar.get_frame_action('aa') == (True, None)
+        assert len(calls) == 2
@@ -0,0 +1,146 @@
+"""
+test cases for buffered move ingestion
+"""
+
+# lib
+import datetime
+import pytest
+
+# src
+from api import storage
+from api.journal import MoveJournal
+from api.models import Move, Gesture
+
+
+def _move(match: str, fid: int, turn: int, g: Gesture = Gesture.ROCK) -> Move:
+    return Move(
+        id=f'{match}_{fid}_{turn}',
+        created=datetime.datetime(2024, 3, 1),
+        match=match,
+        user=fid,
+        turn=turn,
+        move=g,
+        signature='0x'
+    )
+
+
+class TestMoveJournal(object):
+    def test_append(self, tmp_path):
+        j = MoveJournal(str(tmp_path / 'moves.db'), lambda moves: None)
+        j.append(_move('1_0_3', 7, 0))
+        j.append(_move('1_0_3', 8, 0))
+        j.append(_move('1_0_4', 9, 0))
+        assert len(j) == 3
+        pending = j.pending(['1_0_3', '1_0_5'])
+        assert [m.id for m in pending['1_0_3']] == ['1_0_3_7_0', '1_0_3_8_0']
+        assert '1_0_5' not in pending
+
+    def test_duplicate(self, tmp_path):
+        written = []
+        j = MoveJournal(str(tmp_path / 'moves.db'), written.extend)
+        j.append(_move('1_0_3', 7, 0))
+        with pytest.raises(ValueError):
+            j.append(_move('1_0_3', 7, 0, Gesture.PAPER))
+        assert j.flush() == 1
+        with pytest.raises(ValueError):
+            j.append(_move('1_0_3', 7, 0, Gesture.PAPER))  # already written
+        j.append(_move('1_0_3', 7, 1))
+        assert len(j) == 1
+
+    def test_flush(self, tmp_path):
+        written = []
+        j = MoveJournal(str(tmp_path / 'moves.db'), lambda moves: written.append([m.id for m in moves]))
+        j.append(_move('1_0_3', 7, 0))
+        j.append(_move('1_0_3', 8, 0))
+        assert j.flush() == 2
+        assert j.flush() == 0
+        assert written == [['1_0_3_7_0', '1_0_3_8_0']]
+        assert len(j) == 0
+        assert j.pending(['1_0_3']) == {}
+
+    def test_retain(self, tmp_path):
+        # written ids are forgotten after the retention window
+        j = MoveJournal(str(tmp_path / 'moves.db'), lambda moves: None, retain=0)
+        j.append(_move('1_0_3', 7, 0))
+        j.flush()
+        j.flush()
+        j.append(_move('1_0_3', 7, 0))
+        assert len(j) == 1
+
+    def test_failed_flush(self, tmp_path):
+        written = []
+
+        def write(moves):
+            if not written:
+                written.append(None)
+                raise Exception('storage unavailable')
+            written.extend(moves)
+
+        j = MoveJournal(str(tmp_path / 'moves.db'), write, flush_interval=60)
+        j.append(_move('1_0_3', 7, 0))
+        with pytest.raises(Exception):
+            j.flush()
+        assert len(j) == 1  # still buffered and visible
+        assert j.flush() == 1
+        assert len(j) == 0
+
+    def test_replay(self, tmp_path):
+        path = str(tmp_path / 'moves.db')
+        j = MoveJournal(path, lambda moves: None, flush_interval=60)
+        j.append(_move('1_0_3', 7, 0))
+        j.append(_move('1_0_3', 8, 0))
+        j.close()
+
+        written = []
+        j = MoveJournal(path, written.extend, flush_interval=60)
+        assert [m.id for m in j.pending(['1_0_3'])['1_0_3']] == ['1_0_3_7_0', '1_0_3_8_0']
+        j.flush()
+        assert len(written) == 2
+
+    def test_workers(self, tmp_path):
+        # workers on a host share the buffer, a move id is claimed once and visible to all of them
+        path = str(tmp_path / 'moves.db')
+        written = []
+        j0 = MoveJournal(path, written.extend, flush_interval=60)
+        j1 = MoveJournal(path, written.extend, flush_interval=60)
+        j0.append(_move('1_0_3', 7, 0))
+        with pytest.raises(ValueError):
+            j1.append(_move('1_0_3', 7, 0, Gesture.PAPER))
+        j1.append(_move('1_0_3', 8, 0))
+        assert [m.id for m in j0.pending(['1_0_3'])['1_0_3']] == ['1_0_3_7_0', '1_0_3_8_0']
+
+        # one flush writes every worker's moves
+        assert j0.flush() == 2
+        assert [m.id for m in written] == ['1_0_3_7_0', '1_0_3_8_0']
+        assert j1.flush() == 0
+        with pytest.raises(ValueError):
+            j1.append(_move('1_0_3', 7, 0))
+
+
+class TestQueueMove(object):
+    def test_visible(self, monkeypatch, tmp_path):
+        class Res(object):
+            data = [_move('1_0_3', 8, 0).model_dump(mode='json')]
+
+        class Query(object):
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self
+
+            def execute(self):
+                return Res()
+
+        class Client(object):
+            def table(self, name):
+                return Query()
+
+        j = MoveJournal(str(tmp_path / 'moves.db'), lambda moves: None, flush_interval=60)
+        monkeypatch.setattr(storage, 'get_move_journal', lambda: j)
+
+        storage.queue_move(Client(), _move('1_0_3', 7, 0))
+        moves = storage.get_moves(Client(), '1_0_3')
+        assert [m.id for m in moves] == ['1_0_3_7_0', '1_0_3_8_0']
+
+        # already written by another worker, never reached this journal
+        with pytest.raises(ValueError):
+            storage.queue_move(Client(), _move('1_0_3', 8, 0, Gesture.PAPER))
+        assert len(j) == 1
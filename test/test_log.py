@@ -0,0 +1,66 @@
+"""
+test cases for structured logging
+"""
+
+# lib
+import json
+
+# src
+from api import log as logging_
+from api.log import get_logger, start_request
+from api.index import app
+
+
+class Expensive(object):
+    def __str__(self):
+        raise AssertionError('formatted a disabled record')
+
+
+def _records(out: str) -> list[dict]:
+    return [json.loads(line) for line in out.splitlines() if line.startswith('{')]
+
+
+class TestLogger(object):
+    def test_lazy(self, capsys, monkeypatch):
+        monkeypatch.setattr(logging_, 'LOG_LEVEL', logging_.INFO)
+        log = get_logger('api.test')
+        start_request(sampled=False)
+        log.debug('skipped %s', Expensive(), value=Expensive())
+        assert capsys.readouterr().out == ''
+
+    def test_fields(self, capsys, monkeypatch):
+        monkeypatch.setattr(logging_, 'LOG_LEVEL', logging_.INFO)
+        log = get_logger('api.test')
+        ctx = start_request(sampled=False)
+        log.info('played %s', 'rock', fid=3, match='1_0_2')
+        r = _records(capsys.readouterr().out)[0]
+        assert r['msg'] == 'played rock'
+        assert r['level'] == 'info'
+        assert r['fid'] == 3
+        assert r['match'] == '1_0_2'
+        assert r['request'] == ctx.id
+
+    def test_sampled(self, capsys, monkeypatch):
+        monkeypatch.setattr(logging_, 'LOG_LEVEL', logging_.WARNING)
+        log = get_logger('api.test')
+        start_request(sampled=True)
+        log.debug('kept')
+        start_request(sampled=False)
+        log.debug('dropped')
+        log.info('dropped')
+        assert [r['msg'] for r in _records(capsys.readouterr().out)] == ['kept']
+
+
+class TestRequestSummary(object):
+    def test_summary(self, capsys, monkeypatch):
+        monkeypatch.setattr(logging_, 'LOG_LEVEL', logging_.INFO)
+        monkeypatch.setattr(logging_, 'LOG_SAMPLE_RATE', 0.0)
+        res = app.test_client().get('/render/message/2/im.png')
+        assert res.status_code == 200
+        records = [r for r in _records(capsys.readouterr().out) if r['msg'] == 'request']
+        assert len(records) == 1
+        r = records[0]
+        assert r['path'] == '/render/message/2/im.png'
+        assert r['status'] == 200
+        assert r['ms'] > 0
+        assert 'render_cache' in r['stages']
@@ -4,10 +4,11 @@ test cases for match gameplay logic utilities
 
 # lib
 import time
+import random
 import pytest
 
 # src
-from api.rps import resolve_match, resolve_match_state
+from api.rps import resolve_match, resolve_match_state, resolve_match_states
 from api.models import Match, MatchStatus, MatchState, Move, Gesture, Result
 
 
@@ -395,3 +396,82 @@ class TestResolveState(object):
         # too many user0 moves
         with pytest.raises(Exception):
             resolve_match_state(match, moves)
+
+
+class TestResolveStates(object):
+    def _match(self, i: int = 0) -> Match:
+        t = int(time.time())
+        return Match(
+            id=f'abcd{i}',
+            created=t,
+            updated=t,
+            tournament=1,
+            round=2,
+            slot=i,
+            user0=7,
+            user1=8,
+            result=Result.PENDING
+        )
+
+    def _moves(self, match: Match, moves: list[tuple]) -> list[Move]:
+        t = int(time.time())
+        return [
+            Move(id=f'{match.id}_{u}_{turn}_{j}', created=t, match=match.id, turn=turn, user=u, move=g, signature='0x')
+            for j, (u, turn, g) in enumerate(moves)
+        ]
+
+    def _assert_same(self, match: Match, moves: list[Move], state):
+        try:
+            expected = resolve_match_state(match, moves)
+        except Exception:
+            assert isinstance(state, Exception)
+            return
+        assert not isinstance(state, Exception)
+        assert state == expected
+
+    def test_cases(self):
+        cases = [
+            [],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.ROCK), (8, 1, Gesture.PAPER), (7, 1, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.ROCK), (7, 1, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.ROCK), (8, 1, Gesture.PAPER), (7, 1, Gesture.PAPER),
+             (8, 2, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.ROCK), (8, 1, Gesture.SCISSORS), (7, 1, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 1, Gesture.ROCK), (8, 1, Gesture.SCISSORS), (7, 2, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.ROCK), (7, 1, Gesture.SCISSORS), (7, 1, Gesture.PAPER)],
+            [(7, 0, Gesture.ROCK), (8, 0, Gesture.PAPER), (7, 1, Gesture.SCISSORS), (8, 1, Gesture.PAPER)],
+            [(7, 0, Gesture.SCISSORS), (8, 0, Gesture.PAPER), (8, 1, Gesture.PAPER)],
+        ]
+        matches = [self._match(i) for i in range(len(cases))]
+        moves = {m.id: self._moves(m, c) for m, c in zip(matches, cases)}
+
+        states = resolve_match_states(matches, moves)
+
+        assert len(states) == len(matches)
+        for m, state in zip(matches, states):
+            self._assert_same(m, moves[m.id], state)
+
+        assert states[4].status == MatchStatus.SETTLED
+        assert states[4].winner == 8
+        assert isinstance(states[5], Exception)  # misaligned turns
+        assert isinstance(states[6], Exception)  # too many user0 moves
+        assert isinstance(states[7], Exception)  # moves after settled
+        assert isinstance(states[8], Exception)  # mismatched counts after settled
+
+    def test_random(self):
+        rng = random.Random(42)
+        matches = [self._match(i) for i in range(500)]
+        moves = {}
+        for m in matches:
+            c = []
+            for turn in range(rng.randint(0, 6)):
+                for u in (7, 8):
+                    if rng.random() < 0.9:
+                        c.append((u, turn if rng.random() < 0.97 else turn + 1, Gesture(rng.randint(1, 3))))
+            rng.shuffle(c)
+            moves[m.id] = self._moves(m, c)
+
+        states = resolve_match_states(matches, moves)
+
+        for m, state in zip(matches, states):
+            self._assert_same(m, moves[m.id], state)
@@ -0,0 +1,62 @@
+"""
+test cases for render stage timing
+"""
+
+# src
+from api import metrics, render
+from api.index import app
+from api.metrics import Histogram, Timings, stage, timed_render
+
+
+class TestHistogram(object):
+    def test_quantile(self):
+        h = Histogram()
+        assert h.quantile(0.5) is None
+        for ms in [0.05, 0.3, 0.3, 4, 40, 40, 40, 40, 40, 9000]:
+            h.observe(ms)
+        assert h.count == 10
+        assert h.quantile(0.1) == 0.1
+        assert h.quantile(0.5) == 50
+        assert h.quantile(0.99) == float('inf')
+        snap = h.snapshot()
+        assert snap['buckets']['50'] == 5
+        assert snap['buckets']['inf'] == 1
+
+
+class TestStages(object):
+    def test_render_totals(self):
+        metrics.reset_histograms()
+        t = metrics.start_timings()
+
+        @timed_render('test')
+        def fn():
+            for _ in range(3):
+                with stage('text'):
+                    pass
+            with stage('encode'):
+                pass
+
+        fn()
+        fn()
+        hist = metrics.get_histograms()
+        assert hist['text']['count'] == 2  # once per render, not per call
+        assert hist['render_test']['count'] == 2
+        assert set(t.stages) == {'text', 'encode', 'render_test'}
+
+    def test_server_timing(self):
+        t = Timings()
+        t.add('encode', 1.234)
+        t.add('text', 0.5)
+        t.add('text', 0.5)
+        assert t.server_timing() == 'encode;dur=1.23, text;dur=1.00'
+
+    def test_response_header(self):
+        render._renders.clear()
+        res = app.test_client().get('/render/message/1/im.png')
+        assert res.status_code == 200
+        timing = res.headers['Server-Timing']
+        for name in ['render_cache', 'background', 'text', 'encode', 'render_message']:
+            assert f'{name};dur=' in timing
+
+        res = app.test_client().get('/stats/render')
+        assert res.json['stages']['encode']['count'] >= 1
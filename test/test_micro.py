@@ -0,0 +1,30 @@
+"""
+test cases for the microbenchmark regression gate
+"""
+
+# src
+from api.rps import resolve_match_state
+from api.models import MatchStatus
+from bench.micro import compare, draw_chain
+
+
+class TestMicroBench(object):
+    def test_draw_chain(self):
+        for draws in [0, 1, 4]:
+            match, moves = draw_chain(draws)
+            state = resolve_match_state(match, moves)
+            assert state.status == MatchStatus.SETTLED
+            assert state.turn == draws
+            assert state.winner == match.user0
+
+    def test_compare(self):
+        baseline = {'ns': {'calibration': 100.0, 'a': 10.0, 'b': 10.0, 'c': 10.0}}
+        result = {'ns': {'calibration': 100.0, 'a': 14.0, 'b': 16.0, 'd': 100.0}}
+        assert compare(baseline, result, 1.5) == ['b']
+
+    def test_compare_calibrated(self):
+        # twice as slow machine, twice as slow cases is not a regression
+        baseline = {'ns': {'calibration': 100.0, 'a': 10.0}}
+        result = {'ns': {'calibration': 200.0, 'a': 25.0}}
+        assert compare(baseline, result, 1.5) == []
+        assert compare(baseline, result, 1.2) == ['a']
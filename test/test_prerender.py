@@ -0,0 +1,87 @@
+"""
+test cases for round start pre-rendering
+"""
+
+# lib
+import time
+import pytest
+
+# src
+from api import storage, warpcast, render, index
+from api.cache import LRUCache, DiskCache
+from api.prerender import prerender_round
+from bench.load import set_round
+
+
+@pytest.fixture
+def tournament(monkeypatch, tmp_path):
+    # fresh memory store with round 0 materialized, offline profiles and an empty render store
+    store = storage.create_store('memory')
+    monkeypatch.setattr(storage, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(storage, '_client', store)
+    monkeypatch.setattr(warpcast, 'fetch_user', warpcast.placeholder_user)
+    monkeypatch.setattr(render, '_renders', LRUCache(maxsize=1024))
+    monkeypatch.setattr(render, '_renders_disk', DiskCache(str(tmp_path)))
+    monkeypatch.setenv('CRON_SECRET', 'test')
+    set_round(store, 8, 0)
+    res = index.app.test_client().post('/jobs/round', headers={'Authorization': 'Bearer test'})
+    assert res.status_code == 200
+    return store, storage.get_current_tournament(store)
+
+
+class TestPrerender(object):
+    def test_round(self, tournament, monkeypatch):
+        store, t = tournament
+        now = int(time.time())
+        report = prerender_round(store, now, t, 0, workers=1)
+        assert report['matches'] == 4
+        assert report['rendered'] == 4 * 2
+        assert report['failed'] == 0
+
+        # every match perspective is served from the store for the rest of the round, only the countdown is drawn
+        def fail(*args, **kwargs):
+            raise AssertionError('rendered on request')
+
+        monkeypatch.setattr(index, 'render_match_base', fail)
+        client = index.app.test_client()
+        for later in [0, 600, 3 * 3600]:
+            monkeypatch.setattr(render, '_renders', LRUCache(maxsize=1024))
+            monkeypatch.setattr(index.time, 'time', lambda: now + later)
+            for m in storage.get_matches_for_round(store, t.id, 0):
+                for fid in [m.user0, m.user1]:
+                    res = client.get(f'/render/match/{t.id}/0/{m.slot}/0/{fid}/0/im.png')
+                    assert res.status_code == 200
+                    assert res.data.startswith(b'\x89PNG')
+
+    def test_missing_profile(self, tournament, monkeypatch):
+        # a match with a profile that could not be fetched is left to render on request
+        store, t = tournament
+
+        def fetch_user(fid):
+            if fid == 1:
+                raise Exception('profile unavailable')
+            return warpcast.placeholder_user(fid)
+
+        monkeypatch.setattr(warpcast, 'fetch_user', fetch_user)
+        monkeypatch.setattr(warpcast, '_users', LRUCache(maxsize=1024))
+        report = prerender_round(store, int(time.time()), t, 0, workers=1)
+        assert report['missed_profiles'] == 1
+        assert report['rendered'] == 3 * 2
+
+    def test_skip(self, tournament):
+        store, t = tournament
+        now = int(time.time())
+        prerender_round(store, now, t, 0, workers=1)
+        report = prerender_round(store, now + 600, t, 0, workers=1)
+        assert report['rendered'] == 0
+        assert report['skipped'] == 8
+
+    def test_pool(self, tournament, tmp_path):
+        # workers write straight into the shared disk store
+        store, t = tournament
+        report = prerender_round(store, int(time.time()), t, 0, workers=2)
+        assert report['rendered'] == 8
+        assert report['failed'] == 0
+        files = [p for p in tmp_path.rglob('*') if p.is_file()]
+        assert len(files) == 8
+        assert all(p.read_bytes().startswith(b'\x89PNG') for p in files)
@@ -0,0 +1,163 @@
+"""
+test cases for image rendering utilities
+"""
+
+# lib
+import time
+import pytest
+import numpy as np
+import cv2
+
+# src
+from api import render
+from api.render import match_render_key, match_base_key, render_key, countdown, get_pfps, Encoding, encode_image, \
+    quantize, draw_match, render_match_base, render_countdown
+from api.cache import LRUCache, DiskCache
+from api.models import Match, MatchState, MatchStatus, Result, User, WarpProfile, WarpBio, WarpLocation, Pfp
+
+
+def _user(fid: int, name: str, pfp: str = 'https://example.com/pfp.png') -> User:
+    return User(
+        fid=fid,
+        displayName=name,
+        pfp=Pfp(url=pfp, verified=False),
+        profile=WarpProfile(bio=WarpBio(text=''), location=WarpLocation(placeId='', description='')),
+        followerCount=0,
+        followingCount=0,
+        activeOnFcNetwork=True
+    )
+
+
+class TestMatchRenderKey(object):
+    def setup_method(self):
+        t = int(time.time())
+        self.match = Match(
+            id='1_2_1', created=t, updated=t, tournament=1, round=2, slot=1, user0=7, user1=8, result=Result.PENDING
+        )
+        self.state = MatchState(match=self.match.id, turn=0, status=MatchStatus.NEW)
+        self.u0 = _user(7, 'alice')
+        self.u1 = _user(8, 'bob')
+
+    def test_stable(self):
+        k0 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3601)
+        k1 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3630)
+        assert k0 == k1  # same countdown minute
+
+    def test_countdown(self):
+        k0 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3601)
+        k1 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3599)
+        assert k0 != k1
+        assert countdown(3599) == 3540
+        assert countdown(-5) == 0
+
+    def test_perspective(self):
+        k0 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3600)
+        k1 = match_render_key(self.match, self.u1, self.u0, 2, self.state, 3600)
+        assert k0 != k1
+
+    def test_status(self):
+        k0 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3600)
+        state = MatchState(match=self.match.id, turn=0, status=MatchStatus.USER_0_PLAYED)
+        k1 = match_render_key(self.match, self.u0, self.u1, 2, state, 3600)
+        assert k0 != k1
+
+    def test_profile(self):
+        k0 = match_render_key(self.match, self.u0, self.u1, 2, self.state, 3600)
+        u1 = _user(8, 'bob', pfp='https://example.com/new.png')
+        k1 = match_render_key(self.match, self.u0, u1, 2, self.state, 3600)
+        assert k0 != k1
+
+    def test_base(self):
+        # base image outlives the countdown, a draw changes once it can no longer be replayed
+        k0 = match_base_key(self.match, self.u0, self.u1, 2, self.state, 86000)
+        assert k0 == match_base_key(self.match, self.u0, self.u1, 2, self.state, 60)
+        assert k0 != match_render_key(self.match, self.u0, self.u1, 2, self.state, 86000)
+        state = MatchState(match=self.match.id, turn=1, status=MatchStatus.DRAW)
+        k1 = match_base_key(self.match, self.u0, self.u1, 2, state, render.ROUND_BUFFER)
+        assert k1 != match_base_key(self.match, self.u0, self.u1, 2, state, render.ROUND_BUFFER - 1)
+
+    def test_replayable(self):
+        # matches the frame's move buttons, which go away only below ROUND_BUFFER
+        assert render.replayable(render.ROUND_BUFFER + 30)
+        assert render.replayable(render.ROUND_BUFFER)
+        assert not render.replayable(render.ROUND_BUFFER - 1)
+
+    def test_countdown_overlay(self):
+        # countdown drawn over the base matches a full render
+        base = render_match_base(self.match, self.u0, self.u1, 2, self.state, 7215, pfps={})
+        b = render_countdown(base, 7215, encoding=Encoding('png'))
+        im = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(im, draw_match(self.match, self.u0, self.u1, 2, self.state, 7215, pfps={}))
+
+
+class TestGetPfps(object):
+    def test_concurrent(self, monkeypatch):
+        def get(url):
+            time.sleep(0.2)
+            return np.zeros((render.PFP_SZ, render.PFP_SZ, 3), dtype=np.uint8)
+
+        monkeypatch.setattr(render, 'get_pfp', get)
+        t0 = time.perf_counter()
+        pfps = get_pfps(['a', 'b', 'a'])
+        assert time.perf_counter() - t0 < 0.35  # slower of the two, not the sum
+        assert sorted(pfps.keys()) == ['a', 'b']
+
+    def test_fallback(self, monkeypatch):
+        def get(url):
+            if url == 'slow':
+                time.sleep(0.5)
+            if url == 'bad':
+                raise Exception('bad image')
+            return np.zeros((render.PFP_SZ, render.PFP_SZ, 3), dtype=np.uint8)
+
+        monkeypatch.setattr(render, 'get_pfp', get)
+        pfps = get_pfps(['ok', 'slow', 'bad'], timeout=0.1)
+        assert list(pfps.keys()) == ['ok']
+
+
+class TestEncoding(object):
+    def setup_method(self):
+        self.im = render.draw_message('The tournament has not started yet.', 'Check back soon!')
+
+    def test_parse(self):
+        e = Encoding.parse('webp:85')
+        assert e.format == 'webp'
+        assert e.quality == 85
+        assert e.content_type == 'image/webp'
+        assert Encoding.parse('JPEG').spec == 'jpeg:90'
+        with pytest.raises(ValueError):
+            Encoding.parse('gif')
+        with pytest.raises(ValueError):
+            Encoding.parse('png:10')
+
+    def test_formats(self):
+        for spec, magic in [('png:6', b'\x89PNG'), ('png_palette:64', b'\x89PNG'), ('jpeg:80', b'\xff\xd8'),
+                            ('webp:80', b'RIFF')]:
+            b = encode_image(self.im, Encoding.parse(spec))
+            assert b.startswith(magic)
+            decoded = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+            assert decoded.shape == self.im.shape
+
+    def test_lossless(self):
+        for spec in ['png:0', 'png:9', 'webp:101']:
+            b = encode_image(self.im, Encoding.parse(spec))
+            decoded = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+            assert np.array_equal(decoded, self.im)
+
+    def test_palette(self):
+        palette, idx = quantize(self.im, 16)
+        assert len(palette) <= 16
+        assert idx.max() < len(palette)
+        b = encode_image(self.im, Encoding.parse('png_palette:16'))
+        decoded = cv2.imdecode(np.frombuffer(b, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(decoded, palette[idx])
+        # flat background is kept exactly
+        assert np.array_equal(decoded[0, 0], self.im[0, 0])
+        assert len(b) < len(encode_image(self.im, Encoding.parse('png:1')))
+
+    def test_render_key(self, monkeypatch):
+        k0 = render_key('message', 'a', 'b')
+        monkeypatch.setitem(render.ENCODINGS, 'message', Encoding.parse('webp:90'))
+        assert render_key('message', 'a', 'b') != k0
+        assert render.content_type('message') == 'image/webp'
+        assert render.render_message('a', 'b').startswith(b'RIFF')
@@ -0,0 +1,221 @@
+"""
+test cases for local storage backends
+"""
+
+# lib
+import datetime
+import pytest
+
+# src
+from api import storage
+from api.store import Store, MemoryStore, SqliteStore
+from api.models import Tournament, Match, Move, Gesture, Result, MatchStatus
+from api.rps import (
+    advance_round,
+    settle_round,
+    submit_move,
+    update_match_result,
+    get_match_user,
+    get_tournament_state,
+    round_size,
+    RoundNotReady
+)
+
+T0 = 1709269200  # 2024-03-01 05:00 UTC, a round boundary
+DAY = 86400
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'sqlite_file'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        s = MemoryStore()
+    elif request.param == 'sqlite':
+        s = SqliteStore()
+    else:
+        s = SqliteStore(str(tmp_path / 'rps.db'))
+    storage.invalidate_tournament()
+    storage.set_tournament(s, Tournament(
+        id=1, created=datetime.datetime.utcfromtimestamp(T0 - DAY), start=datetime.datetime.utcfromtimestamp(T0),
+        size=8
+    ))
+    return s
+
+
+def _match(round_: int, slot: int, user0: int, user1: int, **kwargs) -> Match:
+    return Match(id=f'1_{round_}_{slot}', created=T0, updated=T0, tournament=1, round=round_, slot=slot,
+                 user0=user0, user1=user1, result=Result.PENDING, **kwargs)
+
+
+class TestStore(object):
+    def test_tournament(self, store):
+        assert storage.get_current_tournament(store).size == 8
+        assert storage.get_tournament(store, 1).id == 1
+        with pytest.raises(Exception):
+            storage.get_tournament(store, 2)
+
+    def test_matches(self, store):
+        storage.set_matches(store, [_match(0, 1, 2, 7), _match(0, 0, 1, 8), _match(1, 0, 1, 4)])
+        assert [m.slot for m in storage.get_matches_for_round(store, 1, 0)] == [0, 1]
+        assert len(storage.get_matches_after(store, 1, 1)) == 1
+        assert storage.get_matches_count(store, 1, 0) == 2
+        assert storage.get_matches_count(store, 1, 0, Result.PLAYED) == 0
+        assert sorted(storage.get_matches_by_ids(store, ['1_0_1', '1_1_0', '1_9_9'])) == ['1_0_1', '1_1_0']
+
+        # partial upsert keeps existing fields
+        m = storage.get_match(store, 1, 0, 1)
+        m.winner, m.loser, m.result = 7, 2, Result.PLAYED
+        storage.set_match(store, m)
+        m = storage.get_match(store, 1, 0, 1)
+        assert (m.user0, m.winner, m.result) == (2, 7, Result.PLAYED)
+        assert storage.get_match_loser(store, 1, 2).id == '1_0_1'
+        assert storage.get_matches_count(store, 1, 0, Result.PLAYED) == 1
+        assert storage.get_match_last(store, 1, 4).id == '1_1_0'
+
+        # ignore duplicates leaves the scored match alone
+        storage.set_matches(store, [_match(0, 1, 2, 7)], ignore_duplicates=True)
+        assert storage.get_match(store, 1, 0, 1).winner == 7
+
+    def test_moves(self, store):
+        m = Move(id='', created=T0, match='1_0_0', user=1, turn=0, move=Gesture.ROCK, signature='0x')
+        storage.set_move(store, m)
+        with pytest.raises(ValueError):
+            storage.set_move(store, m)
+        rejected = storage.set_moves(store, [m, Move(id='', created=T0, match='1_0_0', user=8, turn=0,
+                                                     move=Gesture.PAPER, signature='0x')])
+        assert rejected == []  # identical replay is not a conflict
+        other = Move(id='', created=T0, match='1_0_0', user=1, turn=0, move=Gesture.SCISSORS, signature='0x')
+        assert [m.id for m in storage.set_moves(store, [other])] == ['1_0_0_1_0']
+        assert storage.get_moves(store, '1_0_0')[0].move == Gesture.ROCK
+        assert [m.id for m in storage.get_moves(store, '1_0_0')] == ['1_0_0_1_0', '1_0_0_8_0']
+        moves = storage.get_moves_for_matches(store, ['1_0_0', '1_0_1'])
+        assert len(moves['1_0_0']) == 2
+        assert moves['1_0_1'] == []
+
+    def test_tournament_flow(self, store):
+        t = storage.get_tournament(store, 1)
+        now = T0 + 60
+        advance_round(store, now, t.id, t.size, 0, 0)
+        assert storage.get_matches_count(store, 1, 0) == round_size(8, 0) // 2
+
+        # one played match, one lazily scored, rest settled by the round sweep
+        m, state = get_match_user(store, now, t.id, t.size, 0, 1)
+        assert state.status == MatchStatus.NEW
+        submit_move(store, now, m.id, m.user0, 0, Gesture.ROCK, '0x')
+        submit_move(store, now, m.id, m.user1, 0, Gesture.PAPER, '0x')
+        m, state = update_match_result(store, now, 0, m)
+        assert m.result == Result.PLAYED
+        assert m.winner == 8
+
+        state = get_tournament_state(store, now, t, 0)
+        assert state.settled == 1
+        assert state.remaining == 7
+
+        now = T0 + DAY + 60
+        report = settle_round(store, now, t.id, 1, 0)
+        assert report['settled'] == 3
+        advance_round(store, now, t.id, t.size, 1, 1)
+        assert storage.get_match_last(store, 1, 1).id == m.id
+        state = get_tournament_state(store, now, t, 1)
+        assert (state.round, state.remaining, state.pending) == (1, 4, 2)
+
+    def test_round_not_ready(self, store):
+        # requests only read, materializing the round is left to the job
+        t = storage.get_tournament(store, 1)
+        with pytest.raises(RoundNotReady):
+            get_match_user(store, T0 + 60, t.id, t.size, 0, 3)
+        assert storage.get_matches_count(store, 1, 0) == 0
+
+    def test_settle_once(self, store):
+        # a second reader still holding the pending match must not move the counters again
+        t = storage.get_tournament(store, 1)
+        now = T0 + 60
+        advance_round(store, now, t.id, t.size, 0, 0)
+        get_tournament_state(store, now, t, 0)
+        m = storage.get_match(store, 1, 0, 0)
+        stale = m.model_copy()
+        submit_move(store, now, m.id, m.user0, 0, Gesture.ROCK, '0x')
+        submit_move(store, now, m.id, m.user1, 0, Gesture.PAPER, '0x')
+
+        m, _ = update_match_result(store, now, 0, m)
+        assert m.result == Result.PLAYED
+        stats = storage.get_round_stats(store, 1, 0)
+        state = storage.get_state(store, 1)
+        assert (stats.settled, stats.eliminated, state.settled, state.remaining) == (1, 1, 1, 7)
+
+        update_match_result(store, now + 5, 0, stale)
+        update_match_result(store, now + 5, 0, storage.get_match(store, 1, 0, 0))
+        stats2 = storage.get_round_stats(store, 1, 0)
+        state2 = storage.get_state(store, 1)
+        assert (stats2.pending, stats2.settled, stats2.played, stats2.eliminated) == (
+            stats.pending, stats.settled, stats.played, stats.eliminated)
+        assert (state2.settled, state2.pending, state2.remaining) == (state.settled, state.pending, state.remaining)
+        assert storage.get_match(store, 1, 0, 0).updated.timestamp() == T0 + 60
+
+
+class _Query(object):
+    # records postgrest calls and serves canned rows per table, or per (table, first call)
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args))
+            return self
+        return call
+
+    def execute(self):
+        self.client.requests.append((self.table, self.calls))
+        rows = self.client.rows.get((self.table, self.calls[0][0]), self.client.rows.get(self.table, []))
+        return type('Response', (object,), {'data': rows})()
+
+
+class _Client(object):
+    def __init__(self, rows: dict):
+        self.rows = rows
+        self.requests = []
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+
+class TestStoreInterface(object):
+    def test_incomplete(self):
+        # a backend missing part of the interface fails when created, not mid request
+        class Partial(Store):
+            def get_match(self, tournament: int, round_: int, slot: int) -> Match:
+                return None
+
+        with pytest.raises(TypeError):
+            Partial()
+
+
+class TestSupabaseQueries(object):
+    def test_match_last(self):
+        m = _match(2, 1, 4, 9)
+        client = _Client({'player': [{'last': m.model_dump(mode='json')}]})
+        assert storage.get_match_last(client, 1, 4).id == m.id
+        assert len(client.requests) == 1
+        table, calls = client.requests[0]
+        assert table == 'player'
+        assert calls[0] == ('select', ('last:match(*)',))
+
+    def test_moves_conflict(self):
+        # upsert returns only inserted rows, the rest are read back and compared
+        moves = [Move(id='', created=T0, match='1_0_0', user=u, turn=0, move=Gesture.ROCK, signature='0x')
+                 for u in (1, 2, 3)]
+        stored = [moves[1].model_copy(update={'id': '1_0_0_2_0'}),
+                  moves[2].model_copy(update={'id': '1_0_0_3_0', 'move': Gesture.PAPER})]
+        client = _Client({
+            ('move', 'upsert'): [moves[0].model_copy(update={'id': '1_0_0_1_0'}).model_dump(mode='json')],
+            ('move', 'select'): [m.model_dump(mode='json') for m in stored]
+        })
+        assert [m.id for m in storage.set_moves(client, moves)] == ['1_0_0_3_0']
+        assert [t for t, _ in client.requests] == ['move', 'move']
+
+    def test_match_last_unindexed(self):
+        m = _match(2, 1, 4, 9)
+        client = _Client({'match': [m.model_dump(mode='json')]})
+        assert storage.get_match_last(client, 1, 4).id == m.id
+        assert [t for t, _ in client.requests] == ['player', 'match']
@@ -4,9 +4,22 @@ test cases for tournament logic utilities
 
 # lib
 import pytest
+import numpy as np
 
 # src
-from api.rps import current_round, round_size, match_slot, parent_slots, current_round_end
+from api.rps import (
+    current_round,
+    round_size,
+    match_slot,
+    parent_slots,
+    current_round_end,
+    round_pairings,
+    create_round,
+    remaining_users,
+    round_stats_from_matches,
+    match_players
+)
+from api.models import Result
 
 
 class TestCurrentRound(object):
@@ -260,3 +273,104 @@ class TestParentSlots(object):
     def test_final_invalid(self):
         with pytest.raises(ValueError):
             parent_slots(64, 5, 1)
+
+
+class TestRoundPairings(object):
+
+    def test_first(self):
+        fid0, fid1 = round_pairings(64, 0)
+        assert len(fid0) == 32
+        assert fid0[0] == 1
+        assert fid1[0] == 64
+        assert fid0[8] == 9
+        assert fid1[8] == 56
+        assert fid0[31] == 32
+        assert fid1[31] == 33
+
+    def test_first_uneven(self):
+        fid0, fid1 = round_pairings(50, 0)
+        assert len(fid0) == 32
+        assert fid0[0] == 1
+        assert fid1[0] == 0  # bye
+        assert fid0[13] == 14
+        assert fid1[13] == 0  # 51, bye
+        assert fid0[14] == 15
+        assert fid1[14] == 50
+
+    def test_first_matches_slot(self):
+        fid0, fid1 = round_pairings(50, 0)
+        for slot, (u0, u1) in enumerate(zip(fid0, fid1)):
+            assert match_slot(50, 0, int(u0)) == slot
+            if u1:
+                assert match_slot(50, 0, int(u1)) == slot
+
+    def test_second(self):
+        winners = np.arange(1, 33)  # top seeds all advance
+        fid0, fid1 = round_pairings(64, 1, winners)
+        assert len(fid0) == 16
+        for slot in range(16):
+            a, b = parent_slots(64, 1, slot)
+            assert fid0[slot] == winners[a]
+            assert fid1[slot] == winners[b]
+
+    def test_second_invalid(self):
+        with pytest.raises(ValueError):
+            round_pairings(64, 1, np.arange(1, 17))
+
+    def test_create_byes(self):
+        matches = create_round(0, 1, 50, 0)
+        assert len(matches) == 32
+        assert matches[0].id == '1_0_0'
+        assert matches[0].result == Result.BYE
+        assert matches[0].winner == 1
+        assert matches[0].loser == 0
+        assert matches[14].result == Result.PENDING
+        assert matches[14].user0 == 15
+        assert matches[14].user1 == 50
+        assert matches[14].winner is None
+
+
+class TestRoundStats(object):
+    def test_first(self):
+        matches = create_round(0, 1, 50, 0)
+        matches[14].winner = 15
+        matches[14].loser = 50
+        matches[14].result = Result.PLAYED
+        matches[15].winner = 16
+        matches[15].loser = 49
+        matches[15].result = Result.FORFEIT
+
+        stats = round_stats_from_matches(0, 1, 0, matches)
+
+        assert stats.id == '1_0'
+        assert stats.matches == 32
+        assert stats.settled == 16  # 14 byes + 2
+        assert stats.pending == 16
+        assert stats.played == 1
+        assert stats.eliminated == 2
+
+    def test_remaining_first(self):
+        assert remaining_users(50, 0, 0) == 50
+        assert remaining_users(50, 0, 2) == 48
+
+    def test_remaining_later(self):
+        assert remaining_users(50, 1, 0) == 32
+        assert remaining_users(50, 1, 16) == 16
+
+
+class TestMatchPlayers(object):
+    def test_index(self):
+        matches = create_round(0, 1, 6, 0)
+        matches[2].winner = 3
+        matches[2].loser = 6
+        matches[2].result = Result.PLAYED
+
+        players = {p.fid: p for p in match_players(0, matches)}
+
+        assert sorted(players.keys()) == [1, 2, 3, 4, 5, 6]  # no entry for bye
+        assert players[1].match == '1_0_0'
+        assert players[1].alive  # bye
+        assert players[6].id == '1_6'
+        assert players[6].match == '1_0_2'
+        assert not players[6].alive
+        assert players[3].alive